@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+""" Checkpoints for long-running experiments.
+
+    Completed steps (iterations, benchmark pairs, ...) are appended to a
+    file as they finish. When the same test is restarted with the same
+    file, finished steps are not executed again.
+"""
+
+from os.path import exists
+import pickle
+import os
+
+
+class Error(Exception):
+  """ Generic class for all errors of this module. """
+
+
+class Checkpoint:
+  def __init__(self, path, spec):
+    self.path = path
+    self.spec = spec
+    self.steps = {}
+    if exists(path):
+      self.load()
+      print("resuming {spec} from {path}: {num} steps done"
+            .format(spec=spec, path=path, num=len(self.steps)))
+      self.fd = open(path, 'ab')
+    else:
+      self.fd = open(path, 'ab')
+      self.dump({'spec': spec})
+
+  def load(self):
+    with open(self.path, 'rb') as fd:
+      header = pickle.load(fd)
+      if header.get('spec') != self.spec:
+        raise Error("checkpoint {path} is for {other!r}, not for {spec!r}"
+                    .format(path=self.path, other=header.get('spec'), spec=self.spec))
+      good = fd.tell()
+      while True:
+        try:
+          key, value = pickle.load(fd)
+        except EOFError:
+          break
+        except (pickle.UnpicklingError, ValueError):
+          break  # the last record was not written completely
+        self.steps[key] = value
+        good = fd.tell()
+    # drop a partially written record, if any
+    os.truncate(self.path, good)
+
+  def dump(self, record):
+    pickle.dump(record, self.fd)
+    self.fd.flush()
+    os.fsync(self.fd.fileno())
+
+  def __contains__(self, key):
+    return key in self.steps
+
+  def __getitem__(self, key):
+    return self.steps[key]
+
+  def save(self, key, value):
+    self.steps[key] = value
+    self.dump((key, value))
+
+  def run(self, key, f, *args, **kwargs):
+    """ Call f unless the step is already done, returns its (saved) result. """
+    if key in self.steps:
+      print("step %s is already done, skipping" % (key,))
+      return self.steps[key]
+    value = f(*args, **kwargs)
+    self.save(key, value)
+    return value
+
+  def close(self):
+    self.fd.close()
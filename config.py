@@ -18,7 +18,7 @@ HOSTNAME = gethostname()
 WARMUP_TIME = 10
 IDLENESS = 45
 MEASURE_TIME = 180
-BOOT_TIME = 10
+BOOT_TIME = 10  # upper limit, boot is detected with ready.wait_booted()
 setrlimit(RLIMIT_NOFILE, (10240, 10240))
 VMS = []
 
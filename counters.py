@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+""" Persistent counter sessions.
+
+    Instead of forking perf for every sample, a session attaches to a pid
+    once and then is read repeatedly. Measurements are deltas between two
+    reads of cumulative counters.
+"""
+
+from perf.perftool import NotCountedError
+from perfstream import parse
+
+from subprocess import Popen, DEVNULL, PIPE
+from threading import Thread, Lock
+from collections import defaultdict
+import signal
+import shlex
+import time
+
+
+PERF = "/home/sources/perf_lite"
+EVENTS = ['cycles', 'instructions']
+
+
+class Source:
+  """ Base class for counter sources.
+      A source provides cumulative counters for a set of events.
+  """
+  resolution = 0.001  # how often counters change, in seconds
+
+  def open(self, pid, events):
+    raise NotImplementedError
+
+  def read(self):
+    """ Returns (timestamp, {event: cumulative count}). """
+    raise NotImplementedError
+
+  def close(self):
+    pass
+
+
+class PerfSource(Source):
+  """ Long-running `perf kvm stat -I` process, its output is
+      parsed and accumulated by a reader thread.
+  """
+  CMD = "{perf} kvm stat -e {events} -x, -I {subinterval} -p {pid}"
+
+  def __init__(self, subinterval=10, perf=PERF):
+    self.subinterval = subinterval
+    self.resolution = subinterval / 1000
+    self.perf = perf
+    self.lock = Lock()
+    self.pipe = None
+
+  def open(self, pid, events):
+    self.events = events
+    self.totals = dict.fromkeys(events, 0)
+    self.tstamp = 0.0
+    cmd = self.CMD.format(perf=self.perf, pid=pid, events=",".join(events),
+                          subinterval=self.subinterval)
+    # perf writes statistics to stderr
+    self.pipe = Popen(shlex.split(cmd), stdout=DEVNULL, stderr=PIPE,
+                      universal_newlines=True)
+    self.reader = Thread(target=self._reader, daemon=True)
+    self.reader.start()
+
+  def _reader(self):
+    for interval in parse(self.pipe.stderr, self.events):
+      with self.lock:
+        for ev, cnt in interval.counts.items():
+          self.totals[ev] += cnt
+        self.tstamp = interval.time
+
+  def read(self):
+    if self.pipe is None or self.pipe.poll() is not None:
+      raise NotCountedError
+    with self.lock:
+      return self.tstamp, dict(self.totals)
+
+  def close(self):
+    if self.pipe is None:
+      return
+    if self.pipe.poll() is None:
+      self.pipe.send_signal(signal.SIGINT)
+      self.pipe.wait()
+    self.pipe = None
+
+
+class FakeSource(Source):
+  """ Counters that grow with constant rates (events per second).
+      Useful for testing without access to PMU.
+  """
+  def __init__(self, rates=None, clock=time.time):
+    self.rates = rates or {'cycles': 3*10**9, 'instructions': 2*10**9}
+    self.clock = clock
+
+  def open(self, pid, events):
+    self.events = events
+    self.started = self.clock()
+
+  def read(self):
+    ts = self.clock() - self.started
+    return ts, {ev: int(self.rates.get(ev, 0)*ts) for ev in self.events}
+
+
+class CounterSession:
+  """ Counters attached to a single pid. """
+
+  def __init__(self, pid, events=EVENTS, source=None, sleep=time.sleep):
+    self.pid = pid
+    self.events = list(events)
+    self.source = source or PerfSource()
+    self.sleep = sleep  # time comes from the source
+    self.opened = False
+
+  def open(self):
+    if not self.opened:
+      self.source.open(self.pid, self.events)
+      self.opened = True
+    return self
+
+  def close(self):
+    if self.opened:
+      self.source.close()
+      self.opened = False
+
+  def __enter__(self):
+    return self.open()
+
+  def __exit__(self, *args):
+    self.close()
+
+  def read(self):
+    return self.source.read()
+
+  def _wait(self, since):
+    """ Wait until counters advance past `since` seconds. """
+    poll = self.source.resolution
+    while True:
+      ts, counts = self.read()
+      if ts >= since - 1e-6:  # timestamps are sums of floats
+        return ts, counts
+      self.sleep(max(since - ts, poll))
+
+  def measure(self, interval, events=None):
+    """ Delta of counters over interval (in ms). """
+    t0, c0 = self.read()
+    self.sleep(interval / 1000)
+    _, c1 = self._wait(t0 + interval / 1000)
+    return {ev: c1[ev] - c0[ev] for ev in events or self.events}
+
+  def subsample(self, interval, subinterval):
+    """ Per-subinterval deltas, the same format as qemu.ipcistat.
+        subinterval (in ms) cannot be finer than the source resolution.
+    """
+    assert subinterval / 1000 >= self.source.resolution, \
+        "subinterval %sms is finer than the source resolution %ss" % (subinterval, self.source.resolution)
+    r = defaultdict(list)
+    start, prev = self.read()
+    # boundaries are counted from the start, so that errors do not add up
+    for i in range(1, round(interval / subinterval) + 1):
+      _, cur = self._wait(start + i * subinterval / 1000)
+      for ev in self.events:
+        r[ev].append(cur[ev] - prev[ev])
+      prev = cur
+    return r
+
+  def ipc(self, interval):
+    r = self.measure(interval, ['instructions', 'cycles'])
+    if not r['instructions'] or not r['cycles']:
+      raise NotCountedError
+    return r['instructions'] / r['cycles']
+
+
+def attach(vm, events=EVENTS, source=None):
+  """ Attach a session to the VM and route vm.ipcstat and vm.stat through it. """
+  session = CounterSession(vm.pid, events=events, source=source).open()
+  orig_stat = vm.stat
+
+  def ipcstat(interval, raw=False):
+    if raw:
+      return session.measure(interval, ['instructions', 'cycles'])
+    return session.ipc(interval)
+
+  def stat(interval, events=None):
+    if events and not set(events) <= set(session.events):
+      return orig_stat(interval=interval, events=events)
+    r = session.measure(interval, events)
+    if not any(r.values()):
+      raise NotCountedError
+    return r
+
+  vm.counters = session
+  vm.ipcstat = ipcstat
+  vm.stat = stat
+  return session
+
+
+def detach(vm):
+  """ Close VM session and restore original methods. """
+  session = getattr(vm, 'counters', None)
+  if session is None:
+    return
+  session.close()
+  for attr in ['counters', 'ipcstat', 'stat']:
+    vm.__dict__.pop(attr, None)
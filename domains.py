@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+""" Shared-resource domains: CPUs that share last level cache (and hence a
+    memory controller on our hosts). VMs in different domains do not
+    interfere much and can be measured concurrently.
+"""
+
+from perf.numa import topology
+
+import os
+
+
+SYSFS_CPU = "/sys/devices/system/cpu/cpu{cpu}/"
+
+
+def cpu_domain(cpu, sysfs=SYSFS_CPU):
+  """ Id of the LLC the cpu belongs to, falls back to the socket id. """
+  base = sysfs.format(cpu=cpu)
+  for path in ["cache/index3/id", "topology/physical_package_id"]:
+    try:
+      with open(base + path) as fd:
+        return int(fd.read())
+    except (OSError, ValueError):
+      continue
+  return 0
+
+
+def cpu_domains(cpus=None):
+  """ {cpu: domain} for all cpus of the host. """
+  if cpus is None:
+    cpus = topology.all
+  return {cpu: cpu_domain(cpu) for cpu in cpus}
+
+
+def vm_cpus(vm):
+  cpus = getattr(vm, 'cpus', None)
+  if cpus:
+    return list(cpus)
+  return sorted(os.sched_getaffinity(vm.pid))
+
+
+def group_by_domain(vms, mapping=None):
+  """ Split VMs into groups that do not share any domain.
+      A VM that spans several domains (e.g., not pinned) glues them together.
+  """
+  if mapping is None:
+    mapping = cpu_domains()
+  groups = []  # [(set of domains, [vms])]
+  for vm in vms:
+    doms = {mapping.get(cpu, 0) for cpu in vm_cpus(vm)}
+    members = [vm]
+    for group in [g for g in groups if g[0] & doms]:
+      groups.remove(group)
+      doms |= group[0]
+      members = group[1] + members
+    groups.append((doms, members))
+  # keep original order of VMs inside groups
+  order = {vm: i for i, vm in enumerate(vms)}
+  return [sorted(members, key=order.get) for _, members in groups]
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+""" Event group scheduler.
+
+    A PMU has only a few programmable counters. If more events are
+    requested the kernel multiplexes them and scaled counts get noisy.
+    Here events are split into groups that fit the counters, every group
+    also counts cycles, and groups take turns over the interval. A count
+    is extrapolated to the whole interval by the cycles it was measured
+    for, coverage tells which share of cycles that was.
+"""
+
+from perf.perftool import NotCountedError
+
+
+SLOTS = 4  # programmable counters per hardware thread
+ANCHOR = 'cycles'
+# events that do not occupy programmable counters
+FIXED = {'cycles', 'instructions', 'ref-cycles'}
+SOFTWARE = {'task-clock', 'cpu-clock', 'context-switches', 'cs', 'cpu-migrations',
+            'page-faults', 'minor-faults', 'major-faults', 'alignment-faults',
+            'emulation-faults'}
+
+
+class Counts(dict):
+  """ {event: count} with per-event coverage (0..1). """
+
+  def __init__(self, values=(), coverage=None):
+    super().__init__(values)
+    self.coverage = coverage or {}
+
+
+def schedule(events, slots=SLOTS, anchor=ANCHOR):
+  """ Split events into groups that fit `slots` counters.
+      Every group has the anchor event, free events are in all of them.
+  """
+  free = [ev for ev in events if ev in FIXED or ev in SOFTWARE]
+  if anchor not in free:
+    free.insert(0, anchor)
+  programmable = [ev for ev in events if ev not in free]
+  groups = [free + programmable[i:i+slots] for i in range(0, len(programmable), slots)]
+  return groups or [free]
+
+
+def measure(stat, events, interval, slots=SLOTS, rounds=10, anchor=ANCHOR):
+  """ Measure events with stat(interval=ms, events=[...]) -> {event: count}
+      rotating event groups `rounds` times over the interval (in ms).
+  """
+  groups = schedule(events, slots, anchor)
+  if len(groups) == 1:
+    rounds = 1
+  piece = interval / (rounds * len(groups))
+  sums = {ev: 0 for group in groups for ev in group}
+  cycles = dict.fromkeys(sums, 0)  # anchor counts while an event was counted
+  total = 0
+  for _ in range(rounds):
+    for group in groups:
+      try:
+        r = stat(interval=piece, events=group)
+      except NotCountedError:
+        continue
+      total += r[anchor]
+      for ev in group:
+        sums[ev] += r[ev]
+        cycles[ev] += r[anchor]
+  if not total:
+    raise NotCountedError
+  values, coverage = {}, {}
+  for ev in events:
+    coverage[ev] = cycles[ev] / total
+    values[ev] = sums[ev] * total / cycles[ev] if cycles[ev] else None
+  return Counts(values, coverage)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+""" cgroup v2 freezer backend.
+
+    All co-runners are kept in one cgroup ("pool"). The task that needs
+    exclusive access is moved to a sibling cgroup ("solo") and the pool is
+    frozen with a single write to cgroup.freeze, no matter how many
+    co-runners there are.
+"""
+
+from os.path import join, exists
+import time
+import os
+
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+
+class Error(Exception):
+  """ Generic class for all errors of this module. """
+
+
+class Timeout(Error):
+  """ cgroup did not reach the requested state in time. """
+
+
+def write(path, value):
+  with open(path, 'wt') as fd:
+    fd.write(str(value))
+
+
+class CgroupFreezer:
+  def __init__(self, root=CGROUP_ROOT, name="perforator", timeout=1.0):
+    self.root = root
+    self.path = join(root, name)
+    self.pool = join(self.path, "pool")
+    self.solo = join(self.path, "solo")
+    self.timeout = timeout
+    self.pids = []
+    self.solo_pid = None
+    for path in [self.path, self.pool, self.solo]:
+      os.makedirs(path, exist_ok=True)
+
+  def add(self, pid):
+    """ Put process (with all its threads) to the pool of co-runners. """
+    write(join(self.pool, "cgroup.procs"), pid)
+    self.pids.append(pid)
+
+  def attach(self, vms):
+    """ Route vm.exclusive() and vm.shared() through the freezer. """
+    for vm in vms:
+      self.add(vm.pid)
+      vm.exclusive = lambda vm=vm: self.exclusive(vm.pid)
+      vm.shared = lambda vm=vm: self.shared()
+
+  def frozen(self):
+    """ True when the kernel reports that all pool tasks are stopped. """
+    events = join(self.pool, "cgroup.events")
+    if not exists(events):
+      # not a real cgroupfs: freezing completes immediately
+      with open(join(self.pool, "cgroup.freeze")) as fd:
+        return fd.read().strip() == "1"
+    with open(events) as fd:
+      for line in fd:
+        key, value = line.split()
+        if key == 'frozen':
+          return value == "1"
+    return False
+
+  def wait(self, frozen, poll=0.0001):
+    """ Wait for freeze (or thaw) to complete, returns how long it took. """
+    t = time.time()
+    deadline = t + self.timeout
+    while self.frozen() != frozen:
+      if time.time() > deadline:
+        raise Timeout("pool is not %s after %ss" % ("frozen" if frozen else "thawed", self.timeout))
+      time.sleep(poll)
+    return time.time() - t
+
+  def exclusive(self, pid):
+    """ Freeze everybody except pid. Returns the latency of the whole
+        operation, i.e. the time till the freeze has actually completed.
+    """
+    t = time.time()
+    if self.solo_pid is not None:
+      self.shared()
+    write(join(self.solo, "cgroup.procs"), pid)
+    self.solo_pid = pid
+    write(join(self.pool, "cgroup.freeze"), 1)
+    self.wait(frozen=True)
+    return time.time() - t
+
+  def shared(self):
+    """ Thaw the pool and return the exclusive task to it. """
+    t = time.time()
+    write(join(self.pool, "cgroup.freeze"), 0)
+    self.wait(frozen=False)
+    if self.solo_pid is not None:
+      write(join(self.pool, "cgroup.procs"), self.solo_pid)
+      self.solo_pid = None
+    return time.time() - t
+
+  def release(self):
+    """ Thaw everything and move processes back to the root cgroup. """
+    self.shared()
+    for pid in self.pids:
+      try:
+        write(join(self.root, "cgroup.procs"), pid)
+      except ProcessLookupError:
+        pass  # process is already dead
+    self.pids = []
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+""" Freeze governor.
+
+    To measure a VM in isolation the samplers freeze its co-runners,
+    and every such window is a stall for them. When all freezes go
+    through the governor, it keeps frozen time of every VM over a
+    sliding window and delays (or rejects) freezes that would make
+    any VM exceed its budget, e.g. 0.05 is "no more than 5% of time".
+"""
+
+from collections import defaultdict, deque
+from threading import RLock
+import json
+import time
+
+
+class Error(Exception):
+  """ Generic class for all errors of this module. """
+
+
+class Rejected(Error):
+  """ The freeze would exceed the budget. """
+
+
+class Governor:
+  def __init__(self, budget=0.05, window=60, policy='delay', maxdelay=None,
+               clock=time.time, sleep=time.sleep):
+    assert policy in ('delay', 'reject'), "unknown policy %s" % policy
+    self.budget = budget
+    self.window = window
+    self.policy = policy
+    self.maxdelay = maxdelay or window
+    self.clock = clock
+    self.sleep = sleep
+    self.lock = RLock()  # samplers may run in several threads
+    self.history = defaultdict(deque)  # vm -> [(start, end)] of past freezes
+    self.since = {}  # vm -> when it was frozen, for VMs frozen now
+    self.total = defaultdict(float)  # vm -> total frozen time
+    self.requests = 0
+    self.delayed = 0
+    self.rejected = 0
+    self.waited = 0.0
+
+  def used(self, vm, at):
+    """ Frozen time of vm in the window ending at `at`. """
+    start = at - self.window
+    r = sum(min(e, at) - max(s, start) for s, e in self.history[vm] if e > start)
+    if vm in self.since:
+      r += at - max(self.since[vm], start)
+    return r
+
+  def fits(self, vms, at, duration):
+    limit = self.budget * self.window
+    return all(self.used(vm, at) + duration <= limit for vm in vms)
+
+  def delay(self, vms, duration):
+    """ How long to wait until vms can be frozen for `duration` seconds.
+        None if it is not possible at all.
+    """
+    if duration > self.budget * self.window:
+      return None
+    now = self.clock()
+    if self.fits(vms, now, duration):
+      return 0
+    if any(vm in self.since for vm in vms):
+      return None  # waiting does not help those who are frozen now
+    # the past freezes slide out of the window, so it fits eventually
+    lo, hi = 0, self.window
+    while hi - lo > 0.001:
+      mid = (lo + hi) / 2
+      if self.fits(vms, now + mid, duration):
+        hi = mid
+      else:
+        lo = mid
+    return hi
+
+  def freeze(self, vms, duration=0):
+    """ Ask permission to freeze vms for about `duration` seconds.
+        Waits if needed, raises Rejected if it is not allowed.
+        The caller freezes VMs itself and calls unfreeze() afterwards.
+    """
+    waited = 0
+    while True:
+      with self.lock:
+        delay = self.delay(vms, duration)
+        if delay is None or waited + delay > self.maxdelay or (delay and self.policy == 'reject'):
+          self.requests += 1
+          self.rejected += 1
+          raise Rejected("freezing %s for %.3fs would exceed the budget" % (vms, duration))
+        if not delay:
+          self.requests += 1
+          self.delayed += bool(waited)
+          self.waited += waited
+          now = self.clock()
+          for vm in vms:
+            self.since.setdefault(vm, now)
+          return
+      # other threads may freeze their VMs meanwhile
+      self.sleep(delay)
+      waited += delay
+
+  def unfreeze(self, vms):
+    with self.lock:
+      now = self.clock()
+      for vm in vms:
+        if vm not in self.since:
+          continue
+        start = self.since.pop(vm)
+        self.total[vm] += now - start
+        history = self.history[vm]
+        history.append((start, now))
+        while history and history[0][1] < now - self.window:
+          history.popleft()
+
+  def stats(self):
+    now = self.clock()
+    vms = set(self.history) | set(self.since)
+    return dict(budget=self.budget, window=self.window, policy=self.policy,
+                requests=self.requests, delayed=self.delayed,
+                rejected=self.rejected, waited=self.waited,
+                frozen={str(vm): dict(total=self.total[vm],
+                                      window=self.used(vm, now) / self.window)
+                        for vm in vms})
+
+  def report(self):
+    stats = self.stats()
+    print("governor: {requests} freezes, {delayed} delayed for {waited:.1f}s in total,"
+          " {rejected} rejected".format(**stats))
+    for vm, frozen in sorted(stats['frozen'].items()):
+      print("  {vm}: frozen {total:.1f}s, {window:.1%} of the last {w}s (budget {b:.1%})"
+            .format(vm=vm, w=self.window, b=self.budget, **frozen))
+
+  def export(self, path):
+    with open(path, 'wt') as fd:
+      json.dump(self.stats(), fd, indent=1, sort_keys=True)
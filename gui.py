@@ -4,11 +4,10 @@ from collections import defaultdict, deque
 from threading import Thread, Event
 from subprocess import DEVNULL
 from statistics import mean
+import atexit
 import time
 import sys
 
-import psutil
-
 from libgui import Border, Bars, Bar, String, \
   Button, Canvas, XY, Text, CMDInput, VList, \
   HList, Range, mywrapper, loop, t
@@ -19,6 +18,9 @@ from useful.small import readfd, nsplit
 from useful.log import Log
 
 from config import VMS, log, basis as bench_cmd
+from procfs import ProcSampler
+from ring import Ring
+from governor import Governor, Rejected
 
 
 def dictsum(l, key):
@@ -34,7 +36,7 @@ class Stat:
     self.cpu = deque(maxlen=self.maxlen)
     self.cpubar = cpubar
     self.ipcbar = ipcbar
-    self.process = psutil.Process(pid)
+    self.pid = pid
 
   def update_bars(self):
     ipc = self.get_shared_ipc()
@@ -53,46 +55,69 @@ class Stat:
 class Collector(Thread):
   """ 1. Profile tasks
       1. Update bars and stats
+      With a governor, VMs are really isolated while measuring
+      isolated performance, within the governor's freeze budget.
+      With a ring, samples are also published to other processes.
   """
-  def __init__(self, vms, stat, ev):
+  FIELDS = ['cpu', 'isolated_instructions', 'isolated_cycles',
+            'shared_instructions', 'shared_cycles']
+
+  def __init__(self, vms, stat, ev, governor=None, ring=None):
     super().__init__()
     self.stat = stat
     self.vms = vms
     self.ev = ev
+    self.governor = governor
+    self.ring = ring
+    self.sampler = ProcSampler(vm.pid for vm in vms)
 
   def run(self, measure_time=0.1, interval=0.9):
     stat = self.stat
     vms  = self.vms
     ev   = self.ev
+    governor = self.governor
+    ring = self.ring
+    self.sampler.sample()
     while True:
       ev.wait()
       time.sleep(interval)
-      for vm in vms:
-        # measure CPU
+      # measure CPU of all VMs at once
+      usage = self.sampler.sample()
+      for key, vm in enumerate(vms):
         vmstat = stat[vm]
-        cpu = vmstat.process.cpu_percent()
-        vmstat.cpu.append(cpu)
+        vmstat.cpu.append(usage.get(vm.pid, 0))
+        sample = [vmstat.cpu[-1]] + [float('nan')] * 4
 
+        others = [other for other in vms if other != vm]
         try:
-          #vm.exclusive()
-          isolated = vm.ipcstat(measure_time, raw=True)
-          vmstat.isolated.append(isolated)
+          try:
+            if governor:
+              governor.freeze(others, measure_time)
+              vm.exclusive()
+            isolated = vm.ipcstat(measure_time, raw=True)
+            vmstat.isolated.append(isolated)
+            sample[1:3] = isolated['instructions'], isolated['cycles']
+          finally:
+            # co-runners are frozen only while isolated performance is measured
+            vm.shared()
+            if governor:
+              governor.unfreeze(others)
 
           time.sleep(interval)
 
-          vm.shared()
           shared = vm.ipcstat(measure_time, raw=True)
           vmstat.shared.append(shared)
-        except NotCountedError:
+          sample[3:5] = shared['instructions'], shared['cycles']
+        except (NotCountedError, Rejected):
           pass
-        finally:
-          vm.shared()
+        if ring:
+          ring.write(key, sample)
       for st in stat.values():
         st.update_bars()
 
 
 @mywrapper
-def gui():
+def gui(budget=None, ring=None):
   num_cores = len(topology.all)
   prof_ev = Event()
   prof_ev.set()
@@ -175,9 +200,17 @@ def gui():
     elif s == 'redraw':
       root.canvas.clear()
       root.draw()
+    elif s == 'governor' and governor:
+      stats = governor.stats()
+      logwin.println("{requests} freezes, {delayed} delayed, {rejected} rejected".format(**stats))
   root['cmdinpt'].cb = cmdcb
 
-  collector = Collector(vms=VMS, stat=stat, ev=prof_ev)
+  governor = Governor(budget) if budget else None
+  if ring:
+    ring = Ring.create(ring, keys=[str(vm) for vm in VMS], fields=Collector.FIELDS)
+    # readers that have it open keep their mapping, the name is freed
+    atexit.register(ring.unlink)
+  collector = Collector(vms=VMS, stat=stat, ev=prof_ev, governor=governor, ring=ring)
   collector.daemon = True
   collector.start()
 
@@ -187,4 +220,11 @@ def gui():
 
 
 if __name__ == '__main__':
-  gui()
+  import argparse
+  parser = argparse.ArgumentParser(description='Per-VM performance monitor')
+  parser.add_argument('-g', '--governor', type=float, default=None,
+                      help='measure isolated performance freezing VMs no more than this fraction of time')
+  parser.add_argument('-r', '--ring', default=None,
+                      help='publish samples to a shared-memory ring with this name, see ring.py')
+  args = parser.parse_args()
+  gui(budget=args.governor, ring=args.ring)
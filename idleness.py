@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+""" Idleness detector.
+
+    Samples per-CPU counters from /proc/stat at a fixed rate, keeps a
+    sliding window of host load and returns as soon as the load averaged
+    over the window is below the threshold.
+"""
+
+from collections import deque
+import time
+
+
+def read_cpu_ticks(path="/proc/stat"):
+  """ {cpu: (busy, total)} in clock ticks. """
+  r = {}
+  with open(path) as fd:
+    for line in fd:
+      if not line.startswith('cpu') or line.startswith('cpu '):
+        continue
+      name, *fields = line.split()
+      ticks = [int(f) for f in fields]
+      idle = ticks[3] + ticks[4]  # idle + iowait
+      total = sum(ticks[:8])      # guest time is already included in user
+      r[name] = (total - idle, total)
+  return r
+
+
+class IdleMonitor:
+  def __init__(self, rate=0.1, path="/proc/stat", clock=time.time, sleep=time.sleep):
+    self.rate = rate
+    self.path = path
+    self.clock = clock
+    self.sleep = sleep
+    self.waited = 0.0  # total time spent waiting
+    self.calls = 0
+
+  def load(self, prev, cur):
+    """ Sum of per-CPU loads in percent (100% is one fully loaded core). """
+    load = 0
+    for cpu, (busy, total) in cur.items():
+      pbusy, ptotal = prev.get(cpu, (busy, total))
+      if total > ptotal:
+        load += (busy - pbusy) / (total - ptotal) * 100
+    return load
+
+  def wait(self, threshold, period=1, timeout=None):
+    """ Wait until load averaged over the last `period` seconds
+        is below threshold. Returns how long it waited.
+    """
+    start = self.clock()
+    window = deque()  # (timestamp, load)
+    prev = read_cpu_ticks(self.path)
+    while True:
+      self.sleep(self.rate)
+      now = self.clock()
+      cur = read_cpu_ticks(self.path)
+      window.append((now, self.load(prev, cur)))
+      prev = cur
+      while window[0][0] <= now - period:
+        window.popleft()
+      average = sum(l for _, l in window) / len(window)
+      if now - start >= period and average < threshold:
+        break
+      if timeout and now - start > timeout:
+        print("host is still busy ({:.0f}% > {}%) after {}s, giving up"
+              .format(average, threshold, timeout))
+        break
+    waited = self.clock() - start
+    self.waited += waited
+    self.calls += 1
+    return waited
+
+  def report(self):
+    print("waited for idleness {calls} times, {waited:.1f}s in total"
+          .format(calls=self.calls, waited=self.waited))
+
+
+monitor = IdleMonitor()
+
+
+def wait_idleness(threshold, t=1, timeout=None):
+  """ Drop-in replacement for perf.utils.wait_idleness(). """
+  return monitor.wait(threshold, period=t, timeout=timeout)
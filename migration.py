@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+""" Cost of relocating a VM with set_cpus().
+
+    A migrated VM runs with cold caches for a while. Its IPC is sampled
+    with high-frequency subintervals right after the move and compared to
+    the steady state it reaches on the new cpus (the tail of the curve).
+    IPC before the move is not the reference: the new cpus may be more
+    or less contended than the old ones, that is not a migration cost.
+    The cost is the amount of work lost while recovering, in seconds of
+    the VM's normal execution.
+"""
+
+from subsamples import Subsamples
+from statistics import mean
+import numpy as np
+
+
+def ipc_series(r):
+  """ IPC per subinterval, None where nothing was counted. """
+  ipc = Subsamples.from_columns(r, ['instructions', 'cycles']).ipc()
+  return [None if np.isnan(x) else float(x) for x in ipc]
+
+
+def mean_ipc(r):
+  """ IPC over the whole interval, NotCountedError if no subinterval
+      has both counters (NumPy would divide to nan without raising).
+  """
+  from perf.perftool import NotCountedError
+  ipc = Subsamples.from_columns(r, ['instructions', 'cycles']).total_ipc()
+  if ipc is None:
+    raise NotCountedError
+  return float(ipc)
+
+
+def recovery(curve, subinterval, level=0.95, tail=0.25):
+  """ (cost, recovery time, steady IPC) of a recovery curve, times in
+      seconds. The steady IPC is the mean of the last `tail` of the curve.
+      The VM is considered recovered when IPC averaged over 5
+      subintervals reaches `level` of it.
+  """
+  dt = subinterval / 1000
+  points = [ipc for ipc in curve if ipc is not None]
+  steady = mean(points[-max(1, int(len(points) * tail)):])
+  recovered = len(points)
+  for pos in range(len(points)):
+    window = points[pos:pos+5]
+    if mean(window) >= level * steady:
+      recovered = pos
+      break
+  cost = sum(max(0, 1 - ipc / steady) for ipc in points[:recovered]) * dt
+  return cost, recovered * dt, steady
+
+
+def migrate(vm, cpus, interval=2000, subinterval=10, before=500, cache=None, result=None,
+            pin=None):
+  """ vm.set_cpus(cpus) (or pin(cpus)) that measures what the move cost.
+      The cost is saved to PairCache (per benchmark) and the recovery
+      curve is appended to result[vm] if given.
+  """
+  from qemu import ipcistat  # lazy loading
+  from perf.perftool import NotCountedError
+  pin = pin or vm.set_cpus
+  curve = None
+  try:
+    baseline = mean_ipc(ipcistat(vm, interval=before, subinterval=subinterval))
+  except NotCountedError:
+    baseline = None
+  pin(cpus)
+  if baseline is not None:
+    try:
+      curve = ipc_series(ipcistat(vm, interval=interval, subinterval=subinterval))
+    except NotCountedError:
+      pass
+  if not curve or all(ipc is None for ipc in curve):
+    print("cannot measure migration of", vm)
+    return None
+  cost, recovered, steady = recovery(curve, subinterval)
+  print("{vm} ({bench}) moved to {cpus}: lost {cost:.3f}s, recovered in {rec:.3f}s, ipc {old:.3f} -> {new:.3f}"
+        .format(vm=vm, bench=vm.bname, cpus=cpus, cost=cost, rec=recovered,
+                old=baseline, new=steady))
+  if cache is not None:
+    cache.put_migration(vm.bname, cost, recovered)
+  if result is not None:
+    result[vm].append(dict(ipc=[ipc or 0 for ipc in curve], baseline=baseline,
+                           steady=steady, cost=cost, recovery=recovered))
+  return cost
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+""" Memory placement on NUMA hosts.
+
+    set_cpus() and pin() change CPU affinity only: memory of a task moved
+    to another socket stays on the old node and most accesses become
+    remote. Here the pages are moved to the node of the new cpus with
+    migrate_pages(2). New allocations follow the default (local) policy
+    and land on the new node by themselves.
+"""
+
+from perf.perftool import NotCountedError
+
+from os.path import exists
+import ctypes
+import os
+import platform
+
+
+SYSFS_NODE = "/sys/devices/system/node/"
+SYS_MIGRATE_PAGES = {'x86_64': 256, 'aarch64': 238, 'i686': 294}
+# loads served by any node and loads served by a remote node
+EVENTS = ['node-loads', 'node-load-misses']
+
+
+class Error(Exception):
+  """ Generic class for all errors of this module. """
+
+
+def parse_cpulist(s):
+  """ "0-3,8" -> [0, 1, 2, 3, 8] """
+  r = []
+  for chunk in s.strip().split(','):
+    if not chunk:
+      continue
+    first, _, last = chunk.partition('-')
+    r.extend(range(int(first), int(last or first) + 1))
+  return r
+
+
+def cpu_nodes(sysfs=SYSFS_NODE):
+  """ {cpu: node}, empty on hosts without NUMA support. """
+  r = {}
+  if not exists(sysfs):
+    return r
+  for name in os.listdir(sysfs):
+    if not name.startswith('node') or not name[4:].isdigit():
+      continue
+    with open(os.path.join(sysfs, name, "cpulist")) as fd:
+      for cpu in parse_cpulist(fd.read()):
+        r[cpu] = int(name[4:])
+  return r
+
+
+def nodemask(nodes, maxnode):
+  """ Node set as an array of unsigned longs for memory policy syscalls. """
+  bits = ctypes.sizeof(ctypes.c_ulong) * 8
+  mask = (ctypes.c_ulong * (maxnode // bits + 1))()
+  for node in nodes:
+    mask[node // bits] |= 1 << (node % bits)
+  return mask
+
+
+def migrate_pages(pid, old, new):
+  """ Move pages of pid from old nodes to new ones.
+      Returns the number of pages that were not moved.
+  """
+  nr = SYS_MIGRATE_PAGES.get(platform.machine())
+  if nr is None:
+    raise Error("migrate_pages is not known on %s" % platform.machine())
+  maxnode = max(set(old) | set(new)) + 1
+  libc = ctypes.CDLL(None, use_errno=True)
+  # the kernel reads maxnode-1 bits
+  r = libc.syscall(nr, pid, ctypes.c_ulong(maxnode + 1),
+                   nodemask(old, maxnode), nodemask(new, maxnode))
+  if r < 0:
+    raise Error("migrate_pages(%s): %s" % (pid, os.strerror(ctypes.get_errno())))
+  return r
+
+
+def follow(pid, cpus, nodes=None):
+  """ Move memory of pid to the nodes of cpus.
+      Returns the set of target nodes, empty if nothing was done.
+  """
+  if nodes is None:
+    nodes = cpu_nodes()
+  target = {nodes[cpu] for cpu in cpus if cpu in nodes}
+  other = set(nodes.values()) - target
+  if not target or not other:
+    return set()
+  left = migrate_pages(pid, other, target)
+  if left:
+    print("%s pages of %s were not moved to node %s" % (left, pid, target))
+  return target
+
+
+def remote_ratio(stat):
+  """ Share of loads served by a remote node. """
+  loads = stat.get('node-loads', 0)
+  return stat.get('node-load-misses', 0) / loads if loads else 0
+
+
+def measure(stat, interval):
+  """ stat() of EVENTS or None if there is no stat or it failed. """
+  if not stat:
+    return None
+  try:
+    return stat(interval=interval, events=EVENTS)
+  except NotCountedError:
+    return None
+
+
+def move(task, cpus, pin, stat=None, interval=1000):
+  """ pin(cpus) and move the memory of task.pid after it.
+      If stat(interval, events) is given, remote accesses are
+      measured before and after the move. A failed measurement only
+      skips the report, the task is moved anyway.
+      Returns (remote ratio before, after) or None.
+  """
+  before = measure(stat, interval)
+  pin(cpus)
+  target = follow(task.pid, cpus)
+  after = measure(stat, interval) if before is not None else None
+  if after is None:
+    return None
+  r = remote_ratio(before), remote_ratio(after)
+  print("{task} moved to {cpus} (node {node}): remote loads {:.1%} -> {:.1%}"
+        .format(*r, task=task, cpus=cpus, node=sorted(target) or "unchanged"))
+  return r
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+""" Persistent cache of pairwise interference measurements.
+
+    Every pair of benchmarks is measured once per host, placement mode
+    ('sibling' or 'distant') and measurement configuration. Results are
+    kept in a JSON index and reused by placement logic.
+"""
+
+from socket import gethostname
+from statistics import mean
+from os.path import exists
+from placement import pair_cost
+import json
+import math
+import time
+import os
+
+
+PATH = "results/interference.json"
+SEP = "|"
+
+
+class PairCache:
+  def __init__(self, path=PATH, host=None):
+    self.path = path
+    self.host = host or gethostname()
+    self.data = {}
+    if exists(path):
+      with open(path) as fd:
+        self.data = json.load(fd)
+
+  def save(self):
+    tmp = self.path + ".tmp"
+    with open(tmp, 'wt') as fd:
+      json.dump(self.data, fd, indent=1, sort_keys=True)
+    os.rename(tmp, self.path)
+
+  def key(self, mode, config, *benches):
+    """ host|mode|config|bench... """
+    fields = [self.host, mode, config or ""] + list(benches)
+    for field in fields:
+      assert SEP not in field, "%r cannot contain %r" % (field, SEP)
+    return SEP.join(fields)
+
+  @staticmethod
+  def parse(key):
+    """ (host, mode, config, [benches]) """
+    host, mode, config, *benches = key.split(SEP)
+    return host, mode, config, benches
+
+  def find(self, mode, config, *benches):
+    """ Exact match if config is given, otherwise the latest of any config. """
+    if config is not None:
+      return self.data.get(self.key(mode, config, *benches))
+    found = []
+    for k, v in self.data.items():
+      host, mode1, _, benches1 = self.parse(k)
+      if (host, mode1, benches1) == (self.host, mode, list(benches)):
+        found.append(v)
+    return max(found, key=lambda v: v['time'], default=None)
+
+  # PAIRS
+
+  def get(self, b1, b2, mode, config=None):
+    """ (ipc of b1, ipc of b2) when running together or None. """
+    r = self.find(mode, config, b1, b2)
+    if r:
+      return tuple(r['ipc'])
+    r = self.find(mode, config, b2, b1)
+    if r:
+      return tuple(reversed(r['ipc']))
+    return None
+
+  def put(self, b1, b2, mode, ipcs, config=""):
+    self.data[self.key(mode, config, b1, b2)] = dict(ipc=list(ipcs), time=time.time())
+    self.save()
+
+  # ISOLATED PERFORMANCE
+
+  def isolated(self, bench, config=None):
+    r = self.find('isolated', config, bench)
+    return r['ipc'] if r else None
+
+  def put_isolated(self, bench, ipc, config=""):
+    self.data[self.key('isolated', config, bench)] = dict(ipc=ipc, time=time.time())
+    self.save()
+
+  # MIGRATION COST
+
+  def migration(self, bench, config=None):
+    """ Mean cost of moving bench to other cpus, seconds of lost work. """
+    r = self.find('migration', config, bench)
+    return mean(r['cost']) if r else None
+
+  def put_migration(self, bench, cost, recovery, config=""):
+    assert math.isfinite(cost) and math.isfinite(recovery), \
+        "migration cost of %s is not finite: %s" % (bench, cost)
+    r = self.data.setdefault(self.key('migration', config, bench),
+                             dict(cost=[], recovery=[]))
+    r['cost'].append(cost)
+    r['recovery'].append(recovery)
+    r['time'] = time.time()
+    self.save()
+
+  def migrations(self, tasks, name=lambda t: t.bname):
+    """ Known migration costs {task: seconds} for placement. """
+    r = {}
+    for task in tasks:
+      cost = self.migration(name(task))
+      if cost is not None:
+        r[task] = cost
+    return r
+
+  # QUERIES
+
+  def slowdown(self, victim, aggressor, mode='sibling'):
+    """ Performance of victim next to aggressor relative to isolation. """
+    pair = self.get(victim, aggressor, mode)
+    alone = self.isolated(victim)
+    if not pair or not alone:
+      return None
+    return pair[0] / alone
+
+  def pairs(self, tasks, mode='sibling', name=lambda t: t.bname):
+    """ Interference costs {(a,b): loss} for placement.solve(),
+        on the same scale as placement.estimate_pairs().
+    """
+    r = {}
+    for i, a in enumerate(tasks):
+      for b in tasks[i+1:]:
+        sa = self.slowdown(name(a), name(b), mode)
+        sb = self.slowdown(name(b), name(a), mode)
+        if sa is None or sb is None:
+          continue
+        r[a, b] = pair_cost(sa, sb)
+    return r
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+""" In-process hardware counters with perf_event_open(2).
+
+    Counters of a task are opened once as a group (the first event is the
+    leader), they follow the children of the task (inherit) and all of
+    them are read with a single read() thanks to PERF_FORMAT_GROUP.
+    Counts are scaled if the kernel multiplexed the group.
+"""
+
+from perf.perftool import NotCountedError
+from counters import Source
+
+from struct import unpack_from
+import platform
+import ctypes
+import fcntl
+import time
+import os
+
+
+SYS_PERF_EVENT_OPEN = {'x86_64': 298, 'aarch64': 241, 'i686': 336}
+
+TYPE_HARDWARE = 0
+TYPE_SOFTWARE = 1
+TYPE_HW_CACHE = 3
+
+FORMAT_TOTAL_TIME_ENABLED = 1 << 0
+FORMAT_TOTAL_TIME_RUNNING = 1 << 1
+FORMAT_GROUP = 1 << 3
+
+FLAG_DISABLED = 1 << 0
+FLAG_INHERIT = 1 << 1
+
+IOC_ENABLE = 0x2400
+IOC_DISABLE = 0x2401
+IOC_RESET = 0x2403
+IOC_FLAG_GROUP = 1
+
+
+def cache_event(cache, op, result):
+  """ config of a PERF_TYPE_HW_CACHE event """
+  caches = dict(L1D=0, L1I=1, LL=2, DTLB=3, ITLB=4, BPU=5, NODE=6)
+  ops = dict(read=0, write=1, prefetch=2)
+  results = dict(access=0, miss=1)
+  return TYPE_HW_CACHE, caches[cache] | ops[op] << 8 | results[result] << 16
+
+
+# perf names of events -> (type, config)
+EVENTS = {
+  'cycles':                  (TYPE_HARDWARE, 0),
+  'instructions':            (TYPE_HARDWARE, 1),
+  'cache-references':        (TYPE_HARDWARE, 2),
+  'cache-misses':            (TYPE_HARDWARE, 3),
+  'branch-instructions':     (TYPE_HARDWARE, 4),
+  'branch-misses':           (TYPE_HARDWARE, 5),
+  'bus-cycles':              (TYPE_HARDWARE, 6),
+  'stalled-cycles-frontend': (TYPE_HARDWARE, 7),
+  'stalled-cycles-backend':  (TYPE_HARDWARE, 8),
+  'ref-cycles':              (TYPE_HARDWARE, 9),
+  'task-clock':              (TYPE_SOFTWARE, 1),
+  'context-switches':        (TYPE_SOFTWARE, 3),
+  'cpu-migrations':          (TYPE_SOFTWARE, 4),
+  'minor-faults':            (TYPE_SOFTWARE, 6),
+  'major-faults':            (TYPE_SOFTWARE, 7),
+  'L1-dcache-loads':         cache_event('L1D', 'read', 'access'),
+  'L1-dcache-load-misses':   cache_event('L1D', 'read', 'miss'),
+  'L1-dcache-stores':        cache_event('L1D', 'write', 'access'),
+  'LLC-loads':               cache_event('LL', 'read', 'access'),
+  'LLC-load-misses':         cache_event('LL', 'read', 'miss'),
+  'LLC-stores':              cache_event('LL', 'write', 'access'),
+  'LLC-store-misses':        cache_event('LL', 'write', 'miss'),
+  'node-loads':              cache_event('NODE', 'read', 'access'),
+  'node-load-misses':        cache_event('NODE', 'read', 'miss'),
+}
+
+
+class Error(Exception):
+  """ Generic class for all errors of this module. """
+
+
+class Attr(ctypes.Structure):
+  """ struct perf_event_attr, PERF_ATTR_SIZE_VER5 """
+  _fields_ = [
+    ('type', ctypes.c_uint32),
+    ('size', ctypes.c_uint32),
+    ('config', ctypes.c_uint64),
+    ('sample_period', ctypes.c_uint64),
+    ('sample_type', ctypes.c_uint64),
+    ('read_format', ctypes.c_uint64),
+    ('flags', ctypes.c_uint64),
+    ('wakeup_events', ctypes.c_uint32),
+    ('bp_type', ctypes.c_uint32),
+    ('config1', ctypes.c_uint64),
+    ('config2', ctypes.c_uint64),
+    ('branch_sample_type', ctypes.c_uint64),
+    ('sample_regs_user', ctypes.c_uint64),
+    ('sample_stack_user', ctypes.c_uint32),
+    ('clockid', ctypes.c_int32),
+    ('sample_regs_intr', ctypes.c_uint64),
+    ('aux_watermark', ctypes.c_uint32),
+    ('sample_max_stack', ctypes.c_uint16),
+    ('reserved', ctypes.c_uint16),
+  ]
+
+
+libc = ctypes.CDLL(None, use_errno=True)
+
+
+def perf_event_open(attr, pid, cpu, group_fd=-1, flags=0):
+  nr = SYS_PERF_EVENT_OPEN.get(platform.machine())
+  if nr is None:
+    raise Error("perf_event_open is not known on %s" % platform.machine())
+  fd = libc.syscall(nr, ctypes.byref(attr), pid, cpu, group_fd, ctypes.c_ulong(flags))
+  if fd < 0:
+    errno = ctypes.get_errno()
+    raise Error("perf_event_open(pid=%s, cpu=%s): %s" % (pid, cpu, os.strerror(errno)))
+  return fd
+
+
+class Group:
+  """ Counters of events of a task (pid) or of a cpu (pid=-1). """
+
+  def __init__(self, pid, events, cpu=-1, inherit=True, reader=os.read):
+    unknown = set(events) - set(EVENTS)
+    assert not unknown, "unknown events: %s" % unknown
+    self.pid = pid
+    self.cpu = cpu
+    self.events = list(events)
+    self.inherit = inherit
+    self.reader = reader  # os.read(fd, size)
+    self.fds = []
+
+  def open(self):
+    try:
+      for ev in self.events:
+        attr = Attr()
+        attr.size = ctypes.sizeof(Attr)
+        attr.type, attr.config = EVENTS[ev]
+        attr.read_format = FORMAT_GROUP | FORMAT_TOTAL_TIME_ENABLED | FORMAT_TOTAL_TIME_RUNNING
+        leader = self.fds[0] if self.fds else -1
+        attr.flags = (FLAG_INHERIT if self.inherit else 0) | (0 if self.fds else FLAG_DISABLED)
+        self.fds.append(perf_event_open(attr, self.pid, self.cpu, leader))
+    except Error:
+      self.close()
+      raise
+    fcntl.ioctl(self.fds[0], IOC_RESET, IOC_FLAG_GROUP)
+    fcntl.ioctl(self.fds[0], IOC_ENABLE, IOC_FLAG_GROUP)
+    return self
+
+  def read(self):
+    """ {event: count}, scaled if the group was multiplexed. """
+    size = 8 * (3 + len(self.events))
+    data = self.reader(self.fds[0], size)
+    nr, enabled, running = unpack_from("QQQ", data)
+    values = unpack_from("%dQ" % nr, data, 24)
+    scale = enabled / running if running else 0
+    return {ev: int(v * scale) for ev, v in zip(self.events, values)}
+
+  def close(self):
+    for fd in reversed(self.fds):
+      os.close(fd)
+    self.fds = []
+
+  def __enter__(self):
+    return self.open()
+
+  def __exit__(self, *args):
+    self.close()
+
+
+class SystemGroup:
+  """ The same events on every cpu, counts are summed. """
+
+  def __init__(self, events, cpus=None):
+    self.events = list(events)
+    cpus = cpus if cpus is not None else sorted(os.sched_getaffinity(0))
+    self.groups = [Group(-1, events, cpu=cpu, inherit=False) for cpu in cpus]
+
+  def open(self):
+    try:
+      for group in self.groups:
+        group.open()
+    except Error:
+      self.close()
+      raise
+    return self
+
+  def read(self):
+    r = dict.fromkeys(self.events, 0)
+    for group in self.groups:
+      for ev, cnt in group.read().items():
+        r[ev] += cnt
+    return r
+
+  def close(self):
+    for group in self.groups:
+      group.close()
+
+  def __enter__(self):
+    return self.open()
+
+  def __exit__(self, *args):
+    self.close()
+
+
+class PerfEventSource(Source):
+  """ counters.Source on top of perf_event_open. pid=-1 is system-wide. """
+
+  def __init__(self, inherit=True, clock=time.monotonic):
+    self.inherit = inherit
+    self.clock = clock
+    self.group = None
+
+  def open(self, pid, events):
+    self.events = events
+    if pid == -1:
+      group = SystemGroup(events)
+    else:
+      group = Group(pid, events, inherit=self.inherit)
+    try:
+      group.open()
+    except Error as err:
+      # e.g., perf_event_paranoid does not allow it
+      print(err)
+      raise NotCountedError
+    self.group = group
+    self.started = self.clock()
+
+  def read(self):
+    if self.group is None:
+      raise NotCountedError
+    try:
+      counts = self.group.read()
+    except OSError:
+      raise NotCountedError
+    return self.clock() - self.started, counts
+
+  def close(self):
+    if self.group is not None:
+      self.group.close()
+      self.group = None
@@ -7,19 +7,38 @@ from socket import gethostname
 from subprocess import DEVNULL, Popen
 from os.path import exists
 from os import urandom
+from functools import partial
 from random import choice
 from time import sleep
 import argparse
 import pickle
+import shlex
 import time
 import sys
+import os
 
 from perf.perftool import NotCountedError
-from perf.utils import wait_idleness, threadulator
+from perf.utils import threadulator
+from idleness import wait_idleness, monitor as idleness
 from useful.small import dictzip, invoke
 from useful.mystruct import Struct
 from config import basis, VMS, IDLENESS, BOOT_TIME
 from perf.numa import topology
+import counters
+from freezer import CgroupFreezer
+from sequential import Sequential
+from domains import group_by_domain, vm_cpus
+from store import Store
+from checkpoint import Checkpoint
+from ready import wait_dead, wait_booted, wait_running
+from placement import solve, apply as apply_placement, moving, Hysteresis, \
+  cost as placement_cost, migration_penalty, align, limit_moves
+from migration import migrate
+from numabind import move as numa_move
+from governor import Governor, Rejected
+from paircache import PairCache
+from transient import Transient
+import eventsched
 
 from useful.mstring import prints
 
@@ -30,23 +49,26 @@ assert vmc_version >= 20
 class Setup:
   """ Launch all VMS at start, stop them at exit. """
 
-  def __init__(self, vms, benchmarks, debug=False):
+  def __init__(self, vms, benchmarks, debug=False, counters=False, freezer=False):
     self.benchmarks = benchmarks
     self.vms = vms
     self.debug = debug
+    self.counters = counters
+    self.freezer = freezer
     if any([vm.kill() for vm in vms]):
       print("giving old VMs time to die...")
-      sleep(3)
+      wait_dead(vms, timeout=3)
     if any(vm.pid for vm in vms):
       raise Exception("there are VMs still running!")
-    if any([vm.start() for vm,bmark in zip(vms, benchmarks)]):
+    started = vms[:len(benchmarks)]
+    if any([vm.start() for vm in started]):
       print("let VMs to boot")
-      sleep(10)
+      wait_booted(started, timeout=BOOT_TIME)
     else:
       print("no VM start was requested")
 
   def __enter__(self):
-    map = {}
+    global freezer
     if not self.debug:
       wait_idleness(IDLENESS*6)
     for bname, vm in zip(self.benchmarks, self.vms):
@@ -54,11 +76,63 @@ class Setup:
       cmd = basis[bname]
       vm.pipe = vm.Popen(cmd, stdout=DEVNULL, stderr=DEVNULL)
       vm.bname = bname
-    return map
+    wait_running(self.vms[:len(self.benchmarks)], timeout=BOOT_TIME)
+    if self.counters:
+      for vm in self.vms:
+        if vm.pid:
+          counters.attach(vm)
+    if self.freezer:
+      freezer = CgroupFreezer()
+      freezer.attach([vm for vm in self.vms if vm.pid])
+    return self
+
+  def reconfigure(self, benchmarks):
+    """ Switch to another set of benchmarks. Only VMs whose benchmark
+        changed (or that were stopped by a test) are touched, VMs that
+        are not needed any more are killed.
+        Returns the list of restarted VMs.
+    """
+    changed = []
+    surplus = [vm for vm in self.vms[len(benchmarks):] if vm.pid]
+    if surplus:
+      print("stopping VMs that are not needed:", surplus)
+      for vm in surplus:
+        pipe = getattr(vm, 'pipe', None)
+        if pipe is not None and pipe.poll() is None:
+          pipe.killall()
+        vm.pipe = None
+        counters.detach(vm)
+        vm.kill()
+      wait_dead(surplus, timeout=3)
+    booted = [vm for vm, _ in zip(self.vms, benchmarks) if not vm.pid]
+    if any([vm.start() for vm in booted]):
+      print("let VMs to boot:", booted)
+      wait_booted(booted, timeout=BOOT_TIME)
+    for vm in booted:
+      if self.counters:
+        counters.detach(vm)
+        counters.attach(vm)
+      if freezer:
+        freezer.attach([vm])
+    for bname, vm in zip(benchmarks, self.vms):
+      pipe = getattr(vm, 'pipe', None)
+      alive = pipe is not None and pipe.poll() is None
+      if vm not in booted and alive and getattr(vm, 'bname', None) == bname:
+        continue
+      if alive:
+        pipe.killall()
+      vm.pipe = vm.Popen(basis[bname], stdout=DEVNULL, stderr=DEVNULL)
+      vm.bname = bname
+      changed.append(vm)
+    self.benchmarks = benchmarks
+    return changed
 
   def __exit__(self, *args):
     print("tearing down the system")
+    if freezer:
+      freezer.release()
     for vm in self.vms:
+      counters.detach(vm)
       if not vm.pid:
         #print(vm, "already dead, not stopping it on tear down")
         continue
@@ -98,30 +172,155 @@ def cpu_enum():
   return ranked
 
 
-def exclusive(vm, vms):
-  [vm1.freeze() for vm1 in vms if vm1 != vm]
+# cgroup freezer, if enabled all co-runners are frozen with a single write
+freezer = None
+# columnar result store, if enabled samples are saved as soon as they are taken
+store = None
+
+
+# experiment checkpoint, if enabled completed steps are not repeated on restart
+checkpoint = None
+# freeze governor, if enabled VMs are not frozen more than the budget allows.
+# All freezes of co-runners go through it (see exclusive()). Tests that stop
+# VMs they do not need (isolated_performance, all_events, interference) do
+# not freeze anybody and are not accounted.
+governor = None
+# post-freeze transients, if enabled samplers wait as long as learned per VM and benchmark
+transient = None
+
+
+class BenchmarkDied(Exception):
+  """ Benchmark exited during measurement. """
+
+
+def step(key, f, *args, **kwargs):
+  """ Run a step of an experiment (an iteration, a pair of benchmarks).
+      With --checkpoint the step is skipped if it was completed before.
+  """
+  if checkpoint is None:
+    return f(*args, **kwargs)
+  return checkpoint.run(key, f, *args, **kwargs)
+
+
+def results(name):
+  """ A defaultdict(list) for experiment results. With --store
+      everything appended to it is written through to the store.
+  """
+  if store is None:
+    return defaultdict(list)
+  return store.results(name)
+
+
+
+def relocate(vm, cpus, numa=False, migration=False):
+  """ vm.set_cpus() that optionally moves VM memory to the node of the
+      new cpus and reports remote accesses (see numabind.move) and
+      measures the cost of migration (see migration.migrate).
+  """
+  if migration:
+    pin = partial(numa_move, vm, pin=vm.set_cpus) if numa else None
+    migrate(vm, cpus, cache=PairCache(), result=results('recovery'), pin=pin)
+  elif numa:
+    numa_move(vm, cpus, vm.set_cpus, stat=vm.stat)
+  else:
+    vm.set_cpus(cpus)
+
+
+def exclusive(vm, vms, duration=0):
+  """ Freeze everybody but vm for about `duration` seconds.
+      Raises Rejected if the governor does not allow it.
+  """
+  if governor:
+    governor.freeze([vm1 for vm1 in vms if vm1 != vm], duration)
+  try:
+    if freezer:
+      return freezer.exclusive(vm.pid)
+    [vm1.freeze() for vm1 in vms if vm1 != vm]
+  except Exception:
+    # e.g., freezer.Timeout: do not leave anybody frozen or charged
+    shared(vms)
+    raise
 
 def shared(vms):
-  for vm in vms:
-    vm.unfreeze()
+  if freezer:
+    freezer.shared()
+  else:
+    for vm in vms:
+      vm.unfreeze()
+  if governor:
+    governor.unfreeze(vms)
+
+def settle(vm, vms, delay=None, default=0.0, pause=0.1):
+  """ How long to wait after co-runners of vm are frozen: `delay` if it is
+      given, otherwise the learned transient of vm's benchmark (it is probed
+      first if unknown), `default` if transients are not learned.
+  """
+  if delay is not None:
+    return delay
+  if not transient:
+    return default
+  key = (str(vm), vm.bname)
+  if not transient.known(key):
+    transient.learn(key, probe_transient(vm, vms, pause))
+  learned = transient.delay(key)
+  return default if learned is None else learned
+
+def probe_transient(vm, vms, pause=0.1):
+  """ High-resolution measurements right after the freeze. """
+  from qemu import ipcistat  # lazy loading
+  samples = []
+  for _ in range(transient.probes):
+    if pause: sleep(pause)
+    exclusive(vm, vms, duration=transient.length/1000)
+    try:
+      samples.append(ipcistat(vm, interval=transient.length, subinterval=transient.subinterval))
+    except NotCountedError:
+      print("missed a transient probe for", vm.bname)
+    finally:
+      shared(vms)
+  return samples
+
+def stat_ipc(vm, time):
+  """ IPC of vm over `time` seconds. """
+  r = vm.stat(interval=time*1000, events=['instructions', 'cycles'])
+  if not r['cycles']:
+    raise NotCountedError
+  return r['instructions'] / r['cycles']
 
 def reverse_isolated(num:int, time:float, pause:float, vms=None):
-  result = defaultdict(list)
-  for vm in vms:
-    vm.freeze()
+  """ With the governor, VMs run between measurements instead of
+      being kept frozen for the whole test.
+  """
+  result = results('isolated')
+
+  def freeze_all():
+    for vm in vms:
+      vm.freeze()
+
+  def unfreeze_all():
+    for vm in vms:
+      vm.unfreeze()
+
+  if not governor:
+    freeze_all()
 
   for i in range(num):
     print("measure %s out of %s" % (i+1, num))
     for predator, victim in permutations(vms, 2):
+      if governor:
+        try:
+          governor.freeze([vm for vm in vms if vm != victim], 2*time)
+        except Rejected as err:
+          print(err)
+          continue
+        freeze_all()
       try:
         # exclusive
         victim.unfreeze()
-        i, c = victim.stat(time)
-        exclusive = i / c
+        exclusive = stat_ipc(victim, time)
         # shared
         predator.unfreeze()
-        i, c = victim.stat(time)
-        shared = i / c
+        shared = stat_ipc(victim, time)
         # tear down
         predator.freeze()
         victim.freeze()
@@ -131,22 +330,27 @@ def reverse_isolated(num:int, time:float, pause:float, vms=None):
         predator.freeze()
         victim.freeze()
         continue
+      finally:
+        if governor:
+          unfreeze_all()
+          governor.unfreeze(vms)
       key = predator.bname, victim.bname
       result[key].append(shared / exclusive)
       sleep(pause)
 
-  for vm in vms:
-    vm.unfreeze()
+  unfreeze_all()
   return result
 
 
 def reverse_shared(num:int=1, time:float=0.1, pause:float=0.1, vms=None):
   assert vms, "vms is a mandatory argument"
-  result = defaultdict(list)
+  result = results('shared')
 
   def measure(vm, r):
-    ins, cycles = vm.stat(time)
-    r[vm.bname] = ins / cycles
+    try:
+      r[vm.bname] = stat_ipc(vm, time)
+    except NotCountedError:
+      pass
 
   for i in range(num):
     print("measure %s out of %s" % (i+1, num))
@@ -156,9 +360,17 @@ def reverse_shared(num:int=1, time:float=0.1, pause:float=0.1, vms=None):
       # shared phase
       threadulator(measure, [(vm, shared) for vm in vms if vm != victim])
       # "stop victim" phase
+      try:
+        if governor:
+          governor.freeze([victim], time)
+      except Rejected as err:
+        print(err)
+        continue
       victim.freeze()
       threadulator(measure, [(vm, exklusiv) for vm in vms if vm != victim])
       victim.unfreeze()
+      if governor:
+        governor.unfreeze([victim])
       # calculate results
       try:
         for bench, pShared, pExcl in dictzip(shared, exklusiv):
@@ -192,23 +404,35 @@ def isolated_sampling(num:int=1,
                       pause:float=0.1,
                       delay:float=None,
                       result=None,
-                      vms=None):
-  """ Isolated sampling. """
+                      vms=None,
+                      targets=None):
+  """ Isolated sampling.
+      Only `targets` are measured (all by default), but all `vms` are frozen.
+  """
   if result is None:
     result = defaultdict(list)
+  if targets is None:
+    targets = vms
 
-  for vm in vms:
-    vm.exclusive()
-    for i in range(num):
-      if pause: sleep(pause)
-      try:
-        if delay: sleep(delay)
-        ipc = vm.ipcstat(interval)
-        result[vm].append(ipc)
-      except NotCountedError:
-        print("cannot get isolated performance for", vm, vm.bname)
-        pass
-    vm.shared()
+  for vm in targets:
+    try:
+      wait = settle(vm, vms, delay, pause=pause)
+      exclusive(vm, vms, duration=num*(pause + wait + interval/1000))
+    except Rejected as err:
+      print(err)
+      continue
+    try:
+      for i in range(num):
+        if pause: sleep(pause)
+        try:
+          if wait: sleep(wait)
+          ipc = vm.ipcstat(interval)
+          result[vm].append(ipc)
+        except NotCountedError:
+          print("cannot get isolated performance for", vm, vm.bname)
+          pass
+    finally:
+      shared(vms)
 
   return result
 
@@ -266,31 +490,70 @@ def shared_thr_sampling(num:int=1,
 def freezing_sampling(num:int,
                       interval:int,
                       pause:float=0.1,
-                      delay:float=0.0,
+                      delay:float=None,
                       result=None,
-                      vms=None):
-  """ Like freezing, but with another order of loops. """
+                      vms=None,
+                      targets=None):
+  """ Like freezing, but with another order of loops.
+      Only `targets` are measured (all by default), but all `vms` are frozen.
+      Without delay, measurements start after the learned transient.
+  """
   if result is None:
     result = defaultdict(list)
+  if targets is None:
+    targets = vms
 
   for _ in range(num):
-    for i, vm in enumerate(vms):
+    for i, vm in enumerate(targets):
       if pause: sleep(pause)
-      exclusive(vm, vms)
       try:
-        if delay: sleep(delay)
+        wait = settle(vm, vms, delay, pause=pause)
+        exclusive(vm, vms, duration=interval/1000 + wait)
+      except Rejected as err:
+        print(err)
+        continue
+      try:
+        if wait: sleep(wait)
         ipc = vm.ipcstat(interval)
         result[vm].append(ipc)
       except NotCountedError:
         print("cannot get frozen performance for", vm, vm.bname)
         pass
-      shared(vms)
+      finally:
+        shared(vms)
+  return result
+
+
+def domain_sampling(num:int,
+                    interval:int,
+                    pause:float=0.1,
+                    delay:float=None,
+                    result=None,
+                    vms=None,
+                    targets=None):
+  """ freezing_sampling() run concurrently in every group of VMs
+      that does not share LLC/memory controller with other groups.
+  """
+  if result is None:
+    result = defaultdict(list)
+  if targets is None:
+    targets = vms
+  if freezer:
+    print("cgroup freezer is not domain-aware, sampling sequentially")
+    return freezing_sampling(num, interval, pause, delay, result, vms, targets)
+
+  args = []
+  for group in group_by_domain(vms):
+    group_targets = [vm for vm in group if vm in targets]
+    if group_targets:
+      args.append((num, interval, pause, delay, result, group, group_targets))
+  threadulator(freezing_sampling, args)
   return result
 
 
 def isolated_vs_shared(num:int=10, interval:int=100, pause:float=0.1, vms=None):
-  isolated = defaultdict(list)
-  shared   = defaultdict(list)
+  isolated = results('isolated')
+  shared   = results('shared')
   step = 10
   assert not num % step, "num should be a multiple of %s" % step
   for i in range(num//step):
@@ -300,15 +563,29 @@ def isolated_vs_shared(num:int=10, interval:int=100, pause:float=0.1, vms=None):
   return Struct(isolated=isolated, shared=shared)
 
 
-def loosers(num:int=10, interval:int=100, pause:float=0.0, vms=None):
-  """ Detect starving applications. """
-  shared_perf = defaultdict(list)
-  frozen_perf = defaultdict(list)
-  while num>0:
+def loosers(num:int=10, interval:int=100, pause:float=0.0,
+            precision:float=None, maxnum:int=100, domains:bool=False, vms=None):
+  """ Detect starving applications.
+      With precision, VMs are sampled until their ratio is known this
+      precisely (see Sequential), num is ignored then.
+      With domains, independent cache domains are sampled in parallel.
+  """
+  sampling = domain_sampling if domains else freezing_sampling
+  shared_perf = results('shared_perf')
+  frozen_perf = results('frozen_perf')
+  seq = Sequential(precision, maxnum=maxnum) if precision else None
+  active = vms
+  if seq:
+    num = maxnum
+  while num>0 and active:
     print(num, "measurements left")
-    shared_sampling(num=10, interval=interval, pause=pause, result=shared_perf, vms=vms)
-    freezing_sampling(num=10, interval=interval, pause=pause, result=frozen_perf, vms=vms)
+    shared_sampling(num=10, interval=interval, pause=pause, result=shared_perf, vms=active)
+    sampling(num=10, interval=interval, pause=pause, result=frozen_perf, vms=vms, targets=active)
     num -= 10
+    if seq:
+      active = converge(seq, active, shared=shared_perf, frozen=frozen_perf)
+  if seq:
+    seq.report(vms, name=lambda vm: vm.bname)
 
   result = {}
   for bench, sh_perf, fr_perf in dictzip(shared_perf, frozen_perf):
@@ -337,16 +614,45 @@ def loosers_test(vms=None):
   print(watch)
 
 
-def real_loosers3(num:int=10, interval:int=10*1000, pause:float=0.1, vms=None):
-  """ Detect starving applications. Improved version """
-  shared_perf = defaultdict(list)
-  frozen_perf = defaultdict(list)
+def converge(seq, active, **series):
+  """ Feed new samples to Sequential, return VMs that still need more. """
+  for vm in active:
+    for name, result in series.items():
+      seq.feed(vm, name, result[vm])
+  return seq.pending(active)
+
+
+def real_loosers3(num:int=10, interval:int=10*1000, pause:float=0.1,
+                  precision:float=None, maxnum:int=100, domains:bool=False,
+                  phase:str=None, vms=None):
+  """ Detect starving applications. Improved version.
+      With precision, every VM is sampled until the confidence interval
+      of its shared/frozen ratio is narrower than that (e.g., 0.05) or
+      maxnum samples are taken, num is ignored then.
+      With domains, independent cache domains are sampled in parallel.
+      phase names the samples when the test calls it several times.
+  """
+  sampling = domain_sampling if domains else freezing_sampling
+  prefix = phase + '/' if phase else ''
+  shared_perf = results(prefix + 'shared_perf')
+  frozen_perf = results(prefix + 'frozen_perf')
+  seq = Sequential(precision, maxnum=maxnum) if precision else None
+  active = vms
+  if seq:
+    num = maxnum
   prints("real_loosers3 iterations ", end="")
   for i,x in enumerate(range(num)):
     prints("{i}/{num}", end=" "); sys.stdout.flush()
-    shared_thr_sampling(num=1, interval=interval, result=shared_perf, vms=vms)
-    freezing_sampling(num=1,   interval=interval, pause=0.1, result=frozen_perf, vms=vms)
+    shared_thr_sampling(num=1, interval=interval, result=shared_perf, vms=active)
+    sampling(num=1,   interval=interval, pause=0.1, result=frozen_perf, vms=vms, targets=active)
     sleep(pause)
+    if seq:
+      active = converge(seq, active, shared=shared_perf, frozen=frozen_perf)
+      if not active:
+        break
+  print()
+  if seq:
+    seq.report(vms, name=lambda vm: vm.bname)
 
   result = {}
   for vm, sh_perf, fr_perf in dictzip(shared_perf, frozen_perf):
@@ -359,13 +665,16 @@ def real_loosers3(num:int=10, interval:int=10*1000, pause:float=0.1, vms=None):
 
 
 def delay(num:int=1, interval:int=100, pause:float=0.1, delay:float=0.01, vms=None):
-  """ How delay after freeze affects precision. """
-  without   = freezing_sampling(num, interval, pause, 0.0, vms)
-  withdelay = freezing_sampling(num, interval, pause, delay, vms)
-  print(without)
-  print(withdelay)
-  print(Struct(without=without, withdelay=withdelay))
-  return Struct(without=without, withdelay=withdelay)
+  """ How delay after freeze affects precision.
+      With learned transients, also how the learned delay does.
+  """
+  without   = freezing_sampling(num, interval, pause, 0.0, vms=vms)
+  withdelay = freezing_sampling(num, interval, pause, delay, vms=vms)
+  learned   = freezing_sampling(num, interval, pause, None, vms=vms) if transient else None
+  r = Struct(without=without, withdelay=withdelay, learned=learned,
+             transient=transient.stats() if transient else None)
+  print(r)
+  return r
 
 
 def distribution_with_subsampling(num:int=1,
@@ -377,8 +686,8 @@ def distribution_with_subsampling(num:int=1,
   """ Intervals are in ms. Duty cycle is in (0,1] range. """
   from qemu import ipcistat  # lazy loading
 
-  standard = defaultdict(list)
-  withskip = defaultdict(list)
+  standard = results('standard')
+  withskip = results('withskip')
 
   assert not (pause and duty), "accepts either pause or duty"
   if duty:
@@ -391,7 +700,11 @@ def distribution_with_subsampling(num:int=1,
     # STEP 1: normal freezing approach
     for vm in vms:
       sleep(pause)
-      vm.exclusive()
+      try:
+        exclusive(vm, vms, duration=interval/1000)
+      except Rejected as err:
+        print(err)
+        continue
       try:
         ipc = vm.ipcstat(interval)
         standard[vm.bname].append(ipc)
@@ -399,14 +712,19 @@ def distribution_with_subsampling(num:int=1,
       except NotCountedError:
         print("missed data point for", vm.bname)
         pass
-      vm.shared()
+      finally:
+        shared(vms)
 
     # STEP 2: approach with sub-sampling and skip
     #print("step 2: {} out of {}".format(_+1, num))
     for vm in vms:
       sleep(pause)
       try:
-        vm.exclusive()
+        exclusive(vm, vms, duration=interval/1000)
+      except Rejected as err:
+        print(err)
+        continue
+      try:
         ipc = ipcistat(vm, interval=interval, subinterval=subinterval)
         withskip[vm.bname].append(ipc)
         #print("saving sub-sampled to", vm.bname, ipc)
@@ -414,23 +732,45 @@ def distribution_with_subsampling(num:int=1,
         print("missed data point for", vm.bname)
         pass
       finally:
-        vm.shared()
+        shared(vms)
 
   return Struct(standard=standard, withskip=withskip)
 
 
-def distribution(num:int=1, interval:int=100, pause:float=0.1, delay:float=None, vms=None):
-  """ How ideal performance looks like in isolated and quasi-isolated environments. """
-  isolated  = defaultdict(list)
-  frozen    = defaultdict(list)
+def distribution(num:int=1, interval:int=100, pause:float=0.1, delay:float=None,
+                 precision:float=None, vms=None):
+  """ How ideal performance looks like in isolated and quasi-isolated environments.
+      With precision, sampling of a VM stops once both distributions are
+      known this precisely, num is an upper limit then.
+  """
+  isolated  = results('isolated')
+  frozen    = results('frozen')
   batch_size = 10
   assert num % batch_size == 0,  \
       "number of samples should divide by 10, got %s" % num
   iterations = num // batch_size
+  seq = Sequential(precision, maxnum=num) if precision else None
+  active = vms
+  by_name = {vm.bname: vm for vm in vms}
+
+  def batch():
+    # only samples of this batch go to the checkpoint
+    batch_isolated = isolated_sampling(num=batch_size, interval=interval, pause=pause, delay=delay, vms=vms, targets=active)
+    batch_frozen = freezing_sampling(num=batch_size, interval=interval, pause=pause, delay=delay, vms=vms, targets=active)
+    return {vm.bname: (batch_isolated[vm], batch_frozen[vm]) for vm in active}
+
   for i in range(iterations):
     print("interval %s: %s out of %s" % (interval, i, iterations))
-    isolated_sampling(num=batch_size, interval=interval, pause=pause, delay=delay, result=isolated, vms=vms)
-    freezing_sampling(num=batch_size, interval=interval, pause=pause, delay=delay, result=frozen, vms=vms)
+    for bname, (iso, fro) in step(('distribution', i), batch).items():
+      vm = by_name[bname]
+      [isolated[vm].append(v) for v in iso]
+      [frozen[vm].append(v) for v in fro]
+    if seq:
+      active = converge(seq, active, isolated=isolated, frozen=frozen)
+      if not active:
+        break
+  if seq:
+    seq.report(vms, name=lambda vm: vm.bname)
   return Struct(isolated=isolated, frozen=frozen)
 
 
@@ -449,8 +789,8 @@ def distribution_with_subsampling2(num:int=1,
   elif not pause:
     pause = 0.1
 
-  isolated  = defaultdict(list)
-  frozen    = defaultdict(list)
+  isolated  = results('isolated')
+  frozen    = results('frozen')
   batch_size = 10
   assert num % batch_size == 0,  \
       "number of samples should divide by 10, got %s" % num
@@ -465,7 +805,11 @@ def distribution_with_subsampling2(num:int=1,
       for vm in vms:
         sleep(pause)
         try:
-          vm.exclusive()
+          exclusive(vm, vms, duration=interval/1000)
+        except Rejected as err:
+          print(err)
+          continue
+        try:
           ipc = ipcistat(vm, interval=interval, subinterval=subinterval)
           frozen[vm.bname].append(ipc)
           #print("saving sub-sampled to", vm.bname, ipc)
@@ -473,7 +817,7 @@ def distribution_with_subsampling2(num:int=1,
           print("missed data point for", vm.bname)
           pass
         finally:
-          vm.shared()
+          shared(vms)
 
     freezing_sampling(num=batch_size, interval=interval, pause=pause, result=frozen, vms=vms)
 
@@ -488,34 +832,65 @@ def syswide_stat(time:float=10, vms=[]):
 
 
 def start_stop_time(num:int=10, pause:float=0.1, vms=None):
-  exclusive = []
-  shared    = []
-  for i in range(num):
-    for vm in vms:
-      t = - time.time()
-      vm.exclusive()
-      t += time.time()
-      exclusive.append(t)
-
-      if pause:
-        time.sleep(pause)
-
-      t = - time.time()
-      vm.shared()
-      t += time.time()
-      shared.append(t)
+  global freezer
+  backends = [("signals", None)]
+  if freezer:
+    backends.append(("cgroup", freezer))
+
+  results = {}
+  enabled = freezer
+  try:
+    for name, backend in backends:
+      freezer = backend
+      frozen = []  # time till freeze has completed
+      thawed = []
+      rejected = 0
+      try:
+        for i in range(num):
+          for vm in vms:
+            t = - time.time()
+            try:
+              exclusive(vm, vms, duration=pause)
+            except Rejected as err:
+              print(err)
+              rejected += 1
+              continue
+            t += time.time()
+            frozen.append(t)
+
+            if pause:
+              time.sleep(pause)
+
+            t = - time.time()
+            shared(vms)
+            t += time.time()
+            thawed.append(t)
+      finally:
+        shared(vms)  # with the same backend that froze them
+      if not frozen:
+        print("{name}: all {rejected} freezes were rejected by the governor"
+              .format(name=name, rejected=rejected))
+        continue
+      results[name] = mean(frozen), mean(thawed)
+      print("{name}: shared: {shared}, exclusive: {exclusive}, shared+exclusive: {both},"
+            " {rejected} rejected"
+            .format(name=name, shared=mean(thawed), exclusive=mean(frozen),
+                    both=mean(frozen+thawed), rejected=rejected))
+  finally:
+    freezer = enabled
 
-  print("shared: {shared}, exclusive: {exclusive}, shared+exclusive: {both}"
-        .format(shared=mean(shared),
-                exclusive=mean(exclusive),
-                both=(mean(shared+exclusive))))
+  if 'cgroup' in results and 'signals' in results:
+    old, new = results['signals'][0], results['cgroup'][0]
+    print("freeze latency improvement: {:.1f}x ({:.3f}ms -> {:.3f}ms)"
+          .format(old/new, old*1000, new*1000))
+  return results
 
 
 def isolated_perf(vms):
-  from subprocess import check_call
-  import shlex
+  from perfstream import PerfStream
 
   benchmarks = "matrix wordpress blosc static sdag sdagp pgbench ffmpeg".split()
+  events = ['instructions', 'cycles']
   for bname, vm in zip(benchmarks, vms):
     #if bname != 'wordpress':
     #  continue
@@ -525,11 +900,14 @@ def isolated_perf(vms):
     sleep(10)
 
     PERF = "/home/sources/perf_lite"
-    CMD = "{perf} kvm stat -e instructions,cycles -o {out} -x, -I {subinterval} -p {pid} sleep {sleep}"
+    CMD = "{perf} kvm stat -e {events} -x, -I {subinterval} -p {pid} sleep {sleep}"
     out = "results/limit/isolated_perf_%s.csv" % bname
-    cmd = CMD.format(perf=PERF, pid=vm.pid,
-                     out=out, subinterval=100, sleep=180)
-    check_call(shlex.split(cmd))
+    cmd = CMD.format(perf=PERF, pid=vm.pid, events=",".join(events),
+                     subinterval=100, sleep=180)
+    with PerfStream(cmd, events) as stream, open(out, 'wt') as csv:
+      for interval in stream:
+        for ev in events:
+          print("{},{},,{}".format(interval.time, interval.counts[ev], ev), file=csv)
 
     ret = pipe.poll()
     if ret is not None:
@@ -539,12 +917,12 @@ def isolated_perf(vms):
     pipe.killall()
 
 
-def perfstat_sampling(num:int=100, interval:int=100, pause:float=0.1, delay:float=0.002, vms=None):
+def perfstat_sampling(num:int=100, interval:int=100, pause:float=0.1, delay:float=None, vms=None):
   from perf.numa import get_cur_cpu
   from perfstat import Perf
 
-  isolated  = defaultdict(list)
-  frozen    = defaultdict(list)
+  isolated  = results('isolated')
+  frozen    = results('frozen')
   batch_size = 5
   assert num % batch_size == 0,  \
       "number of samples should divide by 10, got %s" % num
@@ -558,29 +936,42 @@ def perfstat_sampling(num:int=100, interval:int=100, pause:float=0.1, delay:floa
       for vm, perf in zip(vms, perfs):
         bmark = vm.bname
         if pause: sleep(pause)
-        vm.exclusive()
-        sleep(delay)
-        stat = perf.measure(interval)
-        if stat[0] and stat[1]:
-          ipc = stat[0] / stat[1]
-          frozen[bmark].append(ipc)
-        else:
-          print("Perf() missed a datapoint")
-        vm.shared()
+        try:
+          wait = settle(vm, vms, delay, default=0.002, pause=pause)
+          exclusive(vm, vms, duration=wait + interval/1000)
+        except Rejected as err:
+          print(err)
+          continue
+        try:
+          sleep(wait)
+          stat = perf.measure(interval)
+          if stat[0] and stat[1]:
+            ipc = stat[0] / stat[1]
+            frozen[bmark].append(ipc)
+          else:
+            print("Perf() missed a datapoint")
+        finally:
+          shared(vms)
 
     # isolated
     for vm, perf in zip(vms, perfs):
-      vm.exclusive()
+      try:
+        exclusive(vm, vms, duration=batch_size*(pause + interval/1000))
+      except Rejected as err:
+        print(err)
+        continue
       bmark = vm.bname
-      for i in range(batch_size):
-        if pause: sleep(pause)
-        stat = perf.measure(interval)
-        if stat[0] and stat[1]:
-          ipc = stat[0] / stat[1]
-          isolated[bmark].append(ipc)
-        else:
-          print("Perf() missed a datapoint")
-      vm.shared()
+      try:
+        for i in range(batch_size):
+          if pause: sleep(pause)
+          stat = perf.measure(interval)
+          if stat[0] and stat[1]:
+            ipc = stat[0] / stat[1]
+            isolated[bmark].append(ipc)
+          else:
+            print("Perf() missed a datapoint")
+      finally:
+        shared(vms)
 
   return Struct(isolated=isolated, frozen=frozen)
 
@@ -608,9 +999,15 @@ def start_stop(num:int,
     #print("%s out of %s" % (i, num))
     if pause:
       sleep(pause)
-    vm.exclusive()
-    sleep(interval/1000)
-    vm.shared()
+    try:
+      exclusive(vm, vms, duration=interval/1000)
+    except Rejected as err:
+      print(err)
+      continue
+    try:
+      sleep(interval/1000)
+    finally:
+      shared(vms)
   print("done")
   p.send_signal(2)  # SIGINT
   return None
@@ -672,8 +1069,10 @@ def report(header, t=30):
   return performance, ipc
 
 
-def dead_opt_n(n=4, num=10, vms=None):
-  """ Dead-simple optimization of partial loads. """
+def dead_opt_n(n=4, num=10, numa:bool=False, vms=None):
+  """ Dead-simple optimization of partial loads.
+      With numa, memory of relocated VMs follows their cpus.
+  """
   cpus_ranked = cpu_enum()
   report("before start")
   #benchmarks = list(basis.items())
@@ -695,7 +1094,7 @@ def dead_opt_n(n=4, num=10, vms=None):
   print("warm-up, active vms:", active_vms)
   sleep(90)
 
-  stats, _, _ = real_loosers3(interval=1*1000, num=num, vms=active_vms)
+  stats, _, _ = real_loosers3(interval=1*1000, num=num, phase='before', vms=active_vms)
   p1, ipc1 = report("after finding loosers")
   print(stats)
   for i, (vm, degr) in zip(range(2), stats):
@@ -703,31 +1102,45 @@ def dead_opt_n(n=4, num=10, vms=None):
     for cpu in topology.no_ht:
       if cpu not in active_cpus:
         #TODO: remove old cpu
-        vm.set_cpus([cpu])
+        relocate(vm, [cpu], numa=numa)
         active_cpus.append(cpu)
 
-  stats, _, _ = real_loosers3(interval=1*1000, num=num, vms=active_vms)
+  stats, _, _ = real_loosers3(interval=1*1000, num=num, phase='after', vms=active_vms)
   p2, ipc2 = report("after fixing loosers")
   print("SPEEDUP", p2/p1)
 
 
-def dead_opt_new(nr_vms:int=4, nr_samples:int=10, repeat:int=10, vms=None):
+def dead_opt_new(nr_vms:int=4, nr_samples:int=10, repeat:int=10, solver:bool=False,
+                 migration:bool=False, numa:bool=False, vms=None):
   """ Like old one but reports more data. """
   sys_speedup = []
   reloc_speedup  = []
   all_speedup = []
+  def iteration():
+    wait_idleness(IDLENESS*4)
+    return dead_opt1(nr_vms=nr_vms, nr_samples=nr_samples, solver=solver,
+                     migration=migration, numa=numa, vms=vms)
+
   for x in range(repeat):
     prints("ITERATION {x} out of {repeat}")
-    wait_idleness(IDLENESS*4)
-    sys, vm, all = dead_opt1(nr_vms=nr_vms, nr_samples=nr_samples, vms=vms)
+    sys, vm, all = step(('dead_opt1', x), iteration)
     sys_speedup.append(sys)
     reloc_speedup += vm
     all_speedup += all
   return Struct(sys_speedup=sys_speedup, reloc_speedup=reloc_speedup, all_speedup=all_speedup)
 
 
-def dead_opt1(nr_vms:int=4, nr_samples:int=10, interval=200, vms=None):
-  """ Like dead_opt_n but more output stats so we can add more plots to the article"""
+def dead_opt1(nr_vms:int=4, nr_samples:int=10, interval=200, solver:bool=False,
+              migration:bool=False, numa:bool=False, horizon:float=600, warmup:int=10, vms=None):
+  """ Like dead_opt_n but more output stats so we can add more plots to the article.
+      With solver, VMs are placed by the placement engine instead of
+      moving the two worst loosers to free cores. The new placement is
+      applied only if its gain over horizon seconds pays for migration.
+      With migration, IPC recovery after every move is recorded.
+      With numa, memory of relocated VMs follows their cpus.
+  """
+  cache = PairCache()
+  move = partial(relocate, numa=numa, migration=migration)
   [vm.start() for vm in vms]
   cpus_ranked = cpu_enum()
 
@@ -750,23 +1163,40 @@ def dead_opt1(nr_vms:int=4, nr_samples:int=10, interval=200, vms=None):
     sleep(0.2)  # do not start them all simultaneusly
 
   print("warm-up, active vms:", active_vms)
-  sleep(10)
-  print("TODO: shorter sleep")
+  wait_running(active_vms, timeout=10)
+  sleep(warmup)
 
-  stats, perf_before, _ = real_loosers3(interval=interval, num=nr_samples, vms=active_vms)
+  stats, perf_before, _ = real_loosers3(interval=interval, num=nr_samples, phase='before', vms=active_vms)
   p1, ipc1 = report("after finding loosers")
   print(stats)
   relocated_vms = []
-  for i, (vm, degr) in zip(range(2), stats):
-    print(vm, vm.bname)
-    relocated_vms.append(vm)
-    for cpu in topology.no_ht:
-      if cpu not in active_cpus:
-        #TODO: remove old cpu
-        vm.set_cpus([cpu])
-        active_cpus.append(cpu)
-
-  stats_after, perf_after, _ = real_loosers3(interval=interval, num=nr_samples, vms=active_vms)
+  if solver:
+    degradation = dict(stats)
+    pairs = cache.pairs(active_vms)
+    cost, placement = solve(active_vms, degradation=degradation, pairs=pairs)
+    current = {vm: vm_cpus(vm) for vm in active_vms}
+    placement = align(placement, current)
+    print("placement (predicted loss {:.3f}):".format(cost),
+          {vm.bname: cpus for vm, cpus in placement.items()})
+    gain = placement_cost(current, degradation, pairs) - cost
+    tomove = moving(placement, current)
+    penalty = migration_penalty(tomove, cache.migrations(tomove), horizon)
+    if gain > penalty:
+      relocated_vms = apply_placement({vm: placement[vm] for vm in tomove}, move=move)
+    else:
+      print("gain {:.3f} does not pay for migration {:.3f}, not relocating"
+            .format(gain, penalty))
+  else:
+    for i, (vm, degr) in zip(range(2), stats):
+      print(vm, vm.bname)
+      relocated_vms.append(vm)
+      for cpu in topology.no_ht:
+        if cpu not in active_cpus:
+          #TODO: remove old cpu
+          move(vm, [cpu])
+          active_cpus.append(cpu)
+
+  stats_after, perf_after, _ = real_loosers3(interval=interval, num=nr_samples, phase='after', vms=active_vms)
   prints("BEFORE: {perf_before}\n AFTER: {perf_after}")
   p2, ipc2 = report("after fixing loosers")
 
@@ -791,8 +1221,59 @@ def dead_opt1(nr_vms:int=4, nr_samples:int=10, interval=200, vms=None):
   return sys_speedup, reloc_speedup, all_speedup
 
 
-def power_consumption(n=4, num=10, vms=None):
-  """ Dead-simple optimization of partial loads. """
+def online(period:float=60, nr_samples:int=10, interval:int=200,
+           threshold:float=0.05, min_dwell:float=600, max_moves:int=4, window:float=3600,
+           migration:bool=False, numa:bool=False, vms=None):
+  """ Continuous optimization: periodically measure degradation and
+      relocate VMs when the predicted gain is big enough (see Hysteresis).
+      Known migration costs are amortized over min_dwell. With migration,
+      the cost of every move is measured (see migration.migrate).
+      With numa, memory of relocated VMs follows their cpus.
+      Runs until interrupted, returns the history of decisions.
+  """
+  active_vms = [vm for vm in vms if vm.pid and getattr(vm, 'pipe', None)]
+  hysteresis = Hysteresis(threshold=threshold, min_dwell=min_dwell,
+                          max_moves=max_moves, window=window)
+  history = []
+  try:
+    while True:
+      stats, _, _ = real_loosers3(interval=interval, num=nr_samples,
+                                  phase='round%s' % len(history), vms=active_vms)
+      degradation = dict(stats)
+      cache = PairCache()
+      pairs = cache.pairs(active_vms)
+      current = {vm: vm_cpus(vm) for vm in active_vms}
+      old_cost = placement_cost(current, degradation, pairs)
+      new_cost, placement = solve(active_vms, degradation=degradation, pairs=pairs)
+      placement = align(placement, current)
+      tomove = moving(placement, current)
+      allowed = hysteresis.settled(tomove)
+      if len(tomove) > min(len(allowed), hysteresis.budget()):
+        # not everything can move now, the worst losers go first
+        allowed.sort(key=lambda vm: degradation.get(vm, 1))
+        placement = limit_moves(placement, current, allowed, hysteresis.budget())
+        tomove = moving(placement, current)
+        new_cost = placement_cost(placement, degradation, pairs)
+      penalty = migration_penalty(tomove, cache.migrations(tomove), horizon=min_dwell)
+      verdict, reason = hysteresis.allow(old_cost - new_cost, tomove, penalty)
+      print("placement loss: current {:.3f}, best {:.3f}, {}: {}"
+            .format(old_cost, new_cost, "relocating" if verdict else "staying", reason))
+      if verdict and tomove:
+        apply_placement({vm: placement[vm] for vm in tomove},
+                        move=partial(relocate, numa=numa, migration=migration))
+        hysteresis.moved(tomove)
+      history.append((time.time(), old_cost, new_cost, verdict and [vm.bname for vm in tomove]))
+      sleep(period)
+  except KeyboardInterrupt:
+    print("online optimization stopped")
+  return history
+
+
+def power_consumption(n=4, num=10, migration:bool=False, numa:bool=False, vms=None):
+  """ Dead-simple optimization of partial loads.
+      With migration, IPC recovery after every move is recorded.
+      With numa, memory of relocated VMs follows their cpus.
+  """
   cpus_ranked = cpu_enum()
   def report(header, t=30):
     performance, ipc = sysperf(t=t)
@@ -817,7 +1298,7 @@ def power_consumption(n=4, num=10, vms=None):
 
   input("press enter when done")
 
-  stats, _, _ = real_loosers3(interval=1*1000, num=num, vms=active_vms)
+  stats, _, _ = real_loosers3(interval=1*1000, num=num, phase='before', vms=active_vms)
   p1, ipc1 = report("after finding loosers")
   print(stats)
   for i, (vm, degr) in zip(range(2), stats):
@@ -826,35 +1307,42 @@ def power_consumption(n=4, num=10, vms=None):
       if cpu not in active_cpus:
         for oldcpu in vm.cpus:
           active_cpus.remove(oldcpu)
-        vm.set_cpus([cpu])
+        relocate(vm, [cpu], numa=numa, migration=migration)
         active_cpus.append(cpu)
   print("RELOCATION DONE")
 
-  stats, _, _ = real_loosers3(interval=1*1000, num=num, vms=active_vms)
+  stats, _, _ = real_loosers3(interval=1*1000, num=num, phase='after', vms=active_vms)
   p2, ipc2 = report("after fixing loosers")
   print("SPEEDUP", p2/p1)
   input("press enter when done")
 
 
-def llc_classify(interval:int=180*1000, vms=None):
+def llc_classify(interval:int=180*1000, slots:int=eventsched.SLOTS, vms=None):
+  """ Events are split into groups of `slots` programmable counters
+      (see eventsched) instead of being multiplexed by the kernel.
+  """
   events = ['instructions', 'cycles', 'LLC-stores', 'stalled-cycles-frontend', 'L1-dcache-stores']
   shared = {}
   isolated = {}
   for vm in vms:
     try:
-      stat = vm.stat(interval=interval, events=events)
+      stat = eventsched.measure(vm.stat, events, interval, slots=slots)
       shared[vm.bname] = stat
     except NotCountedError:
       print("missed data point")
   for vm in vms:
     try:
-      vm.exclusive()
-      stat = vm.stat(interval=interval, events=events)
+      exclusive(vm, vms, duration=interval/1000)
+    except Rejected as err:
+      print(err)
+      continue
+    try:
+      stat = eventsched.measure(vm.stat, events, interval, slots=slots)
       isolated[vm.bname] = stat
     except NotCountedError:
       print("missed data point")
     finally:
-      vm.shared()
+      shared(vms)
   print("SHARED:\n", shared)
   print("ISOLATED:\n", isolated)
 
@@ -864,19 +1352,28 @@ def isolated_performance(interval:int=180*1000, warmup:int=15, vms=None):
     vm.stop()
   vm = vms[0]
   vm.start()
-  sleep(BOOT_TIME)
+  wait_booted([vm], timeout=BOOT_TIME)
   cpu = topology.no_ht[0]
   vm.set_cpus([cpu])
 
+  cache = PairCache()
+  config = "interval={},warmup={}".format(interval, warmup)
   result = {}
   for bmark, cmd in basis.items():
+    ipc = cache.isolated(bmark, config)
+    if ipc:
+      print("using cached performance for", bmark)
+      result[bmark] = ipc
+      continue
     wait_idleness(IDLENESS*4)
     print("measuring", bmark)
     vm.Popen(cmd)
+    wait_running([vm], timeout=BOOT_TIME)
     sleep(warmup)
 
     ipc = vm.ipcstat(interval)
     result[bmark] = ipc
+    cache.put_isolated(bmark, ipc, config)
 
     ret = vm.pipe.poll()
     if ret is not None:
@@ -889,7 +1386,11 @@ def isolated_performance(interval:int=180*1000, warmup:int=15, vms=None):
   return result
 
 
-def all_events(interval:int=180*1000, warmup:int=15, vms=None):
+def all_events(interval:int=180*1000, warmup:int=15, slots:int=eventsched.SLOTS,
+               rounds:int=10, vms=None):
+  """ Events are measured in groups of `slots` programmable counters,
+      groups take turns `rounds` times over the interval (see eventsched).
+  """
   from perf import perftool
   events = perftool.get_events()
   print("monitoring events:", events)
@@ -897,7 +1398,7 @@ def all_events(interval:int=180*1000, warmup:int=15, vms=None):
     vm.stop()
   vm = vms[0]
   vm.start()
-  sleep(BOOT_TIME)
+  wait_booted([vm], timeout=BOOT_TIME)
   cpu = topology.no_ht[0]
   vm.set_cpus([cpu])
 
@@ -906,10 +1407,12 @@ def all_events(interval:int=180*1000, warmup:int=15, vms=None):
     wait_idleness(IDLENESS*4)
     print("measuring", bmark)
     vm.Popen(cmd)
+    wait_running([vm], timeout=BOOT_TIME)
     sleep(warmup)
 
-    ipc = vm.stat(interval=interval, events=events)
-    result[bmark] = ipc
+    counts = eventsched.measure(vm.stat, events, interval, slots=slots, rounds=rounds)
+    print("coverage:", ", ".join("{}={:.0%}".format(ev, cov) for ev, cov in counts.coverage.items()))
+    result[bmark] = counts
 
     ret = vm.pipe.poll()
     if ret is not None:
@@ -938,10 +1441,40 @@ def interference(interval:int=180*1000, warmup:int=15, mode=None, vms=None):
   vm1.start()
   vm2.start()
 
-  sleep(13)
+  wait_booted([vm1, vm2], timeout=BOOT_TIME)
   vm1.set_cpus([cpu1])
   vm2.set_cpus([cpu2])
 
+  def measure_pair(key):
+    bmark1, bmark2 = key
+    wait_idleness(IDLENESS*6)
+    p1 = vm1.Popen(basis[bmark1])
+    sleep(1)  # reduce oscillation when two same applications are launched
+    p2 = vm2.Popen(basis[bmark2])
+    wait_running([vm1, vm2], timeout=BOOT_TIME)
+    sleep(warmup)
+
+    r = [None, None]
+    def get_ipc(idx, vm):
+      r[idx] = vm.ipcstat(interval)
+    threadulator(get_ipc, [(0, vm1), (1, vm2)])
+
+    try:
+      for vm, bmark in [(vm1, bmark1), (vm2, bmark2)]:
+        ret = vm.pipe.poll()
+        if ret is not None:
+          msg = "Test {bmark} on {vm} died with {ret}!".format(bmark=bmark, vm=vm, ret=ret)
+          if checkpoint is None:
+            print(msg, "Manual intervention needed\n\n")
+            import pdb; pdb.set_trace()
+          raise BenchmarkDied(msg)
+    finally:
+      p1.killall()
+      p2.killall()
+    return r
+
+  cache = PairCache()
+  config = "interval={},warmup={}".format(interval, warmup)
   benchmarks = list(sorted(basis))
   result = defaultdict(lambda: [None, None])
   for bmark1, bmark2 in product(benchmarks, repeat=2):
@@ -949,29 +1482,118 @@ def interference(interval:int=180*1000, warmup:int=15, mode=None, vms=None):
       continue
     key = (bmark1, bmark2)
     print(key)
+    cached = cache.get(bmark1, bmark2, mode, config)
+    if cached:
+      print("pair is already measured")
+      result[key] = list(cached)
+      continue
+    try:
+      result[key] = step(('interference', mode, key), measure_pair, key)
+    except BenchmarkDied as err:
+      # no checkpoint for this pair, it will be retried on resume
+      print("skipping", key, err)
+      continue
+    cache.put(bmark1, bmark2, mode, result[key], config)
+    print(result)
+  return dict(result)
 
-    wait_idleness(IDLENESS*6)
-    p1 = vm1.Popen(basis[bmark1])
-    sleep(1)  # reduce oscillation when two same applications are launched
-    p2 = vm2.Popen(basis[bmark2])
-    sleep(warmup)
 
-    def get_ipc(idx, vm):
-      ipc = vm.ipcstat(interval)
-      result[key][idx] = ipc
-    threadulator(get_ipc, [(0, vm1), (1, vm2)])
 
+def run_test(args):
+  """ Invoke a test specification and save its result. """
+  global store, checkpoint
+
+  f, fargs = invoke(args.test, globals(), vms=VMS)
+  checkpoint = store = None
+  if args.checkpoint:
+    checkpoint = Checkpoint(args.checkpoint, spec=args.test)
+
+  fname = None
+  if args.output:
+    string_fargs = ",".join('%s=%s' % (k,v) for k,v in sorted(fargs.items()) if k != 'vms')
+    ext = 'store' if args.store else 'pickle'
+    if args.output == 'auto':
+      fname = 'results/{host}/{f}_{fargs}.{ext}'  \
+              .format(host=gethostname(), f=f.__name__, fargs=string_fargs, ext=ext)
+    else:
+      fname = args.output
+    assert not exists(fname), "output %s already exists" % fname
+  if fname and args.store:
+    print("recording samples to", fname)
+    store = Store(fname, 'x')
+    store.set_meta(f=f.__name__, fargs={k:v for k,v in fargs.items() if k != 'vms'},
+                   prog_args=args)
+
+  print("invoking", f.__name__, "with", fargs)
+  try:
+    result = f(**fargs)
+    if store:
+      store.set_result(result)
+  finally:
+    if store:
+      store.close()
+    if checkpoint:
+      checkpoint.close()
+  if args.print:
     print(result)
-    for vm in [vm1, vm2]:
-      ret = vm.pipe.poll()
-      if ret is not None:
-        print("Test {bmark} on {vm} died with {ret}! Manual intervention needed\n\n" \
-              .format(bmark=vm.bname, vm=vm, ret=ret))
-        import pdb; pdb.set_trace()
+  idleness.report()
+  if governor:
+    governor.report()
+    if fname and args.store:
+      governor.export(os.path.join(fname, "governor.json"))
+  if transient:
+    transient.report()
+    if fname and args.store:
+      transient.export(os.path.join(fname, "transient.json"))
+
+  if fname and not args.store:
+    fargs.pop('vms')
+    print("pickling to", fname)
+    pickle.dump(Struct(f=f.__name__, fargs=fargs, result=result, prog_args=args,
+                       governor=governor.stats() if governor else None,
+                       transient=transient.stats() if transient else None),
+                open(fname, "wb"))
+  return result
 
-    p1.killall()
-    p2.killall()
 
+def run_queue(path, setup, parser, defaults, poll=5):
+  """ Run test specifications from the file as they are appended to it.
+      A line holds the same options as the command line, e.g.
+        -t func=distribution,num=100,interval=10 -o auto -b matrix sdag
+      Empty lines and comments are ignored, "quit" stops the runner.
+      --counters and --freezer are set for the whole queue.
+  """
+  done = 0
+  while True:
+    with open(path) as fd:
+      lines = fd.read().splitlines()
+    if len(lines) <= done:
+      sleep(poll)
+      continue
+    line = lines[done].strip()
+    done += 1
+    if not line or line.startswith('#'):
+      continue
+    if line == 'quit':
+      break
+    args = parser.parse_args(shlex.split(line), namespace=argparse.Namespace(**vars(defaults)))
+    print(">>> queue item %s: %s" % (done, line))
+    if (args.counters, args.freezer) != (defaults.counters, defaults.freezer):
+      print("queue item %s: --counters and --freezer apply to the whole queue,"
+            " set them on the command line, skipping" % done)
+      continue
+    changed = setup.reconfigure(args.benches)
+    if changed and not args.debug:
+      print("benches warm-up for %s seconds:" % args.warmup, [vm.bname for vm in changed])
+      sleep(args.warmup)
+    try:
+      run_test(args)
+    except Exception as err:
+      print("queue item %s failed: %s" % (done, err))
+      import traceback; traceback.print_exc()
+    finally:
+      # a failed test may leave co-runners frozen
+      shared([vm for vm in setup.vms if vm.pid])
 
 
 if __name__ == '__main__':
@@ -981,34 +1603,49 @@ if __name__ == '__main__':
   parser.add_argument('-d', '--debug', default=False, const=True, action='store_const', help='enable debug mode')
   parser.add_argument('-t', '--test', help="test specification")
   parser.add_argument('-p', '--print', default=False, const=True, action='store_const', help='print result')
+  parser.add_argument('-c', '--counters', default=False, const=True, action='store_const',
+                      help='attach persistent counter sessions to VMs instead of running perf per sample')
+  parser.add_argument('-F', '--freezer', default=False, const=True, action='store_const',
+                      help='freeze co-runners with cgroup v2 freezer instead of signals')
+  parser.add_argument('-s', '--store', default=False, const=True, action='store_const',
+                      help='record samples to a columnar store as they are taken instead of pickling at exit')
+  parser.add_argument('-r', '--checkpoint', default=None,
+                      help='checkpoint file, completed steps of the test are skipped on restart')
+  parser.add_argument('-g', '--governor', type=float, default=None,
+                      help='max fraction of time a VM may be frozen by measurements, e.g. 0.05')
+  parser.add_argument('--sla-window', type=float, default=60,
+                      help='sliding window for --governor, seconds')
+  parser.add_argument('--sla-policy', default='delay', choices=['delay', 'reject'],
+                      help='what to do with freezes that exceed --governor budget')
+  parser.add_argument('-T', '--transient', default=False, const=True, action='store_const',
+                      help='learn post-freeze transients per VM and benchmark and wait them out instead of a fixed delay')
+  parser.add_argument('--transient-probes', type=int, default=5,
+                      help='measurements to learn a transient from')
+  parser.add_argument('--transient-subinterval', type=int, default=2,
+                      help='resolution of transient probes, ms')
   parser.add_argument('-b', '--benches', nargs='*', default="matrix wordpress blosc static sdag sdagp pgbench ffmpeg".split(), help="which benchmarks to run")
+  parser.add_argument('-q', '--queue', default=None,
+                      help="file with test specifications, one per line (same options as the command line), "
+                           "VMs and benchmarks are kept running between them")
   args = parser.parse_args()
   print("config:", args)
-
+  assert args.test or args.queue, "either --test or --queue is required"
   assert not args.output or not exists(args.output), "output %s already exists" % args.output
 
   from perf.numa import pin_task
-  import os
   pin_task(os.getpid(), 6)
 
-  with Setup(VMS, args.benches, debug=args.debug):
+  if args.governor:
+    governor = Governor(args.governor, window=args.sla_window, policy=args.sla_policy)
+  if args.transient:
+    transient = Transient(subinterval=args.transient_subinterval, probes=args.transient_probes)
+
+  with Setup(VMS, args.benches, debug=args.debug, counters=args.counters,
+             freezer=args.freezer) as setup:
     if not args.debug and args.benches:
       print("benches warm-up for %s seconds" % args.warmup)
       sleep(args.warmup)
-    f, fargs = invoke(args.test, globals(), vms=VMS)
-    print("invoking", f.__name__, "with", fargs)
-    result = f(**fargs)
-    if args.print:
-      print(result)
-
-    if args.output:
-      fargs.pop('vms')
-      if args.output == 'auto':
-        string_fargs = ",".join('%s=%s' % (k,v) for k,v in sorted(fargs.items()))
-        fname = 'results/{host}/{f}_{fargs}.pickle'  \
-                .format(host=gethostname(), f=f.__name__, fargs=string_fargs)
-      else:
-        fname = args.output
-      print("pickling to", fname)
-      pickle.dump(Struct(f=f.__name__, fargs=fargs, result=result, prog_args=args),
-                  open(fname, "wb"))
+    if args.queue:
+      run_queue(args.queue, setup, parser, args)
+    else:
+      run_test(args)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+""" Incremental parser for `perf stat -x, -I` output.
+
+    Rows are parsed as they arrive through a pipe, one record per
+    subinterval, no temporary files involved.
+"""
+
+from perf.perftool import NotCountedError
+
+from subprocess import Popen, DEVNULL, PIPE
+from collections import namedtuple, defaultdict
+import signal
+import shlex
+
+
+NOT_COUNTED = ['<not counted>', '<not supported>']
+
+# time: perf timestamp in seconds, counts: {event: count},
+# missing: events that were not counted in this interval
+Interval = namedtuple('Interval', 'time counts missing')
+
+
+def parse_row(line):
+  """ Returns (time, count, event) or None for non-data rows.
+      count is None when the event was not counted.
+  """
+  fields = line.strip().split(',')
+  if len(fields) < 4:
+    return None
+  try:
+    ts = float(fields[0])
+  except ValueError:
+    return None
+  rawcnt, ev = fields[1], fields[3]
+  if rawcnt in NOT_COUNTED:
+    return ts, None, ev
+  try:
+    return ts, int(rawcnt), ev
+  except ValueError:
+    return None
+
+
+def parse(lines, events):
+  """ Yield an Interval as soon as all events of a subinterval are seen.
+      Events perf skipped are reported as missing, this includes the
+      last interval if the output ends in the middle of it.
+  """
+  events = set(events)
+  pending, missing = {}, set()
+  cur = None
+
+  def incomplete():
+    lost = events - set(pending)
+    pending.update(dict.fromkeys(lost, 0))
+    return Interval(cur, pending, missing | lost)
+
+  for line in lines:
+    row = parse_row(line)
+    if row is None:
+      continue
+    ts, cnt, ev = row
+    if ev not in events:
+      continue
+    if ts != cur:
+      if pending:
+        # perf skipped some events, do not lose the interval
+        yield incomplete()
+      pending, missing, cur = {}, set(), ts
+    if cnt is None:
+      missing.add(ev)
+      cnt = 0
+    pending[ev] = cnt
+    if len(pending) == len(events):
+      yield Interval(ts, pending, missing)
+      pending, missing, cur = {}, set(), None
+  if pending:
+    yield incomplete()
+
+
+class PerfStream:
+  """ Run perf and iterate over its intervals while it is running.
+      Can be stopped at any moment with stop().
+  """
+  def __init__(self, cmd, events):
+    self.cmd = cmd
+    self.events = events
+    self.pipe = None
+
+  def __enter__(self):
+    # perf stat writes statistics to stderr
+    self.pipe = Popen(shlex.split(self.cmd), stdout=DEVNULL, stderr=PIPE,
+                      universal_newlines=True)
+    return self
+
+  def __exit__(self, *args):
+    self.stop()
+
+  def __iter__(self):
+    assert self.pipe, "stream is not started"
+    return parse(self.pipe.stderr, self.events)
+
+  def stop(self):
+    if self.pipe is None:
+      return
+    if self.pipe.poll() is None:
+      self.pipe.send_signal(signal.SIGINT)
+    self.pipe.stderr.close()
+    ret = self.pipe.wait()
+    self.pipe = None
+    return ret
+
+
+class Result(defaultdict):
+  """ Collected counters plus the number of incomplete intervals. """
+  missing = 0
+
+
+def collect(stream, stop=None):
+  """ Gather intervals into {event: [counts]}.
+      `stop` is called with the current result after every interval,
+      the measurement is terminated as soon as it returns True.
+  """
+  r = Result(list)
+  nc = 0
+  for interval in stream:
+    for ev, cnt in interval.counts.items():
+      r[ev].append(cnt)
+    if interval.missing:
+      nc += 1
+    if stop and stop(r):
+      break
+  if not r:
+    raise NotCountedError
+  r.missing = nc
+  return r
+
+
+def record(cmd, events):
+  """ Run perf till it exits and collect() all of its intervals.
+      NotCountedError if perf fails or an event is never reported.
+  """
+  try:
+    with PerfStream(cmd, events) as stream:
+      r = collect(stream)
+      ret = stream.stop()
+  except OSError:
+    raise NotCountedError
+  if ret:
+    print("%s exited with %s" % (shlex.split(cmd)[0], ret))
+    raise NotCountedError
+  if set(events) - set(r):
+    raise NotCountedError
+  return r
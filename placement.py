@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+""" Placement engine: assign tasks (VMs) to CPU cores.
+
+    Only tasks sharing a core (hyper-thread siblings) are assumed to
+    interfere. The cost of a placement is the sum of pairwise interference
+    of co-located tasks, the engine looks for a placement of minimal cost.
+    It is a min-cost matching problem: exact branch-and-bound for small
+    hosts and greedy matching improved with local search for big ones.
+"""
+
+from perf.numa import topology
+
+from collections import deque
+from itertools import combinations
+import time
+
+
+EXACT_LIMIT = 12  # max number of tasks for branch-and-bound
+
+
+def cores(top=topology):
+  """ CPU cores as lists of their hardware threads. """
+  return [[cpu] + list(top.ht_map.get(cpu, [])) for cpu in top.no_ht]
+
+
+def core_index(top=topology):
+  """ {cpu: index of its core in cores()} """
+  return {cpu: i for i, core in enumerate(cores(top)) for cpu in core}
+
+
+def home(cpus, index):
+  """ Core where all cpus are, None if the task floats over several cores. """
+  homes = {index.get(cpu) for cpu in cpus}
+  if len(homes) == 1:
+    return homes.pop()
+  return None
+
+
+def pair_cost(perf_a, perf_b):
+  """ Cost of two tasks sharing a core: the sum of their performance losses.
+      perf_x is performance next to the other task relative to isolation.
+  """
+  return (1 - perf_a) + (1 - perf_b)
+
+
+def estimate_pairs(degradation):
+  """ Pairwise interference from per-task degradation alone.
+      degradation is {task: shared/frozen performance ratio}, the task that
+      suffers most is assumed to be the most sensitive and aggressive, so
+      a loses (1-da)*(1-db) next to b and vice versa.
+  """
+  r = {}
+  for a, b in combinations(degradation, 2):
+    loss = (1 - degradation[a]) * (1 - degradation[b])
+    r[a, b] = pair_cost(1 - loss, 1 - loss)
+  return r
+
+
+class Problem:
+  def __init__(self, tasks, pairs, ncores, threads=2):
+    assert len(tasks) <= ncores * threads, \
+        "%s tasks do not fit into %s cores" % (len(tasks), ncores)
+    self.tasks = list(tasks)
+    self.pairs = pairs
+    self.ncores = ncores
+    # number of cores that will be shared by two tasks
+    self.npairs = max(0, len(tasks) - ncores)
+
+  def cost(self, a, b):
+    if (a, b) in self.pairs:
+      return self.pairs[a, b]
+    return self.pairs.get((b, a), 0)
+
+  def total(self, pairing):
+    return sum(self.cost(a, b) for a, b in pairing)
+
+  def solve(self):
+    """ Returns (cost, [(a,b) pairs sharing a core]). """
+    if len(self.tasks) <= EXACT_LIMIT:
+      return self.branch_and_bound()
+    return self.local_search(self.greedy())
+
+  def branch_and_bound(self):
+    best = [float('inf'), []]
+
+    def search(rest, pairing, cost, solo_left):
+      if cost >= best[0]:
+        return
+      if not rest:
+        best[:] = cost, list(pairing)
+        return
+      first, others = rest[0], rest[1:]
+      # first gets a core on its own
+      if solo_left:
+        search(others, pairing, cost, solo_left-1)
+      # or shares a core with somebody
+      pairs_left = (len(rest) - solo_left) // 2
+      if pairs_left:
+        for i, other in enumerate(others):
+          pairing.append((first, other))
+          search(others[:i] + others[i+1:], pairing,
+                 cost + self.cost(first, other), solo_left)
+          pairing.pop()
+
+    solo = len(self.tasks) - 2 * self.npairs
+    search(self.tasks, [], 0, solo)
+    return best[0], best[1]
+
+  def greedy(self):
+    pairing, used = [], set()
+    candidates = sorted(combinations(self.tasks, 2), key=lambda p: self.cost(*p))
+    for a, b in candidates:
+      if len(pairing) == self.npairs:
+        break
+      if a in used or b in used:
+        continue
+      pairing.append((a, b))
+      used |= {a, b}
+    return pairing
+
+  def local_search(self, pairing):
+    """ Swap tasks between pairs (and with solo tasks) while it helps. """
+    pairing = [list(p) for p in pairing]
+    improved = True
+    while improved:
+      improved = False
+      paired = {t for p in pairing for t in p}
+      solos = [t for t in self.tasks if t not in paired]
+      for p, q in combinations(pairing, 2):
+        for i, j in [(0, 0), (0, 1)]:
+          old = self.cost(*p) + self.cost(*q)
+          p[i], q[j] = q[j], p[i]
+          if self.cost(*p) + self.cost(*q) < old - 1e-12:
+            improved = True
+          else:
+            p[i], q[j] = q[j], p[i]
+      for p in pairing:
+        for i in range(2):
+          for k, s in enumerate(solos):
+            old = self.cost(*p)
+            p[i], solos[k] = s, p[i]
+            if self.cost(*p) < old - 1e-12:
+              improved = True
+            else:
+              p[i], solos[k] = solos[k], p[i]
+    pairing = [tuple(p) for p in pairing]
+    return self.total(pairing), pairing
+
+
+def solve(tasks, degradation=None, pairs=None, top=topology):
+  """ Compute placement {task: [cpu]}.
+      pairs are measured interference estimates {(a,b): cost},
+      missing ones are derived from degradation.
+  """
+  allcores = cores(top)
+  estimated = estimate_pairs(degradation) if degradation else {}
+  estimated.update(pairs or {})
+  problem = Problem(tasks, estimated, len(allcores), max(len(c) for c in allcores))
+  cost, pairing = problem.solve()
+
+  placement = {}
+  free = list(allcores)
+  for a, b in pairing:
+    core = free.pop(0)
+    placement[a] = [core[0]]
+    placement[b] = [core[1]]
+  paired = set(placement)
+  for task in tasks:
+    if task not in paired:
+      placement[task] = [free.pop(0)[0]]
+  return cost, placement
+
+
+def cost(placement, degradation=None, pairs=None, top=topology):
+  """ Predicted loss of an existing placement {task: [cpus]}.
+      Only tasks pinned to the same core count as co-located. Tasks that
+      float over several cores (e.g., not pinned at all) meet everybody,
+      their loss is the measured one, 1-degradation, if it is known.
+  """
+  allcores = cores(top)
+  index = core_index(top)
+  estimated = estimate_pairs(degradation) if degradation else {}
+  estimated.update(pairs or {})
+  problem = Problem(list(placement), estimated, len(allcores), max(len(c) for c in allcores))
+  homes = {task: home(cpus, index) for task, cpus in placement.items()}
+  pairing = [(a, b) for a, b in combinations(placement, 2)
+             if homes[a] is not None and homes[a] == homes[b]]
+  floating = [task for task in placement if homes[task] is None]
+  measured = sum(1 - degradation[task] for task in floating if task in (degradation or {}))
+  return problem.total(pairing) + measured
+
+
+def align(placement, current, top=topology):
+  """ The same placement with cores (and threads inside them) relabelled
+      so that as few tasks as possible move from `current` {task: [cpus]}.
+      Cores are interchangeable for the solver, so the cost does not change.
+  """
+  allcores = cores(top)
+  index = core_index(top)
+  groups = {}  # core of the solution -> tasks on it
+  for task, cpus in placement.items():
+    groups.setdefault(home(cpus, index), []).append(task)
+  now = {task: home(current.get(task, []), index) for task in placement}
+  # cores where most of the group already is go first
+  scores = []
+  for g, tasks in groups.items():
+    for c in range(len(allcores)):
+      score = sum(now[task] == c for task in tasks)
+      if score:
+        scores.append((-score, g, c))
+  target = {}
+  for _, g, c in sorted(scores):
+    if g not in target and c not in target.values():
+      target[g] = c
+  free = [c for c in range(len(allcores)) if c not in target.values()]
+  for g in groups:
+    if g not in target:
+      target[g] = g if g in free else free[0]
+      free.remove(target[g])
+
+  r = {}
+  for g, tasks in groups.items():
+    core = allcores[target[g]]
+    taken = set()
+    stay = [t for t in tasks if len(current.get(t, [])) == 1 and current[t][0] in core]
+    for task in stay:
+      if current[task][0] not in taken:
+        r[task] = list(current[task])
+        taken.add(current[task][0])
+    rest = [cpu for cpu in core if cpu not in taken]
+    for task in tasks:
+      if task not in r:
+        r[task] = [rest.pop(0)]
+  return r
+
+
+def limit_moves(placement, current, tasks, limit):
+  """ Part of the placement: at most `limit` of `tasks` (in the order of
+      preference) move, the rest stay where they are. A task moves only
+      if its new cpus are not occupied by those who stay.
+  """
+  chosen = []
+  changed = True
+  while changed and len(chosen) < limit:
+    changed = False
+    staying = [t for t in current if t not in chosen]
+    occupied = {cpu for t in staying if len(current[t]) == 1 for cpu in current[t]}
+    occupied |= {cpu for t in chosen for cpu in placement[t]}
+    for task in tasks:
+      if task in chosen or occupied & set(placement[task]):
+        continue
+      chosen.append(task)
+      changed = True
+      break
+  r = {task: list(cpus) for task, cpus in current.items()}
+  r.update((task, placement[task]) for task in chosen)
+  return r
+
+
+def migration_penalty(tasks, costs, horizon):
+  """ Loss caused by moving tasks in the units of cost(), amortized over
+      horizon seconds. costs are {task: seconds of lost work}.
+  """
+  return sum(costs.get(task, 0) for task in tasks) / horizon
+
+
+class Hysteresis:
+  """ Decides if a relocation is worth doing, so that the system does not
+      oscillate: predicted gain must exceed a threshold, a task is not moved
+      again sooner than min_dwell seconds, and there are at most max_moves
+      moves per window seconds.
+  """
+
+  def __init__(self, threshold=0.05, min_dwell=600, max_moves=4, window=3600, clock=time.time):
+    self.threshold = threshold
+    self.min_dwell = min_dwell
+    self.max_moves = max_moves
+    self.window = window
+    self.clock = clock
+    self.last_move = {}   # task -> timestamp
+    self.moves = deque()  # timestamps of all moves
+
+  def allow(self, gain, tasks, penalty=0):
+    """ Returns (verdict, reason). penalty is the cost of migration. """
+    now = self.clock()
+    while self.moves and self.moves[0] < now - self.window:
+      self.moves.popleft()
+    if gain - penalty < self.threshold:
+      return False, "gain {:.3f} minus migration cost {:.3f} is below threshold {}" \
+                    .format(gain, penalty, self.threshold)
+    recent = [t for t in tasks if now - self.last_move.get(t, -float('inf')) < self.min_dwell]
+    if recent:
+      return False, "moved recently: %s" % recent
+    if len(self.moves) + len(tasks) > self.max_moves:
+      return False, "move budget exhausted ({} moves in {}s)".format(len(self.moves), self.window)
+    return True, "gain {:.3f}".format(gain)
+
+  def settled(self, tasks):
+    """ Tasks that may move already (min_dwell has passed). """
+    now = self.clock()
+    return [t for t in tasks if now - self.last_move.get(t, -float('inf')) >= self.min_dwell]
+
+  def budget(self):
+    """ How many moves are left in the current window. """
+    now = self.clock()
+    return self.max_moves - sum(1 for t in self.moves if t >= now - self.window)
+
+  def moved(self, tasks):
+    now = self.clock()
+    for task in tasks:
+      self.last_move[task] = now
+      self.moves.append(now)
+
+
+def moving(placement, current=None):
+  """ Tasks whose cpus would change, compared to current {task: [cpus]}
+      or to task.cpus.
+  """
+  if current is not None:
+    return [task for task, cpus in placement.items() if list(current.get(task, [])) != list(cpus)]
+  return [task for task, cpus in placement.items()
+          if list(getattr(task, 'cpus', None) or []) != list(cpus)]
+
+
+def apply(placement, method='set_cpus', move=None):
+  """ Pin tasks, only those which actually move.
+      VMs are pinned with set_cpus(), profile.Task with pin().
+      move(task, cpus) overrides that, e.g. migration.migrate().
+  """
+  moved = []
+  for task, cpus in placement.items():
+    if list(getattr(task, 'cpus', None) or []) == list(cpus):
+      continue
+    if move:
+      move(task, cpus)
+    else:
+      getattr(task, method)(cpus)
+    moved.append(task)
+  return moved
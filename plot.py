@@ -3,6 +3,8 @@
 from useful.csv import Reader as CSVReader
 from useful.small import invoke, dictzip
 from useful.mstring import s
+from subsamples import Subsamples
+from transient import Transient
 
 
 from argparse import ArgumentParser
@@ -20,6 +22,20 @@ if 'DISPLAY' not in os.environ:
 import pylab as p
 
 
+def load(path):
+  """ Load results saved either with pickle or as a columnar store.
+      Series of a store are loaded lazily, on first access.
+  """
+  if os.path.isdir(path):
+    from store import Store
+    store = Store(path)
+    results = store.meta
+    # tests that do not record series only have their return value saved
+    results.result = store.tree() if store.series() else store.result
+    return results
+  return pickle.load(open(path, 'rb'))
+
+
 def ci_student(a, confidence=0.9):
   from scipy.stats import sem, t
   import numpy as np
@@ -207,20 +223,31 @@ def distribution(data, mode='hist'):
     box = myboxplot(data, labels=labels, notch=True)
 
 
-def distribution_with_subsampling(data, skip=22, mode='hist'):
+def distribution_with_subsampling(data, skip=None, mode='hist'):
+  """ Without skip, the post-freeze transient of every test is detected
+      from its subsamples.
+  """
   standard = data.standard
   withskip = data.withskip
+  transient = Transient()
 
   plots, labels = [], []
   tuples = []
   for test, st_ipcs, raw_skp in dictzip(standard, withskip):
+      if isinstance(raw_skp, dict):  # columns from a store
+        raw_skp = [dict(zip(raw_skp, sample)) for sample in zip(*raw_skp.values())]
+      if skip is None:
+        transient.learn(test, raw_skp)
+        test_skip = transient.skip(test) or 0
+        print("{}: skipping {} subsamples".format(test, test_skip))
+      else:
+        test_skip = int(skip)
       skp_ipc = []
       for skp in raw_skp:
-        instr  = mean(skp['instructions'][skip:])
-        cycles = mean(skp['cycles'][skip:])
-        if not cycles:
+        ipc = Subsamples.from_columns(skp, ['instructions', 'cycles']).skip(test_skip).total_ipc()
+        if ipc is None:
           continue
-        skp_ipc.append(instr/cycles)
+        skp_ipc.append(ipc)
 
       tuples.append((test, st_ipcs, skp_ipc))
 
@@ -230,8 +257,9 @@ def distribution_with_subsampling(data, skip=22, mode='hist'):
       plots.append(isolated)
       plots.append(shared)
       labels.append(test)
+  skipped = "learned skip" if skip is None else "skip %sms" % (int(skip)*2)
   myboxplot(plots, labels=labels,
-            legend=["frozen env meas. 50ms", "frozen with skip %sms" % (skip*2)])
+            legend=["frozen env meas. 50ms", "frozen with %s" % skipped])
 
 
 
@@ -337,7 +365,7 @@ def main():
       func(**params)
   else:
     for plot in args.plots:
-      results = pickle.load(open(plot, 'rb'))
+      results = load(plot)
       fname = results.f
       func  = globals()[fname]
       func(results.result)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+""" Helpers to read process statistics from /proc. """
+
+import time
+import os
+
+
+CLK_TCK = os.sysconf('SC_CLK_TCK')
+
+
+def stat_fields(path):
+  """ Fields of /proc/<pid>/stat after the command name. """
+  with open(path, 'rb') as fd:
+    data = fd.read()
+  # command name may contain spaces and parentheses
+  return data[data.rindex(b')')+2:].split()
+
+
+def pid_ticks(pid):
+  """ CPU time (utime+stime) consumed by the process, in clock ticks. """
+  fields = stat_fields("/proc/%s/stat" % pid)
+  return int(fields[11]) + int(fields[12])
+
+
+class ProcSampler:
+  """ CPU usage of many processes (or threads) from /proc/<pid>/stat.
+      All pids are read in one pass and only tick counters of the
+      previous pass are kept, so a pass costs three syscalls per pid.
+      If pids are not given, all processes of the host are sampled.
+  """
+
+  def __init__(self, pids=None, threads=False, proc="/proc", clock=time.monotonic):
+    self.pids = set(pids) if pids is not None else None
+    self.threads = threads
+    self.proc = proc
+    self.clock = clock
+    self.prev = {}  # pid -> (start time, ticks)
+    self.comm = {}  # pid -> command name
+    self.last = None
+
+  def track(self, pid):
+    if self.pids is None:
+      self.pids = set()
+    self.pids.add(pid)
+
+  def untrack(self, pid):
+    self.pids.discard(pid)
+    self.prev.pop(pid, None)
+    self.comm.pop(pid, None)
+
+  def paths(self):
+    """ [(pid, path to its stat)] """
+    pids = self.pids
+    if pids is None:
+      pids = [int(e.name) for e in os.scandir(self.proc) if e.name.isdigit()]
+    if not self.threads:
+      return [(pid, "%s/%s/stat" % (self.proc, pid)) for pid in pids]
+    r = []
+    for pid in pids:
+      try:
+        tids = os.listdir("%s/%s/task" % (self.proc, pid))
+      except OSError:
+        continue
+      r.extend((int(tid), "%s/%s/task/%s/stat" % (self.proc, pid, tid)) for tid in tids)
+    return r
+
+  def read(self, path):
+    try:
+      fd = os.open(path, os.O_RDONLY)
+    except OSError:
+      return None
+    try:
+      return os.read(fd, 4096)
+    except OSError:
+      return None
+    finally:
+      os.close(fd)
+
+  def sample(self):
+    """ {pid: CPU usage in percent since the previous call}.
+        Pids seen for the first time are not reported.
+    """
+    now = self.clock()
+    elapsed = (now - self.last) * CLK_TCK if self.last else None
+    self.last = now
+    cur, r = {}, {}
+    for pid, path in self.paths():
+      data = self.read(path)
+      if not data:
+        continue
+      pos = data.rindex(b')')
+      fields = data[pos+2:].split()
+      ticks = int(fields[11]) + int(fields[12])
+      start = fields[19]
+      cur[pid] = start, ticks
+      if pid not in self.comm or self.prev.get(pid, (start,))[0] != start:
+        self.comm[pid] = data[data.index(b'(')+1:pos].decode(errors='replace')
+      prev = self.prev.get(pid)
+      if elapsed and prev and prev[0] == start:
+        r[pid] = (ticks - prev[1]) / elapsed * 100
+    for pid in set(self.comm) - set(cur):
+      del self.comm[pid]
+    self.prev = cur
+    return r
+
+  def name(self, pid):
+    return self.comm.get(pid, "?")
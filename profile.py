@@ -1,22 +1,33 @@
 #!/usr/bin/env python3
 
-from perf.utils import wait_idleness
+from idleness import wait_idleness
 from perf.numa import *
-from perf.perftool import ipc, stat
+from perf.perftool import ipc, stat, NotCountedError
 import perf; perf.min_version((2,9))
 
 from useful.log import Log, logfilter
 from useful.mstring import s
 from useful.run import run
+from freezer import CgroupFreezer
+from placement import solve, apply, cores
+from domains import cpu_domain
+from numabind import follow
+from procfs import ProcSampler
+from paircache import PairCache
+from counters import CounterSession, FakeSource
+from perfevent import PerfEventSource
 
 from signal import SIGSTOP, SIGCONT, SIGKILL
 from subprocess import Popen, DEVNULL
 from collections import defaultdict
 from itertools import permutations
 from statistics import mean
-from random import choice
+from random import choice, Random
 from time import sleep
-from os import kill
+from os import kill, listdir
+
+import math
+import time
 
 import argparse
 import atexit
@@ -52,6 +63,9 @@ class cfg:
   warmup_time = 3
   idleness = 100
   cpu_mask = 0b1111
+  counters = 'perf'          # perf: run perf tool, native: perf_event_open, fake: FakeSource
+  freeze_budget = None       # max fraction of time the system is frozen by profiling
+  task_freeze_budget = None  # the same for every single task
 
 def generate_load(num):
   tasks = []
@@ -67,15 +81,14 @@ def generate_load(num):
 
 
 def get_heavy_tasks(thr, t=1):
-  from psutil import process_iter
-  [p.cpu_percent() for p in process_iter()]
+  sampler = ProcSampler()
+  sampler.sample()
   sleep(t)
   r = []
-  for p in process_iter():
-    cpu = p.cpu_percent(None)
-    if cpu > 10:
-      print("{pid:<7} {name:<12} {cpu}% CPU".format(pid=p.pid, name=p.name(), cpu=cpu))
-      r.append(p.pid)
+  for pid, cpu in sorted(sampler.sample().items()):
+    if cpu > thr:
+      print("{pid:<7} {name:<12} {cpu:.1f}% CPU".format(pid=pid, name=sampler.name(pid), cpu=cpu))
+      r.append(pid)
   return r
 
 
@@ -88,14 +101,28 @@ def get_pinned_tasks(threshold):
   return tasks
 
 
+def counter_source(inherit=True):
+  """ counters.Source for cfg.counters other than perf. """
+  if cfg.counters == 'fake':
+    return FakeSource()
+  return PerfEventSource(inherit=inherit)
+
+
 class Task:
   tasks =  []
+  freezer = None  # CgroupFreezer, if None tasks are stopped with signals
+  numa = False    # move memory to the node of new cpus
+  inherit = True  # count children too
+
   def __init__(self, pid, name):
     kill(pid, 0)  # check if pid is alive
     self.pid = pid
     self.cpus = ()
     self.name = name
+    self.counters = None
     self.tasks.append(self)
+    if self.freezer:
+      self.freezer.add(pid)
 
   def pin(self, cpus):
     """ Pin task to the specific cpu.
@@ -110,57 +137,227 @@ class Task:
     #   print("pinning %s to %s" %(self.pid, cpus))
     mask = cpus2mask(cpus)
     self.set_affinity(mask)
+    if self.numa:
+      follow(self.pid, cpus)
     self.cpus = cpus
 
   def kill(self, sig=SIGKILL):
     kill(self.pid, sig)
 
+  def tids(self):
+    """ Threads the affinity is applied to. """
+    try:
+      return [int(tid) for tid in listdir("/proc/%s/task" % self.pid)]
+    except OSError:
+      return [self.pid]
+
   def set_affinity(self, mask):
     log.task.debug("setting affinity to 0x{mask:X} {list}".format(mask=mask, list=mask2cpus(mask)))
-    set_affinity(self.pid, mask)
+    for tid in self.tids():
+      set_affinity(tid, mask)
 
   def ipc(self, time=0.1):
-    return ipc(pid=self.pid, time=time)
+    """ Without access to perf_event_open the perf tool is used. """
+    if cfg.counters == 'perf' or not self.session():
+      return ipc(pid=self.perf_pid(), time=time)
+    return self.counters.ipc(time*1000)
+
+  def session(self):
+    """ Counter session of the task, False if it cannot be opened. """
+    if self.counters is None:
+      session = CounterSession(self.pid, source=counter_source(inherit=self.inherit))
+      try:
+        self.counters = session.open()
+      except NotCountedError:
+        print("cannot open counters of %s, falling back to perf" % self)
+        self.counters = False
+    return self.counters
+
+  def perf_pid(self):
+    return self.pid
+
+  def others(self):
+    """ Tasks that are stopped when this one runs exclusively. """
+    return [t for t in self.tasks if t != self]
 
   def shared(self):
-    for t in self.tasks:
-      if t == self:
-        continue
+    if self.freezer:
+      return self.freezer.shared()
+    for t in self.others():
       t.kill(SIGCONT)
 
   def exclusive(self):
-    for t in self.tasks:
-      if t == self:
-        continue
+    if self.freezer:
+      return self.freezer.exclusive(self.pid)
+    for t in self.others():
       t.kill(SIGSTOP)
 
+  def threads(self, threshold=0, t=0.5):
+    """ Threads of the task consuming more than threshold % of CPU. """
+    sampler = ProcSampler([self.pid], threads=True)
+    sampler.sample()
+    sleep(t)
+    return [Thread(tid, self, sampler.name(tid))
+            for tid, cpu in sorted(sampler.sample().items()) if cpu > threshold]
+
   def __repr__(self):
     cls = self.__class__.__name__
     return "%s(%s, %s)" %(cls, self.pid, self.name)
 
 
+class Thread(Task):
+  """ A single thread of a task with its own affinity and IPC.
+      Threads cannot be stopped one by one, so when a thread runs
+      exclusively other tasks are stopped, but not its siblings.
+  """
+  numa = False  # memory belongs to the whole process
+  inherit = False
+
+  def __init__(self, tid, task, comm=None):
+    kill(tid, 0)
+    self.pid = tid
+    self.task = task
+    self.cpus = ()
+    self.name = "%s/%s" % (task.name, comm or tid)
+    self.counters = None
+
+  def tids(self):
+    return [self.pid]
+
+  def ipc(self, time=0.1):
+    """ Counters of the thread are opened once with perf_event_open
+        (even if cfg.counters is perf), perf is not forked for every sample.
+        Without access to perf_event_open perf counts the whole task.
+    """
+    if not self.session():
+      return ipc(pid=self.perf_pid(), time=time)
+    return self.counters.ipc(time*1000)
+
+  def perf_pid(self):
+    return self.task.pid
+
+  def others(self):
+    return [t for t in self.tasks if t != self.task]
+
+  def exclusive(self):
+    if self.freezer:
+      return self.freezer.exclusive(self.task.pid)
+    for t in self.others():
+      t.kill(SIGSTOP)
+
+
+def expand_threads(tasks, threshold=10, limit=None):
+  """ Replace multi-threaded tasks with their busy threads. There are no
+      more than `limit` (e.g., the number of cpus) tasks and threads in the
+      result, tasks whose threads do not fit are kept whole.
+  """
+  r = []
+  for i, task in enumerate(tasks):
+    threads = task.threads(threshold)
+    left = len(tasks) - i - 1  # every remaining task needs a place too
+    if len(threads) > 1 and limit is not None and len(r) + len(threads) + left > limit:
+      print("{task}: {num} busy threads do not fit into {limit} cpus, placing the task as a whole"
+            .format(task=task, num=len(threads), limit=limit))
+      r.append(task)
+    elif len(threads) > 1:
+      print("{task}: {threads}".format(task=task, threads=threads))
+      r.extend(threads)
+    else:
+      r.append(task)
+  return r
+
+
 def get_sys_ipc(t=cfg.sys_ipc_time):
   r = ipc(time=t)
   log.debug("system IPC: {:.3}".format(r))
   return r
 
 
+sys_counters = None  # system-wide session, unless cfg.counters is perf
+
+
 def get_sys_perf(t=cfg.sys_ipc_time):
-  r = stat(time=t, events=['instructions'], systemwide=True)
+  global sys_counters
+  if cfg.counters == 'perf':
+    r = stat(time=t, events=['instructions'], systemwide=True)
+  else:
+    if sys_counters is None:
+      sys_counters = CounterSession(-1, ['instructions'], source=counter_source()).open()
+    r = sys_counters.measure(t*1000)
   giga_ins = r['instructions'] / t / (1024**3)
   log.debug("system performance: {:.2f} giga instructions per second".format(giga_ins))
   return giga_ins
 
 
-def task_profile(task, shared, ideal, impact, t=cfg.task_profile_time):
+class FreezeBudget:
+  """ Spreads exclusive windows over time: the system is frozen (somebody
+      runs exclusively) no more than `system` fraction of time and every
+      task is frozen no more than `task` fraction of time.
+  """
+
+  def __init__(self, system=0.1, task=None, clock=time.time, sleep=sleep):
+    self.system = system
+    self.task = task
+    self.clock = clock
+    self.sleep = sleep
+    self.start = clock()
+    self.frozen = 0.0                      # time the system was frozen
+    self.task_frozen = defaultdict(float)  # time every task was frozen
+    self.windows = defaultdict(int)        # exclusive windows per task
+    self.waited = 0.0
+
+  def delay(self, task, window):
+    """ How long to wait before task can run exclusively for window seconds. """
+    elapsed = self.clock() - self.start
+    need = (self.frozen + window) / self.system
+    if self.task:
+      for other in task.others():
+        need = max(need, (self.task_frozen[other] + window) / self.task)
+    return max(0, need - elapsed - window)
+
+  def wait(self, task, window):
+    delay = self.delay(task, window)
+    if delay:
+      log.budget.debug("waiting {:.2f}s before freezing others for {}".format(delay, task))
+      self.sleep(delay)
+      self.waited += delay
+
+  def account(self, task, duration):
+    self.frozen += duration
+    self.windows[task] += 1
+    for other in task.others():
+      self.task_frozen[other] += duration
+
+  def report(self):
+    elapsed = self.clock() - self.start
+    total = sum(self.windows.values())
+    print("{num} exclusive windows in {elapsed:.1f}s ({rate:.2f}/s), system frozen {frozen:.1%},"
+          " waited for budget {waited:.1f}s"
+          .format(num=total, elapsed=elapsed, rate=total/elapsed,
+                  frozen=self.frozen/elapsed, waited=self.waited))
+    # profiled threads and tasks which were frozen
+    for task in list(self.windows) + [t for t in Task.tasks if t not in self.windows]:
+      print("  {task}: {num} samples ({rate:.3f}/s), frozen {frozen:.1%}"
+            .format(task=task, num=self.windows[task], rate=self.windows[task]/elapsed,
+                    frozen=self.task_frozen[task]/elapsed))
+
+
+def task_profile(task, shared, ideal, impact, t=cfg.task_profile_time, budget=None):
   # shared performace
   shared_ipc = task.ipc(t)
 
   # ideal performance
+  if budget:
+    budget.wait(task, t)
+  start = time.time()
   task.exclusive()
-  ideal_ipc = task.ipc(t)
-  # unfreeze system
-  task.shared()
+  try:
+    ideal_ipc = task.ipc(t)
+  finally:
+    # unfreeze system
+    task.shared()
+    if budget:
+      budget.account(task, time.time() - start)
   r   = shared_ipc / ideal_ipc
   imp = ideal_ipc - shared_ipc
 
@@ -169,14 +366,28 @@ def task_profile(task, shared, ideal, impact, t=cfg.task_profile_time):
   impact[task].append(imp*r)
 
 
-def sys_optimize_dead_simple1(tasks, repeat=cfg.sys_optimize_samples):
+def profile_tasks(tasks, repeat):
+  """ Round-robin profiling of tasks. With cfg.freeze_budget exclusive
+      windows are spread over time to keep within the budget.
+  """
   shared = defaultdict(list)
   ideal  = defaultdict(list)
   impact = defaultdict(list)
+  budget = None
+  if cfg.freeze_budget:
+    budget = FreezeBudget(cfg.freeze_budget, cfg.task_freeze_budget)
 
   for i in range(repeat):
     for task in tasks:
-      task_profile(task, shared, ideal, impact)
+      task_profile(task, shared, ideal, impact, budget=budget)
+
+  if budget:
+    budget.report()
+  return shared, ideal, impact
+
+
+def sys_optimize_dead_simple1(tasks, repeat=cfg.sys_optimize_samples):
+  shared, ideal, impact = profile_tasks(tasks, repeat)
 
   impact = {}
   for task in tasks:
@@ -188,13 +399,7 @@ def sys_optimize_dead_simple1(tasks, repeat=cfg.sys_optimize_samples):
 
 
 def sys_optimize_dead_simple3(tasks, repeat=cfg.sys_optimize_samples):
-  shared = defaultdict(list)
-  ideal  = defaultdict(list)
-  impact = defaultdict(list)
-
-  for i in range(repeat):
-    for task in tasks:
-      task_profile(task, shared, ideal, impact)
+  shared, ideal, impact = profile_tasks(tasks, repeat)
 
   print_stat(tasks, shared, ideal)
 
@@ -215,6 +420,21 @@ def sys_optimize_dead_simple3(tasks, repeat=cfg.sys_optimize_samples):
     task.set_affinity(others_mask)
 
 
+def sys_optimize_solver(tasks, repeat=cfg.sys_optimize_samples):
+  """ Place tasks with the placement engine. """
+  shared, ideal, impact = profile_tasks(tasks, repeat)
+
+  print_stat(tasks, shared, ideal)
+
+  degradation = {}
+  for task in tasks:
+    degradation[task] = mean(shared[task]) / mean(ideal[task])
+  pairs = PairCache().pairs(tasks, name=lambda t: t.name)
+  cost, placement = solve(tasks, degradation=degradation, pairs=pairs)
+  print("placement (predicted loss {:.3f}): {}".format(cost, placement))
+  apply(placement, method='pin')
+
+
 def print_stat(tasks, shared, ideal):
   for task in tasks:
     s = mean(shared[task])
@@ -225,13 +445,103 @@ def print_stat(tasks, shared, ideal):
         .format(task=task, shared=s, ideal=i, diff=diff, rel=rel))
 
 
-def try_all_permutations(tasks, out):
+def canonical(tasks, perm, top=topology):
+  """ Key of a placement that does not change when sibling threads are
+      swapped or cores (and cache domains) are permuted.
+  """
+  assert len(tasks) <= len(perm), "%s tasks do not fit into %s cpus" % (len(tasks), len(perm))
+  where = {cpu: i for i, (task, cpu) in enumerate(zip(tasks, perm))}
+  domains = defaultdict(list)
+  for core in cores(top):
+    group = tuple(sorted(where[cpu] for cpu in core if cpu in where))
+    if group:
+      domains[cpu_domain(core[0])].append(group)
+  return tuple(sorted(tuple(sorted(groups)) for groups in domains.values()))
+
+
+def measure_placement(tasks, perm):
+  assert len(tasks) <= len(perm), "%s tasks do not fit into %s cpus" % (len(tasks), len(perm))
+  for task, cpu in zip(tasks, perm):
+    task.pin([cpu])
+  sleep(0.1)
+  return get_sys_perf()
+
+
+def try_all_permutations(tasks, out, unique=False):
+  """ Measure every placement. With unique, placements equivalent
+      under core and sibling symmetry are measured only once.
+  """
+  seen = set()
   for i, perm in enumerate(permutations(topology.all)):
-    for task, cpu in zip(tasks, perm):
-      task.pin([cpu])
-    sleep(0.1)
-    perf = get_sys_perf()
+    if unique:
+      key = canonical(tasks, perm)
+      if key in seen:
+        continue
+      seen.add(key)
+    perf = measure_placement(tasks, perm)
     print("{perm} => {perf}".format(perm=perm, perf=perf), file=out)
+  if unique:
+    print("{} unique placements".format(len(seen)), file=out)
+
+
+def anneal_permutations(tasks, out, budget=600, t0=0.05, patience=1000,
+                        measure=measure_placement, top=topology, clock=time.time, rng=None):
+  """ Simulated annealing over placements for `budget` seconds.
+      A move swaps the cpus of two tasks (or a task and an idle cpu),
+      equivalent placements are measured once. t0 is the initial
+      temperature in terms of relative performance difference, it falls
+      linearly to 0 by the end of the budget. Stops earlier if
+      `patience` moves in a row hit measured placements.
+      Returns (best perf, best placement, convergence curve).
+  """
+  rng = rng or Random()
+  start = clock()
+  measured = {}  # canonical key -> perf
+
+  def evaluate(perm):
+    key = canonical(tasks, perm, top)
+    if key not in measured:
+      measured[key] = measure(tasks, perm)
+    return measured[key]
+
+  cur = list(top.all)
+  cur_perf = evaluate(cur)
+  best, best_perf = list(cur), cur_perf
+  curve = [(clock() - start, len(measured), best_perf)]
+  stale = 0
+  while stale < patience:
+    elapsed = clock() - start
+    if elapsed >= budget:
+      break
+    temp = t0 * (1 - elapsed / budget)
+    new = list(cur)
+    i, j = rng.randrange(len(tasks)), rng.randrange(len(new))
+    new[i], new[j] = new[j], new[i]
+    if canonical(tasks, new, top) == canonical(tasks, cur, top):
+      stale += 1
+      continue
+    known = len(measured)
+    perf = evaluate(new)
+    if len(measured) == known:
+      stale += 1
+    else:
+      stale = 0
+      curve.append((clock() - start, len(measured), best_perf))
+    delta = (perf - cur_perf) / cur_perf
+    if delta > 0 or rng.random() < math.exp(delta / temp):
+      cur, cur_perf = new, perf
+    if cur_perf > best_perf:
+      best, best_perf = list(cur), cur_perf
+      curve[-1] = (curve[-1][0], curve[-1][1], best_perf)
+    print("{perm} => {perf} (best {best}, T={temp:.4f})"
+          .format(perm=tuple(new), perf=perf, best=best_perf, temp=temp), file=out)
+
+  print("best placement {perm} => {perf} after {num} measurements"
+        .format(perm=tuple(best), perf=best_perf, num=len(measured)), file=out)
+  print("convergence (time, measurements, best):", file=out)
+  for t, num, perf in curve:
+    print("{:.1f} {} {}".format(t, num, perf), file=out)
+  return best_perf, best, curve
 
 
 if __name__ == '__main__':
@@ -242,6 +552,25 @@ if __name__ == '__main__':
                       help="consider only tasks consuming more CPU than this")
   parser.add_argument('-o', '--output',
                       help="output file")
+  parser.add_argument('-O', '--optimizer', default='simple3', choices=['simple1', 'simple3', 'solver'],
+                      help="how to optimize task placement with --search=none")
+  parser.add_argument('-F', '--freezer', default=False, const=True, action='store_const',
+                      help="freeze tasks with cgroup v2 freezer instead of SIGSTOP")
+  parser.add_argument('-f', '--freeze-budget', type=float,
+                      help="max fraction of time the system is frozen by profiling, e.g. 0.05")
+  parser.add_argument('--task-freeze-budget', type=float,
+                      help="max fraction of time a single task is frozen")
+  parser.add_argument('-C', '--counters', default='perf', choices=['perf', 'native', 'fake'],
+                      help="how to read counters: perf tool, perf_event_open or a fake")
+  parser.add_argument('-T', '--threads', default=False, const=True, action='store_const',
+                      help="place and measure busy threads of tasks separately")
+  parser.add_argument('-N', '--numa', default=False, const=True, action='store_const',
+                      help="migrate memory of tasks to the node of their new cpus")
+  parser.add_argument('-S', '--search', default='all', choices=['all', 'unique', 'anneal', 'none'],
+                      help="explore placements: all permutations (default), unique ones,"
+                           " annealing, or none to optimize the placement with --optimizer")
+  parser.add_argument('-B', '--budget', type=float, default=600,
+                      help="time budget for --search=anneal, seconds")
   args = parser.parse_args()
 
   log.main.info("config:", args)
@@ -253,13 +582,29 @@ if __name__ == '__main__':
     logfilter.rules = [
       ('profile.task.*', False)
     ]
+  out = sys.stdout
   if args.output:
     out = open(args.output, 'at')
 
+  Task.numa = args.numa
+  cfg.counters = args.counters
+  cfg.freeze_budget = args.freeze_budget
+  cfg.task_freeze_budget = args.task_freeze_budget
+  if args.freezer:
+    Task.freezer = CgroupFreezer(name="profile")
+    atexit.register(Task.freezer.release)
+
   wait_idleness(cfg.idleness, t=3)
   tasks = generate_load(num=len(topology.all))
-  try_all_permutations(tasks, out)
-  import sys; sys.exit()
+  if args.threads:
+    sleep(cfg.warmup_time)
+    tasks = expand_threads(tasks, args.threshold, limit=len(topology.all))
+  if args.search == 'anneal':
+    anneal_permutations(tasks, out, budget=args.budget)
+    sys.exit()
+  elif args.search != 'none':
+    try_all_permutations(tasks, out, unique=args.search == 'unique')
+    sys.exit()
 
   #warm-up
   sleep(cfg.warmup_time)
@@ -267,7 +612,10 @@ if __name__ == '__main__':
   # initial performance
   perf_before =  get_sys_perf()
 
-  sys_optimize_dead_simple3(tasks)
+  optimizers = dict(simple1=sys_optimize_dead_simple1,
+                    simple3=sys_optimize_dead_simple3,
+                    solver=sys_optimize_solver)
+  optimizers[args.optimizer](tasks)
 
   # after tasks were optimized
   perf_after =  get_sys_perf()
@@ -2,12 +2,8 @@
 
 from perf.perftool import NotCountedError
 from libvmc import main, manager
-from subprocess import check_call
-from threading import current_thread
-from collections import defaultdict
-from statistics import StatisticsError
-from os import unlink
-import shlex
+from perfstream import record
+from subsamples import Subsamples
 
 from config import VMS as vms  # do not remove, this triggers population of config
 
@@ -15,50 +11,41 @@ from config import VMS as vms  # do not remove, this triggers population of conf
 #PERF = "/home/sources/abs/core/linux/src/linux-3.19/tools/perf/perf"
 #PERF = "perf"
 PERF = "/home/sources/perf_lite"
+IPC_EVENTS = ['instructions', 'cycles']
 
 
 def ipcistat(vm, interval, subinterval, events=['cycles', 'instructions']):
+  """ Per-subinterval counters (Subsamples), parsed while perf is running.
+      An attached counter session is used if it is fine-grained enough.
+      events must include instructions and cycles.
+  """
+  missing = set(IPC_EVENTS) - set(events)
+  assert not missing, "ipcistat needs %s" % ", ".join(sorted(missing))
+  session = getattr(vm, 'counters', None)
+  if session is not None and set(events) <= set(session.events) \
+      and subinterval / 1000 >= session.source.resolution:
+    return session_ipcistat(session, interval, subinterval, events)
+
   interval = interval / 1000
-  nc = 0  # num of not counted events
-  CMD = "{perf} kvm stat -e {events} -o {out} -x, -I {subinterval} -p {pid} sleep {interval}"
-  out = "/tmp/perf_%s_%s" % (vm.bname, current_thread().ident)
+  CMD = "{perf} kvm stat -e {events} -x, -I {subinterval} -p {pid} sleep {interval}"
   cmd = CMD.format(perf=PERF, pid=vm.pid, events=",".join(events),
-                   out=out, subinterval=subinterval, interval=interval)
-  try:
-    check_call(shlex.split(cmd))
-  except:
+                   subinterval=subinterval, interval=interval)
+  r = record(cmd, events)
+  ratio = r.missing/len(r['cycles'])
+  if ratio > 0.3:
+    print("nc", r.missing, ratio)
+  r = Subsamples.from_columns(r, events)
+  if not r.counted(*IPC_EVENTS).any():
     raise NotCountedError
-  with open(out) as fd:
-    result = fd.read()
-  unlink(out)
+  return r
 
-  r = defaultdict(list)
-  for s in result.splitlines():
-    try:
-      _, rawcnt, _, ev = s.split(',')
-    except ValueError:
-      continue
-    if rawcnt == '<not counted>':
-      print('missing subsample')
-      nc += 1
-      rawcnt = 0
-    r[ev].append(int(rawcnt))
-  instructions = r['instructions']
-  cycles = r['cycles']
-  assert len(instructions) == len(cycles)
-  for pos, (i, c) in enumerate(zip(instructions, cycles)):
-    if i == 0 or c == 0:
-      instructions[pos] = cycles[pos] = 0
 
-  nc = 0
-  ratio = nc/len(result.splitlines())
-  if ratio > 0.3:
-    print("nc", nc, ratio)
-  try:
-    return {'instructions': instructions, 'cycles': cycles}
-  except (ZeroDivisionError, StatisticsError):
-    print(cmd)
+def session_ipcistat(session, interval, subinterval, events=['cycles', 'instructions']):
+  """ Like ipcistat, but reads an already attached counter session. """
+  r = Subsamples.from_columns(session.subsample(interval, subinterval), events)
+  if not r.counted(*IPC_EVENTS).any():
     raise NotCountedError
+  return r
 
 
 if __name__ == '__main__':
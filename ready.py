@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+""" Readiness probes: return as soon as VMs or benchmarks are up
+    instead of sleeping for a fixed amount of time.
+"""
+
+from procfs import pid_ticks, CLK_TCK
+
+from socket import create_connection
+import time
+
+
+def wait_for(probe, timeout, what="condition", poll=0.2, clock=time.time, sleep=time.sleep):
+  """ Wait until probe() is true. On timeout it just gives up with a warning
+      (the same as a fixed sleep would do). Returns waited time.
+  """
+  t = clock()
+  deadline = t + timeout
+  while not probe():
+    if clock() > deadline:
+      print("%s is not ready after %ss, proceeding anyway" % (what, timeout))
+      break
+    sleep(poll)
+  waited = clock() - t
+  print("waited %.1fs for %s" % (waited, what))
+  return waited
+
+
+def reachable(addr, port=22, timeout=0.5):
+  """ Guest accepts TCP connections (sshd is up). """
+  try:
+    create_connection((addr, port), timeout=timeout).close()
+    return True
+  except OSError:
+    return False
+
+
+def cpu_usage(pid, period=0.2):
+  """ CPU usage of the process in percent of one core. """
+  try:
+    before = pid_ticks(pid)
+    time.sleep(period)
+    after = pid_ticks(pid)
+  except OSError:
+    return 0
+  return (after - before) / CLK_TCK / period * 100
+
+
+def booted(vm):
+  addr = getattr(vm, 'addr', None)
+  if not vm.pid:
+    return False
+  if addr is None:
+    return True  # nothing to probe, e.g., bare metal
+  return reachable(addr)
+
+
+def running(vm, threshold=30):
+  """ Benchmark process is alive and the VM is busy. """
+  pipe = getattr(vm, 'pipe', None)
+  if pipe is None or pipe.poll() is not None:
+    return False
+  return cpu_usage(vm.pid) > threshold
+
+
+def wait_dead(vms, timeout=3):
+  return wait_for(lambda: not any(vm.pid for vm in vms), timeout, what="VMs to die")
+
+
+def wait_booted(vms, timeout=10):
+  return wait_for(lambda: all(booted(vm) for vm in vms), timeout, what="VMs to boot")
+
+
+def wait_running(vms, timeout=10, threshold=30):
+  return wait_for(lambda: all(running(vm, threshold) for vm in vms), timeout,
+                  what="benchmarks to start")
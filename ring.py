@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+""" Shared-memory ring buffer for live samples.
+
+    One producer appends fixed-size records (timestamp, key, values) to a
+    file in /dev/shm, any number of readers in other processes follow it.
+    The producer never waits for readers: a reader that falls behind by
+    more than the ring size loses the oldest records.
+
+    Layout:
+      header  -- magic, number of slots, number of values, head, meta size
+      meta    -- JSON with names of keys and values, META bytes reserved
+      records -- slots of RECORD dtype
+"""
+
+from os.path import join
+import numpy as np
+import struct
+import json
+import mmap
+import time
+import os
+
+
+MAGIC = b'PERFRNG1'
+HEADER = struct.Struct("8sQQQQ")
+HEAD_OFFSET = 8 + 8 + 8  # offset of the head counter
+META = 4096
+BASE = "/dev/shm"
+
+
+def record_dtype(nvalues):
+  return np.dtype([('seq', 'u8'), ('time', 'f8'), ('key', 'u8'), ('values', 'f8', (nvalues,))])
+
+
+class Ring:
+  def __init__(self, path, fd, mm):
+    self.path = path
+    self.fd = fd
+    self.mm = mm
+    magic, self.slots, nvalues, _, metalen = HEADER.unpack_from(mm)
+    assert magic == MAGIC, "%s is not a ring buffer" % path
+    meta = json.loads(bytes(mm[HEADER.size:HEADER.size+metalen]).decode())
+    self.keys = meta['keys']
+    self.fields = meta['fields']
+    self.head = np.frombuffer(mm, dtype='u8', count=1, offset=HEAD_OFFSET)
+    self.records = np.frombuffer(mm, dtype=record_dtype(nvalues), count=self.slots,
+                                 offset=HEADER.size + META)
+
+  @classmethod
+  def create(cls, name, keys, fields, slots=4096, base=BASE):
+    """ Create a ring for records of len(fields) values about keys. """
+    path = join(base, "perforator-%s" % name)
+    meta = json.dumps(dict(keys=list(keys), fields=list(fields))).encode()
+    assert len(meta) <= META, "too many keys or fields"
+    size = HEADER.size + META + slots * record_dtype(len(fields)).itemsize
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+    os.ftruncate(fd, size)
+    mm = mmap.mmap(fd, size)
+    HEADER.pack_into(mm, 0, MAGIC, slots, len(fields), 0, len(meta))
+    mm[HEADER.size:HEADER.size+len(meta)] = meta
+    return cls(path, fd, mm)
+
+  @classmethod
+  def open(cls, name, base=BASE):
+    path = join(base, "perforator-%s" % name)
+    fd = os.open(path, os.O_RDONLY)
+    mm = mmap.mmap(fd, 0, prot=mmap.PROT_READ)
+    return cls(path, fd, mm)
+
+  # PRODUCER
+
+  def write(self, key, values, ts=None):
+    """ Append a record, key is an index in self.keys. """
+    i = int(self.head[0])
+    rec = self.records[i % self.slots]
+    rec['seq'] = 0  # readers skip the slot while it is being written
+    rec['time'] = ts if ts is not None else time.time()
+    rec['key'] = key
+    rec['values'] = values
+    rec['seq'] = i + 1
+    self.head[0] = i + 1
+
+  # READERS
+
+  def read(self, since=0):
+    """ Records written after `since` (a count returned by a previous
+        call) as (records, new since). Overwritten records are skipped.
+    """
+    head = int(self.head[0])
+    start = max(since, head - self.slots)
+    if start >= head:
+      return self.records[:0].copy(), head
+    idx = np.arange(start, head) % self.slots
+    r = self.records[idx].copy()
+    # drop records that were being overwritten while we were copying
+    ok = (r['seq'] == np.arange(start, head) + 1) & \
+         (self.records['seq'][idx] == r['seq'])
+    return r[ok], head
+
+  def latest(self):
+    """ {key name: (time, {field: value})} of the last record of every key. """
+    records, _ = self.read(max(0, int(self.head[0]) - self.slots))
+    r = {}
+    for rec in records:
+      r[self.keys[rec['key']]] = float(rec['time']), dict(zip(self.fields, rec['values'].tolist()))
+    return r
+
+  def close(self):
+    del self.head, self.records
+    self.mm.close()
+    os.close(self.fd)
+
+  def unlink(self):
+    os.unlink(self.path)
+
+
+if __name__ == '__main__':
+  import argparse
+  parser = argparse.ArgumentParser(description='Print samples from a ring buffer as they come')
+  parser.add_argument('name', help="name of the ring, e.g. gui")
+  parser.add_argument('-p', '--poll', type=float, default=0.5, help="poll interval, seconds")
+  args = parser.parse_args()
+  ring = Ring.open(args.name)
+  print("time", "key", *ring.fields, sep='\t')
+  since = 0
+  while True:
+    records, since = ring.read(since)
+    for rec in records:
+      print("{:.3f}".format(rec['time']), ring.keys[rec['key']], *rec['values'].tolist(), sep='\t')
+    time.sleep(args.poll)
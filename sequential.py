@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+""" Sequential stopping rule: take samples until the confidence interval
+    is narrow enough instead of taking a fixed number of them.
+"""
+
+from collections import defaultdict
+from math import sqrt
+
+
+class Welford:
+  """ Running mean and variance (Welford's algorithm). """
+
+  def __init__(self):
+    self.n = 0
+    self.mean = 0.0
+    self.m2 = 0.0
+
+  def add(self, x):
+    self.n += 1
+    delta = x - self.mean
+    self.mean += delta / self.n
+    self.m2 += delta * (x - self.mean)
+
+  @property
+  def variance(self):
+    if self.n < 2:
+      return float('inf')
+    return self.m2 / (self.n - 1)
+
+  @property
+  def sem(self):
+    """ Standard error of the mean. """
+    return sqrt(self.variance / self.n)
+
+
+def ci_student(w, confidence=0.9):
+  """ Relative width of Student-t confidence interval,
+      the same as plot.ci_student() but for running statistics.
+  """
+  from scipy.stats import t
+  if w.n < 2 or not w.mean:
+    return float('inf')
+  h = w.sem * t.ppf((1+confidence)/2, w.n-1)
+  return abs((2*h)/w.mean)
+
+
+class Sequential:
+  """ Tracks several series per key (e.g., 'shared' and 'frozen'
+      measurements of a VM). A key is done when the sum of relative
+      confidence intervals of its series drops below `precision`
+      (that bounds the interval of their ratio) or when any series
+      reached `maxnum` samples.
+  """
+
+  def __init__(self, precision=0.05, confidence=0.9, minnum=3, maxnum=100):
+    self.precision = precision
+    self.confidence = confidence
+    self.minnum = minnum
+    self.maxnum = maxnum
+    self.stats = defaultdict(lambda: defaultdict(Welford))
+
+  def feed(self, key, series, values):
+    """ Add values that were not seen yet (values is a growing list). """
+    w = self.stats[key][series]
+    for v in values[w.n:]:
+      w.add(v)
+
+  def ci(self, key):
+    series = self.stats[key].values()
+    if not series:
+      return float('inf')
+    return sum(ci_student(w, self.confidence) for w in series)
+
+  def num(self, key):
+    series = self.stats[key].values()
+    return min((w.n for w in series), default=0)
+
+  def done(self, key):
+    series = self.stats[key].values()
+    if any(w.n >= self.maxnum for w in series):
+      return True
+    if self.num(key) < self.minnum:
+      return False
+    return self.ci(key) <= self.precision
+
+  def pending(self, keys):
+    return [key for key in keys if not self.done(key)]
+
+  def report(self, keys, name=str):
+    for key in keys:
+      print("{key}: {num} samples, ci {ci:.2%}"
+            .format(key=name(key), num=self.num(key), ci=self.ci(key)))
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+""" Append-only column-oriented result store.
+
+    Samples are written to disk as soon as they are taken, so a crash
+    does not lose the whole run. Every series is split into numeric
+    columns (one file per field), they can be loaded lazily one by one
+    and memory-mapped on the analysis side.
+
+    Layout of a store directory:
+      meta.pickle  -- Struct(f, fargs, prog_args), written at start
+      result.pickle -- return value of the test, written at the end
+      index        -- one line per column: series, field, typecode, file
+      N.col        -- raw values of a column
+"""
+
+from useful.mystruct import Struct
+
+from collections import defaultdict, OrderedDict
+from threading import Lock
+from array import array
+from os.path import join, exists
+import pickle
+import os
+
+
+RAGGED = '#len'  # field with lengths of variable-sized samples
+NUMPY_TYPES = {'d': 'float64', 'q': 'int64'}
+
+
+def label(key):
+  """ String name of a result key (VM, benchmark name or tuple of them).
+      A VM is named by its benchmark and its own name, e.g. matrix@vm0.
+  """
+  if isinstance(key, tuple):
+    return "-".join(label(k) for k in key)
+  bname = getattr(key, 'bname', None)
+  if bname:
+    name = "%s@%s" % (bname, getattr(key, 'name', None) or key)
+  else:
+    name = str(key)
+  return name.replace('/', '_')
+
+
+def typecode(values):
+  """ 'q' if all values are integers, 'd' otherwise. """
+  return 'q' if all(isinstance(v, int) for v in values) else 'd'
+
+
+def flatten(value):
+  """ Sample -> {field: [numbers]} """
+  if isinstance(value, (int, float)):
+    return {'value': [value]}
+  if isinstance(value, (tuple, list)):
+    return {str(i): [v] for i, v in enumerate(value)}
+  if hasattr(value, 'columns'):  # Subsamples
+    value = value.columns()
+  if isinstance(value, dict):
+    r = {}
+    for field, v in value.items():
+      if isinstance(v, (int, float)):
+        r[field] = [v]
+      else:
+        r[field] = list(v)
+        r[field + RAGGED] = [len(v)]
+    return r
+  raise TypeError("cannot store %r" % (value,))
+
+
+class Store:
+  def __init__(self, path, mode='r'):
+    """ mode is 'r', 'w' (append to the store if it exists)
+        or 'x' (a new store, fails if it exists).
+    """
+    assert mode in ('r', 'w', 'x'), "unknown mode %r" % mode
+    self.path = path
+    self.mode = mode
+    self.columns = OrderedDict()  # (series, field) -> (typecode, fname)
+    self.fds = {}
+    self.lock = Lock()  # samplers write from several threads
+    if mode in ('w', 'x'):
+      os.makedirs(path, exist_ok=(mode == 'w'))
+      self.index = open(join(path, "index"), 'at')
+    self.read_index()
+
+  def read_index(self):
+    fname = join(self.path, "index")
+    if not exists(fname):
+      return
+    with open(fname) as fd:
+      for line in fd:
+        series, field, code, col = line.rstrip('\n').split('\t')
+        self.columns[series, field] = code, col
+
+  # WRITING
+
+  def set_meta(self, **kwargs):
+    with open(join(self.path, "meta.pickle"), 'wb') as fd:
+      pickle.dump(Struct(**kwargs), fd)
+
+  def set_result(self, result):
+    with open(join(self.path, "result.pickle"), 'wb') as fd:
+      pickle.dump(result, fd)
+
+  def column(self, series, field, code):
+    """ File of the column and its typecode. An integer column is
+        converted to floats when a float comes.
+    """
+    key = series, field
+    if key not in self.columns:
+      col = "%s.col" % len(self.columns)
+      self.columns[key] = code, col
+      print(series, field, code, col, sep='\t', file=self.index, flush=True)
+    elif self.columns[key][0] == 'q' and code == 'd':
+      self.promote(key)
+    if key not in self.fds:
+      code, col = self.columns[key]
+      self.fds[key] = open(join(self.path, col), 'ab')
+    return self.fds[key], self.columns[key][0]
+
+  def promote(self, key):
+    """ Rewrite an integer column as floats, the last index line wins. """
+    _, col = self.columns[key]
+    if key in self.fds:
+      self.fds.pop(key).close()
+    fname = join(self.path, col)
+    old = array('q')
+    with open(fname, 'rb') as fd:
+      old.frombytes(fd.read())
+    with open(fname, 'wb') as fd:
+      fd.write(array('d', old).tobytes())
+    self.columns[key] = 'd', col
+    print(key[0], key[1], 'd', col, sep='\t', file=self.index, flush=True)
+
+  def write(self, series, value):
+    """ Append one sample to the series, hits the disk immediately. """
+    with self.lock:
+      for field, values in flatten(value).items():
+        fd, code = self.column(series, field, typecode(values))
+        fd.write(array(code, values).tobytes())
+        fd.flush()
+
+  def results(self, name):
+    """ Result dict that records everything appended to its lists. """
+    return Results(self, name)
+
+  def close(self):
+    for fd in self.fds.values():
+      fd.close()
+    self.fds = {}
+    if self.mode in ('w', 'x'):
+      self.index.close()
+
+  # READING
+
+  @property
+  def meta(self):
+    with open(join(self.path, "meta.pickle"), 'rb') as fd:
+      return pickle.load(fd)
+
+  @property
+  def result(self):
+    """ What the test returned, None if it was not saved. """
+    fname = join(self.path, "result.pickle")
+    if not exists(fname):
+      return None
+    with open(fname, 'rb') as fd:
+      return pickle.load(fd)
+
+  def series(self):
+    return list(OrderedDict.fromkeys(series for series, _ in self.columns))
+
+  def load(self, series, field):
+    """ Memory-mapped column. """
+    import numpy as np
+    code, col = self.columns[series, field]
+    fname = join(self.path, col)
+    if not os.path.getsize(fname):
+      return np.array([], dtype=NUMPY_TYPES[code])
+    return np.memmap(fname, dtype=NUMPY_TYPES[code], mode='r')
+
+  def __getitem__(self, series):
+    """ Series as {field: column}, a scalar series is returned as a column.
+        Ragged fields are split into per-sample arrays.
+    """
+    import numpy as np
+    fields = [f for s, f in self.columns if s == series]
+    if not fields:
+      raise KeyError(series)
+    if fields == ['value']:
+      return self.load(series, 'value')
+    r = {}
+    for field in fields:
+      if field.endswith(RAGGED):
+        continue
+      col = self.load(series, field)
+      if field + RAGGED in fields:
+        lens = self.load(series, field + RAGGED)
+        col = np.split(col, np.cumsum(lens)[:-1])
+      r[field] = col
+    return r
+
+  def tree(self):
+    """ Nested dicts of series, {'isolated': {'matrix': ...}} """
+    return View(self, "")
+
+
+class View:
+  """ Lazy read-only view on series with a common prefix. """
+
+  def __init__(self, store, prefix):
+    self.store = store
+    self.prefix = prefix
+
+  def keys(self):
+    prefix = self.prefix
+    names = [s[len(prefix):] for s in self.store.series() if s.startswith(prefix)]
+    return list(OrderedDict.fromkeys(name.split('/')[0] for name in names))
+
+  def __iter__(self):
+    return iter(self.keys())
+
+  def __len__(self):
+    return len(self.keys())
+
+  def __contains__(self, key):
+    return key in self.keys()
+
+  def __getitem__(self, key):
+    name = self.prefix + key
+    if name in self.store.series():
+      return self.store[name]
+    if key not in self.keys():
+      raise KeyError(key)
+    return View(self.store, name + '/')
+
+  def __getattr__(self, key):
+    try:
+      return self[key]
+    except KeyError:
+      raise AttributeError(key)
+
+  def items(self):
+    return [(key, self[key]) for key in self.keys()]
+
+  def values(self):
+    return [self[key] for key in self.keys()]
+
+
+class Series(list):
+  """ List that writes every appended sample through to the store. """
+
+  def __init__(self, store, name):
+    super().__init__()
+    self.store = store
+    self.name = name
+
+  def append(self, value):
+    super().append(value)
+    self.store.write(self.name, value)
+
+  def __reduce__(self):
+    return list, (list(self),)
+
+
+class Results(defaultdict):
+  """ defaultdict(list) replacement whose lists are Series. """
+
+  def __init__(self, store, name):
+    super().__init__()
+    self.store = store
+    self.name = name
+
+  def __missing__(self, key):
+    series = Series(self.store, "%s/%s" % (self.name, label(key)))
+    self[key] = series
+    return series
+
+  def __reduce__(self):
+    return dict, (dict(self),)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+""" Compact storage of per-subinterval counters.
+
+    A measurement with subsampling is a block of int64 counters, one row
+    per subinterval and one column per event. Analysis helpers work on
+    whole columns instead of Python lists. A zero counter means it was
+    not counted, helpers skip such fields instead of dividing by them.
+"""
+
+import numpy as np
+
+
+class Subsamples:
+  __slots__ = ('data', 'events')
+
+  def __init__(self, data, events):
+    self.data = np.asarray(data, dtype=np.int64).reshape(-1, len(events))
+    self.events = list(events)
+
+  @classmethod
+  def from_columns(cls, columns, events=None):
+    """ From {event: [counts]} as returned by perf parsers. """
+    if isinstance(columns, cls):
+      return columns
+    events = list(events or columns.keys())
+    n = min(len(columns[ev]) for ev in events) if events else 0
+    data = np.empty((n, len(events)), dtype=np.int64)
+    for i, ev in enumerate(events):
+      data[:, i] = np.asarray(columns[ev][:n], dtype=np.int64)
+    return cls(data, events)
+
+  # dict-like access to columns
+
+  def __getitem__(self, event):
+    return self.data[:, self.events.index(event)]
+
+  def __contains__(self, event):
+    return event in self.events
+
+  def keys(self):
+    return list(self.events)
+
+  def items(self):
+    return [(ev, self[ev]) for ev in self.events]
+
+  def columns(self):
+    """ {event: list of counts} """
+    return {ev: self[ev].tolist() for ev in self.events}
+
+  def __len__(self):
+    return len(self.data)
+
+  def __repr__(self):
+    return "Subsamples(%s x %s)" % (len(self), self.events)
+
+  def __getstate__(self):
+    return self.data, self.events
+
+  def __setstate__(self, state):
+    self.data, self.events = state
+
+  # analysis
+
+  def skip(self, n):
+    """ Without the first n subintervals. """
+    return Subsamples(self.data[n:], self.events)
+
+  def counted(self, *events):
+    """ Rows where all events were counted. perf parsers store
+        counters that were not counted as 0, other events of the
+        same row stay valid.
+    """
+    return (self.data[:, [self.events.index(ev) for ev in events]] != 0).all(axis=1)
+
+  def ipc(self):
+    """ IPC of every subinterval, NaN where instructions or cycles
+        were not counted.
+    """
+    valid = self.counted('instructions', 'cycles')
+    r = np.full(len(self), np.nan)
+    r[valid] = self['instructions'][valid] / self['cycles'][valid]
+    return r
+
+  def mean(self, event):
+    """ Mean over subintervals where event was counted, NaN if none. """
+    counts = self[event][self.counted(event)]
+    return counts.mean() if len(counts) else float('nan')
+
+  def total_ipc(self):
+    """ IPC of subintervals where both counters were counted,
+        None if there are none.
+    """
+    valid = self.counted('instructions', 'cycles')
+    if not valid.any():
+      return None
+    return self['instructions'][valid].sum() / self['cycles'][valid].sum()
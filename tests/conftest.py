@@ -0,0 +1,5 @@
+import sys
+from os.path import dirname, abspath
+
+# modules of the project are flat, at the top of the repository
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
@@ -0,0 +1,55 @@
+from io import StringIO
+from random import Random
+
+from profile import anneal_permutations
+
+
+class Topology:
+  """ 3 cores with 2 hyper-threads each """
+  all = list(range(6))
+  no_ht = [0, 1, 2]
+  ht_map = {0: [3], 1: [4], 2: [5], 3: [0], 4: [1], 5: [2]}
+
+
+class Clock:
+  """ Every look at the clock takes a second. """
+  def __init__(self):
+    self.now = 0
+
+  def __call__(self):
+    self.now += 1
+    return self.now
+
+
+def pairing(perm):
+  """ Pairs of tasks sharing a core. """
+  core = {cpu: min([cpu] + Topology.ht_map[cpu]) for cpu in Topology.all}
+  cores = {}
+  for task, cpu in enumerate(perm):
+    cores.setdefault(core[cpu], set()).add(task)
+  return frozenset(frozenset(tasks) for tasks in cores.values())
+
+
+LOCAL = pairing([0, 1, 2, 3, 4, 5])   # 03 14 25, where the search starts
+GLOBAL = pairing([0, 3, 1, 4, 2, 5])  # 01 23 45, two swaps away
+
+
+def measure(tasks, perm):
+  """ The start is a local optimum: every single swap makes it worse. """
+  p = pairing(perm)
+  if p == GLOBAL:
+    return 1.0
+  if p == LOCAL:
+    return 0.9
+  if len(p & LOCAL) == 1:  # a neighbour of the local optimum
+    return 0.85
+  return 0.8
+
+
+def test_escapes_local_optimum():
+  tasks = list("abcdef")
+  for seed in range(5):
+    best_perf, best, _ = anneal_permutations(tasks, StringIO(), budget=2000, measure=measure,
+                                             top=Topology, clock=Clock(), rng=Random(seed))
+    assert best_perf == 1.0
+    assert pairing(best) == GLOBAL
@@ -0,0 +1,47 @@
+import pytest
+
+from checkpoint import Checkpoint, Error
+
+
+def test_resume(tmp_path):
+  path = str(tmp_path / "ckpt")
+  calls = []
+
+  def step(i):
+    calls.append(i)
+    return i * 10
+
+  ckpt = Checkpoint(path, spec="func=test")
+  assert ckpt.run(('step', 0), step, 0) == 0
+  assert ckpt.run(('step', 1), step, 1) == 10
+  ckpt.close()
+
+  ckpt = Checkpoint(path, spec="func=test")
+  assert ('step', 1) in ckpt
+  assert ckpt.run(('step', 1), step, 1) == 10
+  assert ckpt.run(('step', 2), step, 2) == 20
+  ckpt.close()
+  assert calls == [0, 1, 2]
+
+
+def test_truncated_record_is_dropped(tmp_path):
+  path = str(tmp_path / "ckpt")
+  ckpt = Checkpoint(path, spec="s")
+  ckpt.save('a', 1)
+  ckpt.save('b', list(range(100)))
+  ckpt.close()
+  with open(path, 'r+b') as fd:
+    fd.truncate(fd.seek(0, 2) - 10)
+
+  ckpt = Checkpoint(path, spec="s")
+  assert 'a' in ckpt and 'b' not in ckpt
+  ckpt.save('c', 3)
+  ckpt.close()
+  assert Checkpoint(path, spec="s")['c'] == 3
+
+
+def test_other_spec(tmp_path):
+  path = str(tmp_path / "ckpt")
+  Checkpoint(path, spec="one").close()
+  with pytest.raises(Error):
+    Checkpoint(path, spec="two")
@@ -0,0 +1,46 @@
+import pytest
+
+from counters import CounterSession, FakeSource
+
+
+class Clock:
+  """ Time that only moves when somebody sleeps. """
+  def __init__(self):
+    self.now = 100.0
+
+  def __call__(self):
+    return self.now
+
+  def sleep(self, t):
+    self.now += t
+
+
+@pytest.fixture
+def clock():
+  return Clock()
+
+
+def test_measure(clock):
+  source = FakeSource({'cycles': 10**6, 'instructions': 5*10**5}, clock=clock)
+  with CounterSession(1, source=source, sleep=clock.sleep) as session:
+    r = session.measure(100)
+    assert r['cycles'] == pytest.approx(10**5, abs=1)
+    assert r['instructions'] == pytest.approx(5*10**4, abs=1)
+    assert session.ipc(100) == pytest.approx(0.5, rel=0.001)
+
+
+def test_subsample_resolution(clock):
+  source = FakeSource({'cycles': 10**6, 'instructions': 10**6}, clock=clock)
+  source.resolution = 0.002
+  with CounterSession(1, source=source, sleep=clock.sleep) as session:
+    r = session.subsample(100, 2)
+    assert len(r['cycles']) == 50
+    assert sum(r['cycles']) == pytest.approx(10**5, rel=0.01)
+
+
+def test_subsample_finer_than_source(clock):
+  source = FakeSource(clock=clock)
+  source.resolution = 0.01
+  with CounterSession(1, source=source, sleep=clock.sleep) as session:
+    with pytest.raises(AssertionError):
+      session.subsample(100, 2)
@@ -0,0 +1,43 @@
+from domains import cpu_domain, group_by_domain
+
+
+class VM:
+  def __init__(self, name, cpus):
+    self.name = name
+    self.cpus = cpus
+
+  def __repr__(self):
+    return self.name
+
+
+# two LLCs with 4 cpus each
+MAPPING = {cpu: cpu // 4 for cpu in range(8)}
+
+
+def test_cpu_domain(tmp_path):
+  base = tmp_path / "cpu0"
+  (base / "topology").mkdir(parents=True)
+  (base / "topology" / "physical_package_id").write_text("1\n")
+  sysfs = str(tmp_path / "cpu{cpu}") + "/"
+  # no cache info: the socket
+  assert cpu_domain(0, sysfs) == 1
+  (base / "cache" / "index3").mkdir(parents=True)
+  (base / "cache" / "index3" / "id").write_text("7\n")
+  assert cpu_domain(0, sysfs) == 7
+  # nothing known
+  assert cpu_domain(1, sysfs) == 0
+
+
+def test_pinned_vms_are_split():
+  a, b, c, d = VM('a', [0]), VM('b', [4]), VM('c', [1]), VM('d', [5])
+  assert group_by_domain([a, b, c, d], MAPPING) == [[a, c], [b, d]]
+
+
+def test_spanning_vm_glues_domains():
+  a, b, c = VM('a', [0]), VM('b', [4]), VM('c', [3, 4])
+  assert group_by_domain([a, b, c], MAPPING) == [[a, b, c]]
+
+
+def test_unknown_cpus_are_in_domain_0():
+  a, b = VM('a', [0]), VM('b', [100])
+  assert group_by_domain([a, b], MAPPING) == [[a, b]]
@@ -0,0 +1,70 @@
+import pytest
+
+from eventsched import schedule, measure
+from perf.perftool import NotCountedError
+
+
+EVENTS = ['instructions', 'cache-misses', 'LLC-loads', 'LLC-load-misses',
+          'branch-misses', 'node-loads', 'minor-faults']
+
+
+class Stat:
+  """ A task that runs at constant rates, every `fail`-th call is not counted. """
+  rates = {'cycles': 1000, 'instructions': 500, 'cache-misses': 10, 'LLC-loads': 20,
+           'LLC-load-misses': 5, 'branch-misses': 7, 'node-loads': 3, 'minor-faults': 1}
+
+  def __init__(self, fail=None):
+    self.fail = fail
+    self.calls = []
+
+  def __call__(self, interval, events):
+    self.calls.append((interval, events))
+    if self.fail and len(self.calls) % self.fail == 0:
+      raise NotCountedError
+    return {ev: self.rates[ev] * interval for ev in events}
+
+
+def test_schedule():
+  groups = schedule(EVENTS, slots=2)
+  assert len(groups) == 3
+  for group in groups:
+    # free events are everywhere, at most 2 programmable ones
+    assert group[:3] == ['cycles', 'instructions', 'minor-faults']
+    assert len(group) <= 5
+  programmable = [ev for group in groups for ev in group[3:]]
+  assert sorted(programmable) == sorted(set(EVENTS) - {'instructions', 'minor-faults'})
+
+
+def test_schedule_free_events_only():
+  assert schedule(['instructions']) == [['cycles', 'instructions']]
+
+
+def test_measure():
+  stat = Stat()
+  r = measure(stat, EVENTS, interval=600, slots=2, rounds=10)
+  assert len(stat.calls) == 30
+  assert all(interval == 20 for interval, _ in stat.calls)
+  # every event is extrapolated to the whole interval
+  for ev in EVENTS:
+    assert r[ev] == pytest.approx(Stat.rates[ev] * 600)
+  assert r.coverage['instructions'] == 1
+  assert r.coverage['cache-misses'] == pytest.approx(1/3)
+
+
+def test_measure_one_group():
+  stat = Stat()
+  r = measure(stat, ['instructions'], interval=100)
+  assert stat.calls == [(100, ['cycles', 'instructions'])]
+  assert r['instructions'] == 50000
+
+
+def test_measure_not_counted():
+  # the last group is never counted
+  stat = Stat(fail=3)
+  r = measure(stat, EVENTS, interval=600, slots=2, rounds=10)
+  # counts cover the time that was counted at all
+  assert r['instructions'] == pytest.approx(500 * 400)
+  lost = [ev for ev in EVENTS if r[ev] is None]
+  assert len(lost) == 1 and r.coverage[lost[0]] == 0
+  with pytest.raises(NotCountedError):
+    measure(Stat(fail=1), EVENTS, interval=600)
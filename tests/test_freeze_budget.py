@@ -0,0 +1,63 @@
+import pytest
+
+from profile import FreezeBudget
+
+
+class Clock:
+  def __init__(self):
+    self.now = 0.0
+
+  def __call__(self):
+    return self.now
+
+  def sleep(self, t):
+    self.now += t
+
+
+class Task:
+  def __init__(self, name):
+    self.name = name
+    self.tasks = []
+
+  def others(self):
+    return [t for t in self.tasks if t is not self]
+
+
+def tasks(n):
+  r = [Task(i) for i in range(n)]
+  for t in r:
+    t.tasks = r
+  return r
+
+
+def test_freeze_within_budget_is_not_delayed():
+  clock = Clock()
+  budget = FreezeBudget(system=0.1, clock=clock, sleep=clock.sleep)
+  a, b = tasks(2)
+  clock.now = 10
+  assert budget.delay(a, 0.1) == 0
+
+
+def test_over_long_freeze_is_held_back():
+  clock = Clock()
+  budget = FreezeBudget(system=0.1, clock=clock, sleep=clock.sleep)
+  a, b = tasks(2)
+  clock.now = 1
+  assert budget.delay(a, 1) == pytest.approx(8)
+  budget.wait(a, 1)
+  assert clock.now == pytest.approx(9)
+  start = clock.now
+  clock.now += 1
+  budget.account(a, clock.now - start)
+  assert budget.frozen / clock.now <= 0.1 + 1e-9
+
+
+def test_task_budget():
+  clock = Clock()
+  budget = FreezeBudget(system=1, task=0.1, clock=clock, sleep=clock.sleep)
+  a, b, c = tasks(3)
+  clock.now = 10
+  budget.account(a, 1)  # b and c were frozen for 1s, their whole budget
+  assert budget.delay(b, 0.1) > 0  # c would be frozen again
+  clock.now = 20
+  assert budget.delay(b, 0.1) == 0
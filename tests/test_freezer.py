@@ -0,0 +1,59 @@
+from os.path import join
+import pytest
+
+from freezer import CgroupFreezer, Timeout
+
+
+class VM:
+  def __init__(self, pid):
+    self.pid = pid
+
+
+def read(path):
+  with open(path) as fd:
+    return fd.read().strip()
+
+
+@pytest.fixture
+def freezer(tmp_path):
+  """ Freezer on a plain directory, freezing completes immediately. """
+  freezer = CgroupFreezer(root=str(tmp_path), name="test", timeout=0.01)
+  with open(join(freezer.pool, "cgroup.freeze"), 'wt') as fd:
+    fd.write("0")
+  return freezer
+
+
+def test_exclusive_and_shared(freezer):
+  vms = [VM(1), VM(2), VM(3)]
+  freezer.attach(vms)
+  assert freezer.pids == [1, 2, 3]
+  vms[1].exclusive()
+  assert read(join(freezer.solo, "cgroup.procs")) == "2"
+  assert freezer.frozen()
+  vms[1].shared()
+  assert not freezer.frozen()
+  # the exclusive task is back in the pool
+  assert read(join(freezer.pool, "cgroup.procs")) == "2"
+  assert freezer.solo_pid is None
+
+
+def test_exclusive_twice(freezer):
+  freezer.exclusive(1)
+  freezer.exclusive(2)
+  assert freezer.solo_pid == 2
+  assert read(join(freezer.solo, "cgroup.procs")) == "2"
+
+
+def test_cgroup_events(freezer):
+  # a real cgroupfs reports completion in cgroup.events
+  with open(join(freezer.pool, "cgroup.events"), 'wt') as fd:
+    fd.write("populated 1\nfrozen 0\n")
+  with pytest.raises(Timeout):
+    freezer.exclusive(1)
+
+
+def test_release(freezer):
+  freezer.add(1)
+  freezer.release()
+  assert read(join(freezer.root, "cgroup.procs")) == "1"
+  assert freezer.pids == []
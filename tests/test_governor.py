@@ -0,0 +1,71 @@
+import pytest
+
+from governor import Governor, Rejected
+
+
+class Clock:
+  def __init__(self):
+    self.now = 1000.0
+
+  def __call__(self):
+    return self.now
+
+  def sleep(self, t):
+    self.now += t
+
+
+def governor(policy='delay', **kwargs):
+  clock = Clock()
+  return Governor(budget=0.1, window=10, policy=policy, clock=clock, sleep=clock.sleep, **kwargs), clock
+
+
+def test_within_budget():
+  g, clock = governor()
+  g.freeze(['a'], 0.5)
+  clock.now += 0.5
+  g.unfreeze(['a'])
+  assert g.used('a', clock.now) == pytest.approx(0.5)
+  g.freeze(['a'], 0.5)
+  clock.now += 0.5
+  g.unfreeze(['a'])
+  assert g.stats()['delayed'] == 0
+
+
+def test_too_long_freeze_is_rejected():
+  g, _ = governor()
+  with pytest.raises(Rejected):
+    g.freeze(['a'], 2)  # budget is 1s per 10s window
+  assert g.stats()['rejected'] == 1
+
+
+def test_delay_until_budget_frees_up():
+  g, clock = governor()
+  g.freeze(['a'], 1)
+  clock.now += 1
+  g.unfreeze(['a'])
+  start = clock.now
+  g.freeze(['a'], 0.5)
+  waited = clock.now - start
+  assert 0.5 <= waited <= 10
+  assert g.used('a', clock.now) + 0.5 <= g.budget * g.window + 1e-3
+  assert g.stats()['delayed'] == 1
+
+
+def test_reject_policy():
+  g, clock = governor(policy='reject')
+  g.freeze(['a'], 1)
+  clock.now += 1
+  g.unfreeze(['a'])
+  with pytest.raises(Rejected):
+    g.freeze(['a'], 0.5)
+  # other VMs have their own budgets
+  g.freeze(['b'], 0.5)
+
+
+def test_history_slides_out():
+  g, clock = governor(policy='reject')
+  g.freeze(['a'], 1)
+  clock.now += 1
+  g.unfreeze(['a'])
+  clock.now += 10
+  g.freeze(['a'], 1)
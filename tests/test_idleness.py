@@ -0,0 +1,52 @@
+import pytest
+
+from idleness import IdleMonitor
+
+
+class Host:
+  """ Fake clock and /proc/stat with one cpu, loads in percent. """
+  def __init__(self, path, loads):
+    self.path = path
+    self.loads = iter(loads)
+    self.now = 0.0
+    self.busy = self.total = 0
+    self.write()
+
+  def time(self):
+    return self.now
+
+  def sleep(self, t):
+    self.now += t
+    self.busy += next(self.loads)
+    self.total += 100
+    self.write()
+
+  def write(self):
+    # user nice system idle iowait irq softirq steal
+    idle = self.total - self.busy
+    self.path.write_text("cpu  0 0 0 0 0 0 0 0\ncpu0 %s 0 0 %s 0 0 0 0\nintr 0\n"
+                         % (self.busy, idle))
+
+
+@pytest.fixture
+def monitor(tmp_path):
+  def make(loads):
+    host = Host(tmp_path / "stat", loads)
+    # samples every 1/4s, so that the fake clock is exact
+    return IdleMonitor(rate=0.25, path=str(host.path), clock=host.time, sleep=host.sleep)
+  return make
+
+
+def test_waits_for_the_whole_period(monitor):
+  assert monitor([0] * 10).wait(10, period=1) == 1
+
+
+def test_averages_the_window(monitor):
+  # a single spike is averaged out
+  assert monitor([30, 0, 0, 0]).wait(10, period=1) == 1
+  # steady load is not
+  assert monitor([20] * 4 + [5] * 10).wait(10, period=1) == 1.75
+
+
+def test_timeout(monitor):
+  assert monitor([100] * 20).wait(10, period=1, timeout=2) == 2.25
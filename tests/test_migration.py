@@ -0,0 +1,82 @@
+from types import ModuleType
+import sys
+
+import numpy as np
+import pytest
+
+from migration import mean_ipc, recovery, migrate
+from perf.perftool import NotCountedError
+
+
+class VM:
+  bname = 'bench'
+
+  def __str__(self):
+    return 'vm'
+
+
+class Cache:
+  def __init__(self):
+    self.costs = []
+
+  def put_migration(self, bench, cost, recovery):
+    self.costs.append(cost)
+
+
+def fake_qemu(monkeypatch, *results):
+  results = iter(results)
+  qemu = ModuleType('qemu')
+  qemu.ipcistat = lambda vm, **kw: next(results)
+  monkeypatch.setitem(sys.modules, 'qemu', qemu)
+
+
+def test_mean_ipc_of_empty_counters():
+  with pytest.raises(NotCountedError):
+    mean_ipc({'instructions': np.zeros(3, dtype=np.int64),
+              'cycles': np.zeros(3, dtype=np.int64)})
+
+
+def test_recovery():
+  cost, recovered, steady = recovery([0.5]*5 + [1.0]*20, subinterval=10)
+  assert steady == 1
+  assert cost == pytest.approx(0.025)
+  assert recovered == pytest.approx(0.05)
+
+
+def test_move_to_contended_core():
+  # steady slowdown after the move is not a migration cost
+  baseline = 1.0
+  cost, recovered, steady = recovery([0.3]*5 + [0.6]*20, subinterval=10)
+  assert steady == 0.6 < baseline
+  assert cost == pytest.approx(0.025)
+  assert recovered == pytest.approx(0.05)
+
+
+def test_move_to_better_core():
+  # warm-up is a cost even if IPC never drops below the old one
+  baseline = 1.0
+  cost, recovered, steady = recovery([1.0]*5 + [2.0]*20, subinterval=10)
+  assert steady == 2.0 > baseline
+  assert cost == pytest.approx(0.025)
+  assert recovered == pytest.approx(0.05)
+
+
+def test_migrate_not_counted(monkeypatch):
+  zero = np.zeros(5, dtype=np.int64)
+  fake_qemu(monkeypatch, {'instructions': zero, 'cycles': zero})
+  pinned, cache = [], Cache()
+  assert migrate(VM(), [1], cache=cache, pin=pinned.append) is None
+  assert pinned == [[1]]
+  assert cache.costs == []
+
+
+def test_migrate(monkeypatch):
+  before = {'instructions': np.full(5, 100), 'cycles': np.full(5, 100)}
+  after = {'instructions': np.array([25, 0] + [50]*8),
+           'cycles': np.array([100, 0] + [100]*8)}
+  fake_qemu(monkeypatch, before, after)
+  cache = Cache()
+  cost = migrate(VM(), [1], cache=cache, pin=lambda cpus: None)
+  # IPC drops from 1 to 0.5 after the move, only the first subinterval is lost
+  assert cost == pytest.approx(0.005)
+  assert cache.costs == [cost]
@@ -0,0 +1,30 @@
+from perf.perftool import NotCountedError
+
+import numabind
+
+
+class Task:
+  pid = 1
+
+
+def test_parse_cpulist():
+  assert numabind.parse_cpulist("0-3,8\n") == [0, 1, 2, 3, 8]
+
+
+def test_move_pins_when_not_counted(monkeypatch):
+  monkeypatch.setattr(numabind, 'follow', lambda pid, cpus: set())
+  pinned = []
+
+  def stat(interval, events):
+    raise NotCountedError
+
+  assert numabind.move(Task(), [1], pinned.append, stat=stat) is None
+  assert pinned == [[1]]
+
+
+def test_move_reports_remote_loads(monkeypatch):
+  monkeypatch.setattr(numabind, 'follow', lambda pid, cpus: {0})
+  stats = iter([{'node-loads': 10, 'node-load-misses': 5},
+                {'node-loads': 10, 'node-load-misses': 1}])
+  r = numabind.move(Task(), [1], lambda cpus: None, stat=lambda **kw: next(stats))
+  assert r == (0.5, 0.1)
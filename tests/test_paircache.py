@@ -0,0 +1,65 @@
+import pytest
+
+from paircache import PairCache
+
+
+class Task:
+  def __init__(self, bname):
+    self.bname = bname
+
+
+@pytest.fixture
+def cache(tmp_path):
+  return PairCache(path=str(tmp_path / "interference.json"), host="host")
+
+
+def test_get(cache):
+  cache.put('a', 'b', 'sibling', (1.0, 2.0), config="c1")
+  assert cache.get('a', 'b', 'sibling') == (1.0, 2.0)
+  assert cache.get('b', 'a', 'sibling') == (2.0, 1.0)
+  assert cache.get('a', 'b', 'distant') is None
+  assert cache.get('a', 'b', 'sibling', config="c2") is None
+
+
+def test_persistent(cache):
+  cache.put('a', 'b', 'sibling', (1.0, 2.0))
+  assert PairCache(path=cache.path, host="host").get('a', 'b', 'sibling') == (1.0, 2.0)
+  assert PairCache(path=cache.path, host="other").get('a', 'b', 'sibling') is None
+
+
+def test_find_latest_config(cache):
+  cache.put('a', 'b', 'sibling', (1.0, 1.0), config="old")
+  cache.put('a', 'b', 'sibling', (2.0, 2.0), config="new")
+  assert cache.find('sibling', None, 'a', 'b')['ipc'] == [2.0, 2.0]
+  assert cache.find('sibling', "old", 'a', 'b')['ipc'] == [1.0, 1.0]
+  # fields are compared exactly
+  assert cache.find('sib', None, 'a', 'b') is None
+  assert cache.find('sibling', None, 'b') is None
+  with pytest.raises(AssertionError):
+    cache.put('a', 'b', 'sibling', (1.0, 1.0), config="with|separator")
+
+
+def test_isolated(cache):
+  assert cache.isolated('a') is None
+  cache.put_isolated('a', 2.0)
+  assert cache.isolated('a') == 2.0
+  assert cache.get('a', 'a', 'isolated') is None
+
+
+def test_pairs(cache):
+  cache.put_isolated('a', 2.0)
+  cache.put_isolated('b', 1.0)
+  cache.put('a', 'b', 'sibling', (1.0, 0.5))
+  a, b, c = Task('a'), Task('b'), Task('c')
+  assert cache.slowdown('a', 'b') == 0.5
+  assert cache.pairs([a, b, c]) == {(a, b): 1.0}
+
+
+def test_migrations(cache):
+  a, b = Task('a'), Task('b')
+  cache.put_migration('a', 0.1, 0.5)
+  cache.put_migration('a', 0.3, 0.5)
+  assert cache.migration('a') == pytest.approx(0.2)
+  assert cache.migrations([a, b]) == {a: pytest.approx(0.2)}
+  with pytest.raises(AssertionError):
+    cache.put_migration('b', float('nan'), 0.5)
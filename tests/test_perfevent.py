@@ -0,0 +1,50 @@
+from struct import pack
+import pytest
+
+import perfevent
+from perfevent import Group, PerfEventSource
+from perf.perftool import NotCountedError
+
+
+def reader(enabled, running, *values):
+  """ os.read() of a group leader with PERF_FORMAT_GROUP and times. """
+  data = pack("QQQ%dQ" % len(values), len(values), enabled, running, *values)
+  def read(fd, size):
+    assert size == len(data)
+    return data
+  return read
+
+
+def group(read):
+  g = Group(1, ['instructions', 'cycles'], reader=read)
+  g.fds = [3]  # never opened
+  return g
+
+
+def test_read():
+  assert group(reader(100, 100, 10, 20)).read() == {'instructions': 10, 'cycles': 20}
+
+
+def test_read_multiplexed():
+  # the group was on the pmu half of the time
+  assert group(reader(100, 50, 10, 20)).read() == {'instructions': 20, 'cycles': 40}
+
+
+def test_read_never_scheduled():
+  assert group(reader(100, 0, 10, 20)).read() == {'instructions': 0, 'cycles': 0}
+
+
+def test_unknown_event():
+  with pytest.raises(AssertionError):
+    Group(1, ['no-such-event'])
+
+
+def test_no_access(monkeypatch):
+  def perf_event_open(*args):
+    raise perfevent.Error("perf_event_open(pid=1, cpu=-1): Permission denied")
+  monkeypatch.setattr(perfevent, 'perf_event_open', perf_event_open)
+  source = PerfEventSource()
+  with pytest.raises(NotCountedError):
+    source.open(1, ['instructions', 'cycles'])
+  with pytest.raises(NotCountedError):
+    source.read()
@@ -0,0 +1,73 @@
+import pytest
+
+from perf.perftool import NotCountedError
+from perfstream import parse_row, parse, collect, record
+
+
+EVENTS = ['instructions', 'cycles']
+
+OUTPUT = """\
+#           time             counts unit events
+     0.010,100,,instructions,10000,100.00
+     0.010,200,,cycles,10000,100.00
+     0.020,<not counted>,,instructions,0,100.00
+     0.020,400,,cycles,10000,100.00
+     0.030,500,,cycles,10000,100.00
+     0.040,700,,instructions,10000,100.00
+""".splitlines()
+
+
+def test_parse_row():
+  assert parse_row("0.010,100,,instructions,10000,100.00") == (0.01, 100, 'instructions')
+  assert parse_row("0.010,<not supported>,,cycles,0,0") == (0.01, None, 'cycles')
+  assert parse_row("# started on") is None
+
+
+def test_parse():
+  r = list(parse(OUTPUT, EVENTS))
+  assert [i.time for i in r] == [0.01, 0.02, 0.03, 0.04]
+  assert r[0].counts == {'instructions': 100, 'cycles': 200} and not r[0].missing
+  assert r[1].counts['instructions'] == 0 and r[1].missing == {'instructions'}
+  # perf skipped instructions
+  assert r[2].missing == {'instructions'}
+  # the output ended in the middle of the last interval
+  assert r[3].counts == {'instructions': 700, 'cycles': 0}
+  assert r[3].missing == {'cycles'}
+
+
+def test_collect():
+  r = collect(parse(OUTPUT, EVENTS))
+  assert r['cycles'] == [200, 400, 500, 0]
+  assert r.missing == 3
+
+
+def test_collect_stop():
+  r = collect(parse(OUTPUT, EVENTS), stop=lambda r: len(r['cycles']) == 2)
+  assert r['cycles'] == [200, 400]
+
+
+def test_collect_nothing():
+  with pytest.raises(NotCountedError):
+    collect(parse([], EVENTS))
+
+
+def perf(output, ret=0):
+  """ A command that prints output to stderr like perf does. """
+  return "sh -c 'printf \"%s\" >&2; exit %s'" % ("\\n".join(output), ret)
+
+
+def test_record():
+  r = record(perf(OUTPUT[:3]), EVENTS)
+  assert r['instructions'] == [100] and r['cycles'] == [200]
+
+
+def test_record_failed_perf():
+  with pytest.raises(NotCountedError):
+    record(perf(OUTPUT[:3], ret=1), EVENTS)
+  with pytest.raises(NotCountedError):
+    record("/nonexistent/perf", EVENTS)
+
+
+def test_record_nothing():
+  with pytest.raises(NotCountedError):
+    record(perf(["# started on"]), EVENTS)
@@ -0,0 +1,112 @@
+import pytest
+
+from placement import solve, cost, align, limit_moves, moving, Hysteresis
+from placement import pair_cost, estimate_pairs
+
+
+class Topology:
+  """ 4 cores with 2 hyper-threads each """
+  all = list(range(8))
+  no_ht = [0, 1, 2, 3]
+  ht_map = {0: [4], 1: [5], 2: [6], 3: [7], 4: [0], 5: [1], 6: [2], 7: [3]}
+
+
+top = Topology()
+
+
+class Clock:
+  def __init__(self):
+    self.now = 0
+
+  def __call__(self):
+    return self.now
+
+
+def test_solve_separates_worst_pair():
+  tasks = list("abcde")
+  pairs = {('a', 'b'): 10, ('c', 'd'): 0.1}
+  loss, placement = solve(tasks, pairs=pairs, top=top)
+  assert loss < 10
+  assert len(placement) == 5
+  cpus = [cpu for c in placement.values() for cpu in c]
+  assert len(set(cpus)) == 5
+  assert cost(placement, pairs=pairs, top=top) == loss
+
+
+def test_cost_ignores_floating_tasks():
+  pairs = {('a', 'b'): 1}
+  assert cost({'a': [0], 'b': [4]}, pairs=pairs, top=top) == 1
+  assert cost({'a': [0], 'b': list(range(8))}, pairs=pairs, top=top) == 0
+
+
+def test_align_keeps_tasks_in_place():
+  tasks = list("abcd")
+  current = {'a': [4], 'b': [5], 'c': [2], 'd': [3]}
+  _, placement = solve(tasks, degradation=dict.fromkeys(tasks, 0.9), top=top)
+  aligned = align(placement, current, top=top)
+  assert moving(aligned, current) == []
+
+
+def test_align_does_not_change_cost():
+  tasks = list("abcdef")
+  pairs = {('a', 'b'): 1, ('c', 'd'): 1, ('e', 'f'): 1, ('a', 'c'): 0.1}
+  current = {t: [cpu] for t, cpu in zip(tasks, [7, 6, 5, 4, 3, 2])}
+  loss, placement = solve(tasks, pairs=pairs, top=top)
+  aligned = align(placement, current, top=top)
+  assert cost(aligned, pairs=pairs, top=top) == loss
+
+
+def test_limit_moves():
+  current = {t: list(range(8)) for t in "abcd"}  # not pinned
+  placement = {'a': [0], 'b': [1], 'c': [2], 'd': [3]}
+  limited = limit_moves(placement, current, ['d', 'c', 'b', 'a'], 2)
+  assert moving(limited, current) == ['c', 'd']
+
+
+def test_limit_moves_does_not_take_occupied_cpus():
+  current = {'a': [0], 'b': [1]}
+  placement = {'a': [1], 'b': [0]}  # a swap needs both moves
+  assert moving(limit_moves(placement, current, ['a', 'b'], 1), current) == []
+
+
+def test_hysteresis():
+  clock = Clock()
+  h = Hysteresis(threshold=0.1, min_dwell=10, max_moves=2, window=100, clock=clock)
+  assert not h.allow(0.05, ['a'])[0]
+  assert not h.allow(0.2, ['a'], penalty=0.15)[0]
+  assert h.allow(0.2, ['a'])[0]
+  h.moved(['a'])
+  clock.now = 5
+  assert not h.allow(0.2, ['a'])[0]
+  assert h.settled(['a', 'b']) == ['b']
+  assert h.budget() == 1
+  assert not h.allow(0.2, ['b', 'c'])[0]
+  clock.now = 200
+  assert h.budget() == 2
+  assert h.allow(0.2, ['a', 'b'])[0]
+
+
+def test_estimate_uses_pair_cost():
+  # both lose 0.5*0.5 next to each other, same as a measured pair
+  pairs = estimate_pairs({'a': 0.5, 'b': 0.5})
+  assert pairs['a', 'b'] == pair_cost(0.75, 0.75) == 0.5
+
+
+def test_cost_of_floating_tasks_is_measured():
+  degradation = {'a': 0.8, 'b': 0.9}
+  floating = {'a': list(range(8)), 'b': list(range(8))}
+  assert cost(floating, degradation=degradation, top=top) == pytest.approx(0.3)
+
+
+def test_unpinned_tasks_get_relocated():
+  # the same decision chain as perforator.online() on a fresh host
+  tasks = list("abcd")
+  degradation = {'a': 0.6, 'b': 0.7, 'c': 0.95, 'd': 0.9}
+  current = {t: list(range(8)) for t in tasks}
+  old = cost(current, degradation=degradation, top=top)
+  new, placement = solve(tasks, degradation=degradation, top=top)
+  placement = align(placement, current, top=top)
+  tomove = moving(placement, current)
+  assert sorted(tomove) == tasks
+  h = Hysteresis(threshold=0.05, min_dwell=10, max_moves=4, window=100, clock=Clock())
+  assert h.allow(old - new, tomove)[0]
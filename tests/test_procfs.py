@@ -0,0 +1,75 @@
+import os
+import pytest
+
+from procfs import ProcSampler, CLK_TCK, stat_fields, pid_ticks
+
+
+class Clock:
+  def __init__(self):
+    self.now = 100.0
+
+  def __call__(self):
+    return self.now
+
+
+def write_stat(proc, pid, comm, ticks, start=1000, tid=None):
+  path = proc / str(pid)
+  if tid is not None:
+    path = path / "task" / str(tid)
+  path.mkdir(parents=True, exist_ok=True)
+  # state, ppid ... utime is the 14th field, stime the 15th, starttime the 22nd
+  fields = ["S"] + ["0"] * 10 + [str(ticks), "0"] + ["0"] * 6 + [str(start)] + ["0"] * 10
+  (path / "stat").write_text("%s (%s) %s\n" % (tid or pid, comm, " ".join(fields)))
+
+
+def test_stat_fields(tmp_path):
+  write_stat(tmp_path, 7, "a) (b", 42)
+  fields = stat_fields(str(tmp_path / "7" / "stat"))
+  assert fields[0] == b"S" and int(fields[11]) == 42
+  assert pid_ticks(os.getpid()) >= 0
+
+
+@pytest.fixture
+def proc(tmp_path):
+  write_stat(tmp_path, 1, "init", 0)
+  write_stat(tmp_path, 2, "my (odd) name", 0)
+  return tmp_path
+
+
+def test_sample(proc):
+  clock = Clock()
+  sampler = ProcSampler(proc=str(proc), clock=clock)
+  assert sampler.sample() == {}  # the first pass only remembers ticks
+  assert sampler.name(2) == "my (odd) name"
+  clock.now += 1
+  write_stat(proc, 1, "init", CLK_TCK // 2)
+  write_stat(proc, 2, "my (odd) name", CLK_TCK)
+  assert sampler.sample() == {1: pytest.approx(50), 2: pytest.approx(100)}
+
+
+def test_restarted_and_dead_pids(proc):
+  clock = Clock()
+  sampler = ProcSampler([1, 2, 3], proc=str(proc), clock=clock)
+  sampler.sample()
+  clock.now += 1
+  # pid 1 was reused by another process, pid 2 is gone, pid 3 is new
+  write_stat(proc, 1, "other", CLK_TCK, start=2000)
+  (proc / "2" / "stat").unlink()
+  write_stat(proc, 3, "new", CLK_TCK)
+  assert sampler.sample() == {}
+  assert sampler.name(1) == "other"
+  assert sampler.name(2) == "?"
+  sampler.untrack(3)
+  clock.now += 1
+  assert sampler.sample() == {1: 0}
+
+
+def test_threads(proc):
+  clock = Clock()
+  write_stat(proc, 5, "worker", 0, tid=5)
+  write_stat(proc, 5, "worker", 0, tid=6)
+  sampler = ProcSampler([5], threads=True, proc=str(proc), clock=clock)
+  sampler.sample()
+  clock.now += 2
+  write_stat(proc, 5, "worker", CLK_TCK, tid=6)
+  assert sampler.sample() == {5: 0, 6: pytest.approx(50)}
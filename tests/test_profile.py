@@ -0,0 +1,23 @@
+import os
+
+import perfevent
+import profile
+from profile import Task, Thread
+
+
+def test_falls_back_to_perf(monkeypatch):
+  def perf_event_open(*args):
+    raise perfevent.Error("perf_event_open(pid=1, cpu=-1): Permission denied")
+  monkeypatch.setattr(perfevent, 'perf_event_open', perf_event_open)
+  monkeypatch.setattr(profile.cfg, 'counters', 'native')
+  counted = []
+  monkeypatch.setattr(profile, 'ipc', lambda pid, time: counted.append(pid) or 1.5)
+  monkeypatch.setattr(Task, 'tasks', [])
+
+  task = Task(os.getpid(), 'test')
+  thread = Thread(os.getpid(), task, 'thread')
+  assert task.ipc() == 1.5
+  assert thread.ipc() == 1.5
+  # perf counts the thread as a part of its task
+  assert counted == [task.pid, task.pid]
+  assert task.counters is False
@@ -0,0 +1,59 @@
+import ready
+from ready import wait_for, booted, running, wait_dead
+
+
+class Clock:
+  def __init__(self):
+    self.now = 0.0
+
+  def __call__(self):
+    return self.now
+
+  def sleep(self, t):
+    self.now += t
+
+
+class Pipe:
+  def __init__(self, ret=None):
+    self.ret = ret
+
+  def poll(self):
+    return self.ret
+
+
+class VM:
+  def __init__(self, pid=1, addr=None, pipe=None):
+    self.pid = pid
+    self.addr = addr
+    self.pipe = pipe
+
+
+def test_returns_when_ready():
+  clock = Clock()
+  probes = iter([False, False, True])
+  assert wait_for(lambda: next(probes), 10, poll=0.25, clock=clock, sleep=clock.sleep) == 0.5
+
+
+def test_gives_up():
+  clock = Clock()
+  assert wait_for(lambda: False, 1, poll=0.25, clock=clock, sleep=clock.sleep) == 1.25
+
+
+def test_booted(monkeypatch):
+  assert not booted(VM(pid=None))
+  assert booted(VM())  # nothing to probe
+  monkeypatch.setattr(ready, 'reachable', lambda addr: addr == "10.0.0.1")
+  assert booted(VM(addr="10.0.0.1"))
+  assert not booted(VM(addr="10.0.0.2"))
+
+
+def test_running(monkeypatch):
+  monkeypatch.setattr(ready, 'cpu_usage', lambda pid: 90 if pid == 1 else 5)
+  assert not running(VM(pipe=None))
+  assert not running(VM(pipe=Pipe(ret=0)))  # benchmark exited
+  assert running(VM(pipe=Pipe()))
+  assert not running(VM(pid=2, pipe=Pipe()))  # still idle
+
+
+def test_wait_dead():
+  assert wait_dead([VM(pid=None)], timeout=1) < 0.1
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from ring import Ring
+
+
+@pytest.fixture
+def ring(tmp_path):
+  ring = Ring.create('test', keys=['a', 'b'], fields=['ipc', 'load'], slots=4, base=str(tmp_path))
+  yield ring
+  ring.close()
+
+
+def test_read_write(ring, tmp_path):
+  reader = Ring.open('test', base=str(tmp_path))
+  assert reader.keys == ['a', 'b'] and reader.fields == ['ipc', 'load']
+  ring.write(0, [1.0, 2.0], ts=10)
+  ring.write(1, [3.0, 4.0], ts=11)
+  records, since = reader.read()
+  assert since == 2
+  assert records['key'].tolist() == [0, 1]
+  assert records['values'].tolist() == [[1, 2], [3, 4]]
+  records, since = reader.read(since)
+  assert len(records) == 0 and since == 2
+  assert reader.latest() == {'a': (10, {'ipc': 1, 'load': 2}),
+                             'b': (11, {'ipc': 3, 'load': 4})}
+  reader.close()
+
+
+def test_overwritten_records_are_lost(ring):
+  for i in range(6):
+    ring.write(0, [i, i])
+  records, since = ring.read(0)
+  assert since == 6
+  assert records['values'][:, 0].tolist() == [2, 3, 4, 5]
+
+
+def test_unlink(ring, tmp_path):
+  ring.unlink()
+  assert not list(tmp_path.iterdir())
+  ring.write(0, [1, 1])  # the mapping is still usable
+  assert len(ring.read()[0]) == 1
@@ -0,0 +1,58 @@
+from statistics import mean, variance
+import pytest
+
+from sequential import Welford, Sequential, ci_student
+
+
+def welford(values):
+  w = Welford()
+  for v in values:
+    w.add(v)
+  return w
+
+
+def test_welford():
+  values = [1.0, 2.0, 4.0, 8.0]
+  w = welford(values)
+  assert w.mean == pytest.approx(mean(values))
+  assert w.variance == pytest.approx(variance(values))
+  assert welford([1.0]).variance == float('inf')
+
+
+def test_ci_student():
+  assert ci_student(welford([1.0])) == float('inf')
+  assert ci_student(welford([0.0, 0.0])) == float('inf')
+  assert ci_student(welford([1.0, 1.0, 1.0])) == 0
+  # wider intervals for more confidence and noisier data
+  noisy = welford([0.5, 1.5, 1.0, 0.8])
+  assert ci_student(noisy, 0.99) > ci_student(noisy, 0.9) > 0
+  assert ci_student(welford([0.9, 1.1, 1.0, 1.0])) < ci_student(noisy)
+
+
+def test_stops_when_precise():
+  seq = Sequential(precision=0.05, minnum=3)
+  values = []
+  for v in [1.0, 1.0]:
+    values.append(v)
+    seq.feed('vm', 'shared', values)
+  assert not seq.done('vm')  # below minnum
+  values.append(1.0)
+  seq.feed('vm', 'shared', values)
+  assert seq.num('vm') == 3
+  assert seq.done('vm')
+
+
+def test_all_series_count():
+  seq = Sequential(precision=0.05, minnum=3)
+  seq.feed('vm', 'shared', [1.0] * 3)
+  seq.feed('vm', 'frozen', [1.0, 2.0, 3.0])
+  assert not seq.done('vm')
+  assert seq.pending(['vm']) == ['vm']
+
+
+def test_maxnum():
+  seq = Sequential(precision=0.01, minnum=3, maxnum=5)
+  seq.feed('vm', 'shared', [1.0, 2.0, 3.0, 1.0])
+  assert not seq.done('vm')
+  seq.feed('vm', 'shared', [1.0, 2.0, 3.0, 1.0, 2.0])
+  assert seq.done('vm')
@@ -0,0 +1,80 @@
+import pytest
+from threading import Thread
+
+from store import Store, label
+from subsamples import Subsamples
+
+
+class VM:
+  def __init__(self, name, bname):
+    self.name = name
+    self.bname = bname
+
+
+def test_round_trip(tmp_path):
+  path = str(tmp_path / "run.store")
+  store = Store(path, 'w')
+  store.set_meta(f='test', fargs={})
+  r = store.results('isolated')
+  r['matrix'].append(1.5)
+  r['matrix'].append(2.5)
+  r['blosc'].append({'instructions': 10, 'cycles': [1, 2, 3]})
+  r['blosc'].append({'instructions': 20, 'cycles': [4]})
+  store.results('raw')['x'].append(Subsamples.from_columns({'instructions': [1, 2], 'cycles': [3, 4]}))
+  store.set_result({'answer': 42})
+  store.close()
+
+  store = Store(path)
+  assert store.meta.f == 'test'
+  assert store.result == {'answer': 42}
+  assert list(store['isolated/matrix']) == [1.5, 2.5]
+  blosc = store['isolated/blosc']
+  assert list(blosc['instructions']) == [10, 20]
+  assert [list(c) for c in blosc['cycles']] == [[1, 2, 3], [4]]
+  assert list(store.tree().raw.x['cycles'][0]) == [3, 4]
+
+
+def test_int_column_is_promoted(tmp_path):
+  path = str(tmp_path / "run.store")
+  store = Store(path, 'w')
+  store.write('s', 1)
+  store.write('s', 2.5)
+  store.write('s', 3)
+  store.write('mixed', {'x': [1, 2.5]})
+  store.close()
+  assert list(Store(path)['s']) == [1.0, 2.5, 3.0]
+  assert list(Store(path)['mixed']['x'][0]) == [1.0, 2.5]
+
+
+def test_vms_with_the_same_benchmark(tmp_path):
+  vm0, vm1 = VM('vm0', 'matrix'), VM('vm1', 'matrix')
+  assert label(vm0) != label(vm1)
+  assert label((vm0, 'blosc')) == 'matrix@vm0-blosc'
+
+
+def test_concurrent_writers(tmp_path):
+  path = str(tmp_path / "run.store")
+  store = Store(path, 'w')
+
+  def writer(i):
+    for j in range(100):
+      store.write('series%s' % i, j)
+
+  threads = [Thread(target=writer, args=(i,)) for i in range(8)]
+  for t in threads:
+    t.start()
+  for t in threads:
+    t.join()
+  store.close()
+  store = Store(path)
+  assert len({col for _, col in store.columns.values()}) == 8
+  for i in range(8):
+    assert list(store['series%s' % i]) == list(range(100))
+
+
+def test_new_store_refuses_existing(tmp_path):
+  path = str(tmp_path / "s.store")
+  Store(path, 'x').close()
+  with pytest.raises(FileExistsError):
+    Store(path, 'x')
+  Store(path, 'w').close()  # appending is explicit
@@ -0,0 +1,39 @@
+import numpy as np
+import pickle
+
+from subsamples import Subsamples
+
+
+def sample():
+  return Subsamples.from_columns({'instructions': [10, 0, 30, 40],
+                                  'cycles': [10, 20, 0, 40],
+                                  'cache-misses': [1, 2, 3, 0]})
+
+
+def test_keeps_all_events():
+  r = sample()
+  assert r.keys() == ['instructions', 'cycles', 'cache-misses']
+  assert r['cache-misses'].tolist() == [1, 2, 3, 0]
+
+
+def test_invalid_fields_do_not_spoil_rows():
+  r = sample()
+  assert r.counted('instructions', 'cycles').tolist() == [True, False, False, True]
+  # instructions of the row without cycles are still there
+  assert r['instructions'].tolist() == [10, 0, 30, 40]
+  assert r.mean('cache-misses') == 2
+
+
+def test_ipc():
+  r = sample()
+  ipc = r.ipc()
+  assert ipc[0] == ipc[3] == 1
+  assert np.isnan(ipc[1]) and np.isnan(ipc[2])
+  assert r.total_ipc() == 1
+  assert r.skip(1).total_ipc() == 1
+  assert r.skip(4).total_ipc() is None
+
+
+def test_pickle():
+  r = pickle.loads(pickle.dumps(sample()))
+  assert r.columns() == sample().columns()
@@ -0,0 +1,59 @@
+import json
+import numpy as np
+
+from transient import mser, curve, Transient
+
+
+def warmup(n=100, transient=20, seed=0):
+  """ IPC that starts low and recovers after `transient` subintervals. """
+  rng = np.random.RandomState(seed)
+  x = np.ones(n) + rng.normal(0, 0.01, n)
+  x[:transient] -= np.linspace(0.5, 0, transient)
+  return x
+
+
+def removed(skip, transient=20, limit=50):
+  """ Most of the transient is dropped, never more than the limit. """
+  return transient - 5 <= skip <= limit
+
+
+def test_mser_finds_transient():
+  assert removed(mser(warmup()))
+  assert mser(warmup(), limit=0.1) <= 10
+  assert mser(np.ones(100)) == 0
+
+
+def test_mser_batches():
+  assert mser(warmup(), batch=5) % 5 == 0
+  assert removed(mser(warmup(), batch=5))
+  assert mser([1, 2, 3], batch=1) == 0  # too short
+
+
+def test_mser_ignores_nan():
+  x = warmup()
+  x[50:55] = np.nan
+  assert removed(mser(x))
+
+
+def test_curve():
+  c = curve([np.array([1.0, 2.0, 3.0]), np.array([3.0, np.nan])])
+  assert c.tolist() == [2.0, 2.0]
+
+
+def sample(ipc):
+  cycles = np.full(len(ipc), 1000)
+  return {'instructions': (np.asarray(ipc) * 1000).astype(int), 'cycles': cycles}
+
+
+def test_transient(tmp_path):
+  t = Transient(subinterval=2, probes=3)
+  key = ('vm', 'bench')
+  assert not t.known(key) and t.skip(key) is None
+  t.learn(key, [sample(warmup(seed=i)) for i in range(3)])
+  assert t.known(key)
+  skip = t.skip(key)
+  assert removed(skip)
+  assert t.delay(key) == skip * 2 / 1000
+  path = tmp_path / "transient.json"
+  t.export(str(path))
+  assert json.loads(path.read_text())[str(key)]['samples'] == 3
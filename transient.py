@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+""" Post-freeze transient.
+
+    Right after co-runners are frozen a VM still runs in caches and
+    memory bandwidth they disturbed, so the first subintervals of a
+    measurement do not show its isolated performance yet. The end of
+    the transient is found in per-subinterval IPC with MSER (marginal
+    standard error rule): the truncation point d that minimizes
+    var(x[d:]) / (n-d), i.e. the standard error of what is left.
+    Curves of several measurements of the same VM and benchmark are
+    averaged first, so the detection is not fooled by noise.
+"""
+
+from collections import defaultdict
+from subsamples import Subsamples
+import numpy as np
+import warnings
+import json
+
+
+def nanmean(a, axis):
+  with warnings.catch_warnings():
+    warnings.simplefilter('ignore', RuntimeWarning)  # all-NaN rows stay NaN
+    return np.nanmean(a, axis=axis)
+
+
+def mser(x, batch=1, limit=0.5):
+  """ Number of elements of x to drop. Elements are averaged in batches
+      first (MSER-5 is batch=5), d is searched in the first `limit` of x.
+  """
+  x = np.asarray(x, dtype=float)
+  n = len(x) // batch
+  if n < 4:
+    return 0
+  x = x[:n*batch].reshape(n, batch)
+  x = nanmean(x, axis=1)
+  valid = ~np.isnan(x)
+  x = np.where(valid, x, 0)
+  # sums over x[d:] for every d
+  cnt = np.cumsum(valid[::-1])[::-1]
+  s1 = np.cumsum(x[::-1])[::-1]
+  s2 = np.cumsum((x*x)[::-1])[::-1]
+  last = int(n * limit) + 1
+  cnt, s1, s2 = cnt[:last], s1[:last], s2[:last]
+  with np.errstate(divide='ignore', invalid='ignore'):
+    r = (s2 - s1*s1/cnt) / (cnt*cnt)
+  r[cnt < 2] = np.inf
+  return int(np.argmin(r)) * batch
+
+
+def curve(series):
+  """ Element-wise mean of series, truncated to the shortest one. """
+  n = min(len(s) for s in series)
+  return nanmean(np.vstack([s[:n] for s in series]), axis=0)
+
+
+class Transient:
+  """ Transients learned per key, e.g. (vm, benchmark).
+      subinterval is in ms, probes is how many measurements to learn from.
+  """
+
+  def __init__(self, subinterval=2, probes=5, length=100, batch=1):
+    self.subinterval = subinterval
+    self.probes = probes
+    self.length = length  # of a probe, ms
+    self.batch = batch
+    self.curves = defaultdict(list)  # key -> [IPC per subinterval]
+    self.skips = {}
+
+  def learn(self, key, samples):
+    """ Learn from Subsamples (or perf columns) of measurements that
+        started right after the freeze.
+    """
+    curves = self.curves[key]
+    for sample in samples:
+      ipc = Subsamples.from_columns(sample, ['instructions', 'cycles']).ipc()
+      if len(ipc) and not np.isnan(ipc).all():
+        curves.append(ipc)
+    self.skips.pop(key, None)
+
+  def known(self, key):
+    return key in self.curves
+
+  def skip(self, key):
+    """ Subintervals to skip, None if nothing was learned. """
+    if not self.curves.get(key):
+      return None
+    if key not in self.skips:
+      self.skips[key] = mser(curve(self.curves[key]), self.batch)
+    return self.skips[key]
+
+  def delay(self, key):
+    """ The same in seconds. """
+    skip = self.skip(key)
+    return None if skip is None else skip * self.subinterval / 1000
+
+  def stats(self):
+    return {str(key): dict(skip=self.skip(key), delay=self.delay(key),
+                           samples=len(self.curves[key]))
+            for key in self.curves}
+
+  def report(self):
+    print("post-freeze transients ({}ms subintervals):".format(self.subinterval))
+    for key, st in sorted(self.stats().items()):
+      if st['skip'] is None:
+        print("  {}: not learned".format(key))
+      else:
+        print("  {key}: skip {skip}, delay {ms:.0f}ms, from {samples} measurements"
+              .format(key=key, ms=st['delay']*1000, **st))
+
+  def export(self, path):
+    with open(path, 'wt') as fd:
+      json.dump(self.stats(), fd, indent=1, sort_keys=True)